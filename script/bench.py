@@ -0,0 +1,174 @@
+'''
+构建流水线的基准测试
+
+    python bench.py --scale medium              运行并与基准结果比较
+    python bench.py --scale medium --save       运行并保存为基准结果
+    python bench.py --scale medium --profile    输出一次构建的分类型分阶段统计
+
+各阶段分别计时 取repeat次中的最小值
+耗时超过基准结果(1+threshold)倍的阶段视为退化 此时返回非0
+'''
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from dataclasses import asdict
+from lib.base import *
+from lib.build import BuildOptions, encode, run_stages, write_all
+from lib.shard import open_db
+from lib.synthetic import SyntheticScales, generate
+from lib.writer import FileWriter
+
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baseline.json')
+
+# 低于该耗时的阶段只受噪声影响 不参与比较
+MIN_TIME = 0.005
+
+
+def measure(func: Callable[[], Any], repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - begin
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run(scale: str, options: BuildOptions, repeat: int) -> dict[str, Any]:
+    Resource.clear()
+    begin = time.perf_counter()
+    resources = generate(SyntheticScales[scale])
+    timings = {'generate': time.perf_counter() - begin}
+
+    # 阶段记录(如@scripts)需要在serialize之前生成
+    timings['stages'] = measure(lambda: run_stages(resources, options), repeat)
+
+    with use_output_options(options.output()):
+        timings['serialize'] = measure(lambda: [res.serialize() for res in resources], repeat)
+        records = [(res.res_id, encode(res), res.cache == True and 1 or 0) for res in resources]
+    size = sum(len(data) + 1 for _, data, _ in records)
+
+    path = tempfile.mkdtemp(prefix='tp-bench-')
+    try:
+        # 数据与索引分开计时 索引在close时写入
+        write_time = index_time = None
+        for _ in range(repeat):
+            writer = FileWriter(path, options.index)
+            begin = time.perf_counter()
+            writer.write_many(records)
+            middle = time.perf_counter()
+            writer.close()
+            finish = time.perf_counter()
+            write_time = min(write_time or middle - begin, middle - begin)
+            index_time = min(index_time or finish - middle, finish - middle)
+        timings['write'] = write_time
+        timings['index'] = index_time
+
+        # 最后构建 read读取的是write_all的输出
+        timings['write_all'] = measure(lambda: write_all(path, resources, options), repeat)
+
+        def read():
+            with open_db(path, capacity=0) as db:
+                for id in db.ids():
+                    db.get(id)
+        timings['read'] = measure(read, repeat)
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+    return {
+        'resources': len(resources),
+        'bytes': size,
+        'timings': timings,
+    }
+
+
+def compare(result: dict[str, Any], baseline: dict[str, Any], threshold: float) -> list[str]:
+    regressions = []
+    for stage, elapsed in result['timings'].items():
+        if stage == 'generate' or stage not in baseline['timings']:
+            continue
+        base = baseline['timings'][stage]
+        if max(base, elapsed) < MIN_TIME:
+            continue
+        if elapsed > base * (1 + threshold):
+            regressions.append('%s: %.4fs -> %.4fs (+%.0f%%)' % (stage, base, elapsed, (elapsed / base - 1) * 100))
+    return regressions
+
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark the content build pipeline')
+    parser.add_argument('--scale', choices=[*SyntheticScales], default='medium')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--index', choices=['json', 'binary'], default='json')
+    parser.add_argument('--packed-tables', action='store_true')
+    parser.add_argument('--attribute-ids', action='store_true')
+    parser.add_argument('--script-table', action='store_true')
+    parser.add_argument('--constant-pool', action='store_true')
+    parser.add_argument('--entry-stacking', action='store_true')
+    parser.add_argument('--equipment-tree', action='store_true')
+    parser.add_argument('--material-prefix', action='store_true')
+    parser.add_argument('--shards', action='store_true')
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--threshold', type=float, default=0.1)
+    parser.add_argument('--save', action='store_true')
+    parser.add_argument('--json', action='store_true', help='print the result as JSON')
+    parser.add_argument('--profile', action='store_true', help='print a per-type, per-stage build profile')
+    args = parser.parse_args(argv)
+
+    options = BuildOptions(index=args.index, packed_tables=args.packed_tables, attribute_ids=args.attribute_ids,
+                           script_table=args.script_table, constant_pool=args.constant_pool,
+                           entry_stacking=args.entry_stacking, equipment_tree=args.equipment_tree,
+                           material_prefix=args.material_prefix, shards=args.shards)
+    default = asdict(BuildOptions())
+    key = ','.join([args.scale, *('%s=%s' % (k, v) for k, v in asdict(options).items() if default[k] != v)])
+
+    if args.profile:
+        Resource.clear()
+        resources = generate(SyntheticScales[args.scale])
+        path = tempfile.mkdtemp(prefix='tp-bench-')
+        try:
+            options.profile = True
+            print(write_all(path, resources, options).to_json())
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+        return 0
+
+    result = run(args.scale, options, args.repeat)
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print('%s  %d resources  %.2f MB' % (key, result['resources'], result['bytes'] / 1e6))
+        for stage, elapsed in result['timings'].items():
+            print('  %-10s %8.4fs' % (stage, elapsed))
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as handle:
+            baselines = json.load(handle)
+
+    if args.save:
+        baselines[key] = result
+        with open(args.baseline, 'w') as handle:
+            json.dump(baselines, handle, indent=2)
+        print('baseline saved to %s' % args.baseline)
+        return 0
+
+    if key not in baselines:
+        print('no baseline for %s' % key)
+        return 0
+
+    regressions = compare(result, baselines[key], args.threshold)
+    for line in regressions:
+        print('REGRESSION %s' % line)
+    return regressions and 1 or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
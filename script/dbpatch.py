@@ -0,0 +1,49 @@
+'''
+db输出的增量补丁
+
+    python dbpatch.py diff <base> <target> <patch>     生成从base到target的补丁
+    python dbpatch.py apply <path> <patch>             把补丁应用到path中的输出
+
+base/target/path都是write_all的输出目录 格式见lib.patch
+'''
+
+import argparse
+import sys
+from lib.patch import COMPACT_RATIO, PatchStats, apply_patch, write_patch
+
+
+def report(action: str, stats: PatchStats):
+    print('%s  +%d ~%d -%d  %.4fs' % (action, stats.added, stats.changed, stats.removed, stats.time))
+    ratio = stats.size and stats.db_size / stats.size or 0
+    print('  patch %d bytes  full db %d bytes  (%.0fx)' % (stats.size, stats.db_size, ratio))
+    if stats.compacted:
+        print('  %d segments compacted' % stats.compacted)
+
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(description='Create and apply delta patches between db builds')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p_diff = commands.add_parser('diff')
+    p_diff.add_argument('base')
+    p_diff.add_argument('target')
+    p_diff.add_argument('patch')
+    p_diff.add_argument('--compression', choices=['zlib', 'lzma', 'none'], default='zlib')
+
+    p_apply = commands.add_parser('apply')
+    p_apply.add_argument('path')
+    p_apply.add_argument('patch')
+    p_apply.add_argument('--compact', type=float, default=COMPACT_RATIO,
+                         help='rewrite a segment when this fraction of it is dead, negative to never')
+    args = parser.parse_args(argv)
+
+    if args.command == 'diff':
+        compression = args.compression != 'none' and args.compression or None
+        report('diff', write_patch(args.base, args.target, args.patch, compression))
+    else:
+        report('apply', apply_patch(args.path, args.patch, args.compact if args.compact >= 0 else None))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -3,6 +3,19 @@ from dataclasses import dataclass
 from lib.base import *
 from lib.attribute import *
 from lib.entry import *
+from lib.sampler import alias_table
+
+
+def ser_alias(values: Sequence[Mapping[str, Any]], where: str = '?'):
+    '''
+    池的别名表 运行时O(1)抽取 见lib.sampler
+    '''
+    weights = [v['weight'] for v in values]
+    if sum(weights) <= 0:
+        raise Exception('%s => total weight must greater than 0' % where)
+
+    prob, alias = alias_table(weights)
+    return {'p': prob, 'a': alias}
 
 
 @dataclass
@@ -16,33 +29,43 @@ class RandomAttribute(Serializer):
     # 属性值列表
     values: AttributesList
 
+    # 抽取权重 同一池中按权重比例抽取
+    weight: number = 1
+
     @clean()
     def serialize(self, level: int) -> dict[str, Any]:
         return {
             **super().serialize(),
             'random_id': ser_int(self.random_id, min=0, max=65535, where=self.here('random_id')),
-            'attribute': ser_attribute(self.attribute, self.here('attribute')),
+            'attribute': attribute_key(ser_attribute(self.attribute, self.here('attribute'))),
             'values': ser_attributes_list(self.values, level, self.here('values')),
+            'weight': ser_num(self.weight, min=0, where=self.here('weight')),
         }
 
 
 @dataclass(kw_only=True)
-class RandomAttributes:
+class RandomAttributes(Resource):
+    # 最大等级 决定每个值列表的长度
+    max_level: int
+
     # 值列表
     values: Sequence[RandomAttribute]
 
     @clean()
-    def serialize(self, level: int) -> dict[str, Any]:
-        return {
+    def serialize(self) -> dict[str, Any]:
+        data = {
             **super().serialize(),
-            'values': self._ser_values(level),
+            'max_level': ser_int(self.max_level, min=0, max=99, where=self.here('max_level')),
+            'values': self._ser_values(self.max_level),
         }
+        data['alias'] = ser_alias(data['values'], self.here('values.(item).weight'))
+        return data
 
     def _ser_values(self, level: int):
         if not isinstance(self.values, Sequence):
             raise Exception('%s => must be a Sequence' % self.here('values'))
 
-        if len(list) <= 0:
+        if len(self.values) <= 0:
             raise Exception('%s => size must greater than 0' % self.here('values'))
 
         for v in self.values:
@@ -57,7 +80,7 @@ class RandomAttributes:
 
 
 @dataclass
-class RandomEntry:
+class RandomEntry(Serializer):
     # 名称 在RandomEntries内唯一
     random_id: int
 
@@ -67,33 +90,43 @@ class RandomEntry:
     # 属性值列表
     values: EntriesList
 
+    # 抽取权重 同一池中按权重比例抽取
+    weight: number = 1
+
     @clean()
     def serialize(self, level: int) -> dict[str, Any]:
         return {
             **super().serialize(),
             'random_id': ser_int(self.random_id, min=0, max=65535, where=self.here('random_id')),
-            'entry': ser_res_id(self.attribute, Entry, self.here('entry')),
+            'entry': ser_res_id(self.entry, Entry, self.here('entry')),
             'values': ser_entries_list(self.values, level, self.here('values')),
+            'weight': ser_num(self.weight, min=0, where=self.here('weight')),
         }
 
 
 @dataclass(kw_only=True)
-class RandomEntries:
+class RandomEntries(Resource):
+    # 最大等级 决定每个值列表的长度
+    max_level: int
+
     # 值列表
     values: Sequence[RandomEntry]
 
     @clean()
-    def serialize(self, level: int) -> dict[str, Any]:
-        return {
+    def serialize(self) -> dict[str, Any]:
+        data = {
             **super().serialize(),
-            'values': self._ser_values(level),
+            'max_level': ser_int(self.max_level, min=0, max=99, where=self.here('max_level')),
+            'values': self._ser_values(self.max_level),
         }
+        data['alias'] = ser_alias(data['values'], self.here('values.(item).weight'))
+        return data
 
     def _ser_values(self, level: int):
         if not isinstance(self.values, Sequence):
             raise Exception('%s => must be a Sequence' % self.here('values'))
 
-        if len(list) <= 0:
+        if len(self.values) <= 0:
             raise Exception('%s => size must greater than 0' % self.here('values'))
 
         for v in self.values:
@@ -106,6 +139,9 @@ class RandomEntries:
     def find(res_id: str, where: str = '?') -> RandomEntries:
         return Resource.find(res_id, RandomEntries, where)
 
+    def references(self) -> list[ResID]:
+        return [v.entry for v in self.values]
+
 
 @dataclass(kw_only=True)
 class Accessory(Resource):
@@ -141,24 +177,27 @@ class Accessory(Resource):
     def find(res_id: str, where: str = '?') -> Accessory:
         return Resource.find(res_id, Accessory, where)
 
-    @clean()
-    def serialize(self) -> dict[str, Any]:
+    def references(self) -> list[ResID]:
+        refs = [key for key in self.values if not is_attribute(key) and key != Slots]
+        refs.extend(self.random_values)
+        return refs
 
-        return {
-            **super().serialize(),
-            'max_level': ser_int(self.max_level, min=0, max=99, where=self.here('max_level')),
-            **self._ser_values(),
-            **self._ser_random_values(),
-            'name': ser_str(self.name, self.here('name')),
-            'rare': ser_rare_level(self.rare, self.here('rare')),
-            'icon': ser_str(self.icon, self.here('icon')),
-        }
+    _schema_ = (
+        rule('max_level', ser_int, min=0, max=99),
+        method(None, '_ser_values'),
+        method(None, '_ser_random_values'),
+        rule('name', ser_str),
+        rule('rare', ser_rare_level),
+        rule('icon', ser_str),
+    )
 
     @clean(None, {})
     def _ser_values(self):
         if not isinstance(self.values, Mapping):
             raise Exception('%s => must be a Mapping' % self.here('values'))
 
+        where = self.here('values.(value)')
+
         attributes = {}
         slots = None
         buffs = {}
@@ -166,22 +205,19 @@ class Accessory(Resource):
 
         for key, list in self.values.items():
             if is_attribute(key):
-                attributes[key] = ser_attributes_list(
-                    list, self.max_level, self.here('values.(value)'))
+                attributes[key] = ser_attributes_list(list, self.max_level, where)
             elif key == Slots:
-                slots = ser_slots_list(list, self.max_level, self.here('values.(value)'))
+                slots = ser_slots_list(list, self.max_level, where)
             elif Resource.is_id(key, Entry):
-                entries[key] = ser_entries_list(
-                    list, self.max_level, self.here('values.(value)'))
+                entries[key] = ser_entries_list(list, self.max_level, where)
             elif Resource.is_id(key, Buff):
-                buffs[key] = ser_buffs_list(
-                    list, self.max_level, self.here('values.(value)'))
+                buffs[key] = ser_buffs_list(list, self.max_level, Buff.find(key), where)
             else:
                 raise Exception('%s => must be an Attribute|"Slots"|Entries|BuffID' %
                                 self.here('values.(key)'))
 
         return {
-            'attributes': dict_table(attributes, self.max_level),
+            'attributes': attribute_table(attributes, self.max_level),
             'slots': slots,
             'entries': dict_table(entries, self.max_level),
             'buffs': dict_table(buffs, self.max_level),
@@ -189,17 +225,22 @@ class Accessory(Resource):
 
     @clean(None, [])
     def _ser_random_values(self):
-        if not isinstance(self.values, Sequence):
+        if not isinstance(self.random_values, Sequence):
             raise Exception('%s => must be a Sequence' % self.here('random_values'))
 
         attributes = []
         entries = []
 
         for id in self.random_values:
-            if Resource.is_id(id, RandomAttribute):
+            if Resource.is_id(id, RandomAttributes):
                 attributes.append(id)
             elif Resource.is_id(id, RandomEntries):
                 entries.append(id)
             else:
-                raise Exception('%s => must be a RandomAttributeID|RandomEntriesID' %
+                raise Exception('%s => must be a RandomAttributesID|RandomEntriesID' %
                                 self.here('random_values.(item)'))
+
+        return {
+            'random_attributes': attributes,
+            'random_entries': entries,
+        }
@@ -1,5 +1,6 @@
 from typing import *
 from lib.base import *
+from lib.build import BuildOptions, build_stage
 
 
 MaxHealth = 'MaxHealth'
@@ -176,6 +177,9 @@ Attribute = Literal[
 
 _AttributesDict_ = {k: True for k in get_args(Attribute)}
 
+# 属性的整数ID 按Attribute中的顺序编号 已发布的属性不能调整顺序 新属性只能追加在末尾
+AttributeIDs: dict[str, int] = {name: id for id, name in enumerate(get_args(Attribute))}
+
 
 def ser_attribute(val, where: str = '?', optional: bool = False):
     if optional and val is None:
@@ -186,11 +190,20 @@ def ser_attribute(val, where: str = '?', optional: bool = False):
     return val
 
 
+inline_check(ser_attribute, lambda const: 'v in %s' % const(_AttributesDict_))
+
+
 def is_attribute(val):
     return val in _AttributesDict_
 
 
-# 属性列表 [属性值, ...]
+def attribute_key(name: Attribute) -> Attribute | int:
+    if output_options.attribute_ids:
+        return AttributeIDs[name]
+    return name
+
+
+# 属性列表 [属性值, ...] 也可以是array.array或一维的NumPy数组
 AttributesList = Sequence[float]
 
 
@@ -205,13 +218,52 @@ def ser_attributes_list(
     if optional and list is None:
         return None
 
+    if is_numeric_array(list):
+        if len(list) != size:
+            raise Exception('%s => size must equal to %d' % (where, size))
+        # 数组整体校验 原样输出不复制
+        if not out_of_bounds(list, min, max):
+            return list
+        # 逐个元素检查以定位出错的值
+        ser_attributes_list(list.tolist(), size, where, min=min, max=max)
+
     if not isinstance(list, Sequence):
         raise Exception('%s => must be an AttributesList' % where)
 
     if len(list) != size:
         raise Exception('%s => size must equal to %d' % (where, size))
 
+    # 只在出错时拼接where
     for attr in list:
-        ser_num(attr, where+'.(item)', min, max)
+        if type(attr) not in (int, float) or \
+                (min is not None and attr < min) or (max is not None and max < attr):
+            ser_num(attr, where+'.(item)', min=min, max=max)
 
     return list
+
+
+def attribute_table(table: Mapping[Attribute, AttributesList], y: int):
+    '''
+    属性表的dict_table 开启attribute_ids时以ID列表'k'和值列表't'输出
+    '''
+    if not output_options.attribute_ids:
+        return dict_table(table, y)
+
+    if len(table) == 0:
+        return None
+    table = {AttributeIDs[k]: v for k, v in table.items()}
+    if output_options.packed_tables:
+        return pack_table(table, y)
+    return {
+        'x': len(table),
+        'y': y,
+        'k': [*table],
+        't': [*table.values()],
+    }
+
+
+@build_stage
+def _attributes_header(resources: list[Resource], options: BuildOptions):
+    if options.attribute_ids:
+        yield '@attributes', [*AttributeIDs]
+
@@ -1,8 +1,11 @@
 from __future__ import annotations
-from dataclasses import dataclass, field
-import json
+from contextlib import contextmanager
+from dataclasses import dataclass, field, fields
 from typing import *
-from writer import *
+from lib.writer import *
+# isinstance检查比typing的别名快得多
+from collections.abc import Mapping, Sequence
+from lib.table import is_integer_array, is_numeric_array, out_of_bounds, pack_table
 
 
 number = int | float
@@ -28,7 +31,7 @@ def ser_num(
     if optional and val is None:
         return None
 
-    if type(val) in (int, float):
+    if type(val) not in (int, float):
         raise Exception('%s => must be an int|float' % where)
 
     if min != None:
@@ -81,14 +84,21 @@ def ser_veci(
     if optional and val is None:
         return None
 
-    if isinstance(val, Sequence):
+    if is_numeric_array(val):
+        if len(val) != size:
+            raise Exception('%s => size must equal to %d' % (where, size))
+        if is_integer_array(val) and not out_of_bounds(val, min, max):
+            return val
+        val = val.tolist()
+
+    if not isinstance(val, Sequence):
         raise Exception('%s => must be a Sequence[int]' % where)
 
     if len(val) != size:
         raise Exception('%s => size must equal to %d' % (where, size))
 
     for item in val:
-        if type(item) not in (int, float):
+        if type(item) != int:
             raise Exception('%s.(item) => must be an int' % where)
 
         if min != None:
@@ -111,7 +121,10 @@ def ser_rangei(
     min: int = None,
     max: int = None,
 ):
-    ser_rangei(val, where, optional, min, max)
+    if optional and val is None:
+        return None
+
+    ser_veci(val, 2, where, optional, min, max)
 
     if val[0] >= val[1]:
         raise Exception('%s.(item) => first item must less than second item' % where)
@@ -130,7 +143,14 @@ def ser_vec(
     if optional and val is None:
         return None
 
-    if isinstance(val, Sequence):
+    if is_numeric_array(val):
+        if len(val) != size:
+            raise Exception('%s => size must equal to %d' % (where, size))
+        if not out_of_bounds(val, min, max):
+            return val
+        val = val.tolist()
+
+    if not isinstance(val, Sequence):
         raise Exception('%s => must be a Sequence[int|float]' % where)
 
     if len(val) != size:
@@ -160,6 +180,9 @@ def ser_range(
     min: int = None,
     max: int = None,
 ):
+    if optional and val is None:
+        return None
+
     ser_vec(val, 2, where, optional, min, max)
 
     if val[0] >= val[1]:
@@ -207,17 +230,127 @@ def clean(*white_spaces: Any):
         white_spaces = (None,)
 
     def decorator(func):
-        def wrapper(self) -> dict[str, Any]:
-            res = func(self)
+        def wrapper(self, *args, **kwargs) -> dict[str, Any]:
+            res = func(self, *args, **kwargs)
             return {k: v for k, v in res.items() if v not in white_spaces}
         return wrapper
     return decorator
 
 
+# 编译serialize时替换为资源的实际类型
+OWNER = object()
+
+
+@dataclass(frozen=True)
+class Rule:
+    # 输出的key 为None时将method返回的dict展开到输出中
+    key: str | None
+
+    # 读取的字段名
+    attr: str | None = None
+
+    # 校验函数 ser_*
+    ser: Callable | None = None
+
+    # 生成输出的方法名 _ser_*
+    method: str | None = None
+
+    # 传给校验函数的参数
+    kwargs: Mapping[str, Any] = field(default_factory=dict)
+
+
+def rule(key: str, ser: Callable, attr: str | None = None, **kwargs: Any) -> Rule:
+    return Rule(key, attr or key, ser, None, kwargs)
+
+
+def method(key: str | None, name: str) -> Rule:
+    return Rule(key, None, None, name)
+
+
+# 校验函数对应的内联条件 条件不成立时才调用校验函数生成错误信息
+_inline_checks_: dict[Callable, Callable[..., str]] = {}
+
+
+def inline_check(ser: Callable, check: Callable[..., str]):
+    _inline_checks_[ser] = check
+
+
+def compile_serializer(cls: type) -> Callable[[Any], dict[str, Any]]:
+    '''
+    将继承链上的_schema_编译为一个serialize函数
+    等价于逐级super().serialize()展开再经过clean() 但没有中间dict和where字符串的开销
+    '''
+    rules = []
+    for base in reversed(cls.__mro__):
+        rules.extend(base.__dict__.get('_schema_', ()))
+
+    consts = {}
+
+    def const(obj: Any) -> str:
+        name = '_c%d' % len(consts)
+        consts[name] = obj
+        return name
+
+    lines = ['def serialize(self):', '    out = {%r: %r}' % ('T', cls.__name__)]
+    for r in rules:
+        if r.ser is None:
+            if r.key is None:
+                lines += [
+                    '    for k, v in self.%s().items():' % r.method,
+                    '        if v is not None:',
+                    '            out[k] = v',
+                ]
+            else:
+                lines += [
+                    '    v = self.%s()' % r.method,
+                    '    if v is not None:',
+                    '        out[%r] = v' % r.key,
+                ]
+            continue
+
+        kwargs = {k: (cls if v is OWNER else v) for k, v in r.kwargs.items()}
+        args = ''.join(', %s=%s' % (k, const(v)) for k, v in kwargs.items())
+        call = '%s(v, where=%s%s)' % (const(r.ser), const(cls.here(r.attr)), args)
+
+        lines.append('    v = self.%s' % r.attr)
+        check = _inline_checks_.get(r.ser)
+        if check:
+            cond = check(const, **{k: v for k, v in kwargs.items() if k != 'optional'})
+            if kwargs.get('optional'):
+                cond = 'v is None or (%s)' % cond
+            lines += ['    if not (%s):' % cond, '        %s' % call]
+        else:
+            lines.append('    v = %s' % call)
+        lines += ['    if v is not None:', '        out[%r] = v' % r.key]
+    lines.append('    return out')
+
+    namespace = dict(consts)
+    exec('\n'.join(lines), namespace)
+    serialize = namespace['serialize']
+    serialize.__qualname__ = '%s.serialize' % cls.__qualname__
+    return serialize
+
+
+def _check_range(cond: str, min: number | None = None, max: number | None = None) -> str:
+    if min is not None:
+        cond += ' and %r <= v' % min
+    if max is not None:
+        cond += ' and v <= %r' % max
+    return cond
+
+
+inline_check(ser_bool, lambda const: 'type(v) is bool')
+inline_check(ser_int, lambda const, **kw: _check_range('type(v) is int', **kw))
+inline_check(ser_num, lambda const, **kw: _check_range('type(v) in (int, float)', **kw))
+inline_check(ser_str, lambda const: 'type(v) is str')
+inline_check(ser_res_id, lambda const, T: 'type(v) is str and v.startswith(%r)' % (T.__name__+'.'))
+inline_check(ser_rare_level, lambda const: 'v in %s' % const(frozenset(get_args(RareLevel))))
+
+
 @dataclass
 class Serializer:
     @clean()
-    def serialize(self, where: str) -> dict[str, Any]:
+    def serialize(self, *args) -> dict[str, Any]:
         return {}
 
     @classmethod
@@ -235,33 +368,94 @@ class Resource(Serializer):
 
     _res_dict_: ClassVar[dict[str, Resource]] = dict()
 
+    # 按资源类型分开的注册表 资源ID的前缀与类型名相同
+    _type_dicts_: ClassVar[dict[Type[Resource], dict[str, Resource]]] = dict()
+
+    # 按需导入资源定义模块的加载器 见lib.content.ContentPack
+    _loader_: ClassVar[Any] = None
+
+    # 子类的字段规则 定义子类时编译为serialize
+    _schema_: ClassVar[Sequence[Rule]] = (
+        rule('res_id', ser_res_id, T=OWNER),
+    )
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if 'serialize' not in cls.__dict__:
+            cls.serialize = compile_serializer(cls)
+
     def __post_init__(self):
         if self.res_id in self._res_dict_:
             raise Exception('%s => id conflict' % self.res_id)
         self._res_dict_[self.res_id] = self
 
+        T = type(self)
+        if T not in self._type_dicts_:
+            self._type_dicts_[T] = {}
+        self._type_dicts_[T][self.res_id] = self
+
     @classmethod
     def is_id(cls, res_id: str, T: Type[Resource]):
-        if type(res_id) != str:
+        if type(res_id) is not str:
             return False
-        if not res_id.startswith(T.__name__+'.'):
+        if res_id in cls._type_dicts_.get(T, ()):
+            return True
+        if cls._loader_ is None or not res_id.startswith(T.__name__ + '.'):
             return False
-        return res_id in cls._res_dict_
+        return cls._loader_.load_id(res_id) and res_id in cls._type_dicts_.get(T, ())
 
     @classmethod
     def find(cls, res_id: str, T: Type[Resource] = None, where: str = '?') -> Resource:
         if T:
+            if type(res_id) is str:
+                res = cls._type_dicts_.get(T, {}).get(res_id)
+                if res:
+                    return res
+
             if type(res_id) != str:
                 raise Exception('%s => %s is not %sID' % (where, res_id, T.__name__))
             if not res_id.startswith(T.__name__+'.'):
                 raise Exception('%s => %s is not %sID' % (where, res_id, T.__name__))
 
-        res = cls._res_dict_[res_id]
+        res = cls._res_dict_.get(res_id)
+        if not res and cls._loader_ is not None and type(res_id) is str and cls._loader_.load_id(res_id):
+            res = cls._res_dict_.get(res_id)
         if not res:
             raise Exception('%s => %s not found' % (where, res_id))
 
         return res
 
+    @classmethod
+    def all(cls, T: Type[Resource] | None = None) -> Collection[Resource]:
+        '''
+        T类型的全部资源 不包含T的子类 T为None时为所有资源
+        没有加载器时按注册顺序 有加载器时由加载器决定顺序 与访问过哪些资源无关
+        '''
+        if cls._loader_ is not None:
+            return cls._loader_.ordered(T)
+        if T is None:
+            return cls._res_dict_.values()
+        return cls._type_dicts_.get(T, {}).values()
+
+    @classmethod
+    def count(cls, T: Type[Resource]) -> int:
+        if cls._loader_ is not None:
+            cls._loader_.load_type(T)
+        return len(cls._type_dicts_.get(T, ()))
+
+    @classmethod
+    def clear(cls):
+        cls._res_dict_.clear()
+        cls._type_dicts_.clear()
+        if cls._loader_ is not None:
+            cls._loader_.reset()
+
+    def references(self) -> list[ResID]:
+        '''
+        直接引用的其他资源ID 增量构建时用于判断依赖是否变化
+        '''
+        return []
+
     @clean()
     def serialize(self) -> dict[str, Resource]:
         T = type(self)
@@ -271,20 +465,65 @@ class Resource(Serializer):
         }
 
     @classmethod
-    def write_all(cls, path: str):
-        with FileWriter(path) as writer:
-            for res in cls._res_dict_.values():
-                data = json.dumps(res.serialize(), separators=(',', ':'))
-                cache = res.cache == True and 1 or 0
-                writer.write(res.res_id, data, cache)
+    def write_all(cls, path: str, **options: Any):
+        '''
+        options见lib.build.BuildOptions 开启profile时返回lib.profiling.BuildProfile
+        '''
+        from lib.build import BuildOptions, write_all
+        return write_all(path, cls.all(), BuildOptions(**options))
+
+
+@dataclass
+class OutputOptions:
+    '''
+    影响记录内容的输出选项 构建期间由BuildOptions设置
+    '''
+
+    # dict_table输出为打包的二进制列 见lib.table
+    packed_tables: bool = False
+
+    # 属性名输出为整数ID 见lib.attribute.AttributeIDs
+    attribute_ids: bool = False
+
+    # 脚本源码输出为@scripts中的句柄 见lib.script.ScriptTable
+    script_handles: bool = False
+
+    # 重复的字符串与表格输出为@pool中的引用 见lib.pool.ConstantPool
+    constant_pool: bool = False
 
+    # Entry记录附带叠加矩阵 见lib.entry.Entry._ser_stacking
+    entry_stacking: bool = False
 
-def dict_table(table: Mapping):
+    # 输出@equipment_tree 见lib.equipment._equipment_tree
+    equipment_tree: bool = False
+
+    # 输出@material_prefix.<装备ID> 见lib.equipment._equipment_tree
+    material_prefix: bool = False
+
+
+output_options = OutputOptions()
+
+
+@contextmanager
+def use_output_options(options: OutputOptions):
+    saved = OutputOptions(**{f.name: getattr(output_options, f.name) for f in fields(options)})
+    for f in fields(options):
+        setattr(output_options, f.name, getattr(options, f.name))
+    try:
+        yield
+    finally:
+        for f in fields(saved):
+            setattr(output_options, f.name, getattr(saved, f.name))
+
+
+def dict_table(table: Mapping, y: int):
     if len(table) == 0:
         return None
+    if output_options.packed_tables:
+        return pack_table(table, y)
     return {
         'x': len(table),
-        'y': len(table[0]),
+        'y': y,
         't': table,
     }
 
@@ -1,6 +1,7 @@
 from __future__ import annotations
 from dataclasses import dataclass
 from lib.base import *
+from lib.script import *
 
 
 @dataclass(kw_only=True)
@@ -39,30 +40,32 @@ class Buff(Resource):
     def find(res_id: str, where: str = '?') -> Buff:
         return Resource.find(res_id, Buff, where)
 
-    @clean()
-    def serialize(self) -> dict[str, Any]:
-        return {
-            **super().serialize(),
-            'arguments': self._ser_arguments(),
-            'on_start': ser_script(self.on_start, optional=True, where=self.here('on_start')),
-            'on_finish': ser_script(self.on_finish, optional=True, where=self.here('on_finish')),
-            'on_hit': ser_script(self.on_hit, optional=True, where=self.here('on_hit')),
-            'on_hurt': ser_script(self.on_hurt, optional=True, where=self.here('on_hurt')),
-            'on_tick': ser_script(self.on_tick, optional=True, where=self.here('on_tick')),
-            'name': ser_str(self.name, self.here('name')),
-            'icon': ser_str(self.icon, self.here('icon')),
-        }
+    def references(self) -> list[ResID]:
+        if output_options.script_handles and any(True for _ in resource_scripts(self)):
+            return ['@scripts']
+        return []
+
+    _schema_ = (
+        method('arguments', '_ser_arguments'),
+        rule('on_start', ser_script, optional=True),
+        rule('on_finish', ser_script, optional=True),
+        rule('on_hit', ser_script, optional=True),
+        rule('on_hurt', ser_script, optional=True),
+        rule('on_tick', ser_script, optional=True),
+        rule('name', ser_str),
+        rule('icon', ser_str),
+    )
 
     def _ser_arguments(self):
         if not isinstance(self.arguments, Mapping):
-            Exception('%s => must be a Mapping' % self.here('arguments'))
+            raise Exception('%s => must be a Mapping' % self.here('arguments'))
 
         for arg, value in self.arguments.items():
             if type(arg) != str:
-                Exception('%s => must be a str' % self.here('arguments.(key)'))
+                raise Exception('%s => must be a str' % self.here('arguments.(key)'))
 
             if type(value) not in (int, float):
-                Exception('%s => must be an int|float' % self.here('arguments.(value)'))
+                raise Exception('%s => must be an int|float' % self.here('arguments.(value)'))
 
         return self.arguments
 
@@ -91,6 +94,6 @@ def ser_buffs_list(list, size: int, buff: Buff, where: str = '?', optional: bool
                                 (where, buff.res_id))
 
             if type(value) not in (int, float):
-                raise Exception('%s.(item).(value) => must be an int|float')
+                raise Exception('%s.(item).(value) => must be an int|float' % where)
 
     return list
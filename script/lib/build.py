@@ -0,0 +1,404 @@
+from __future__ import annotations
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, is_dataclass, replace
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from typing import *
+from lib.base import *
+from lib.codec import BLOCK_SIZE
+from lib.pool import ConstantPool
+from lib.profiling import BuildProfile, ProfileHook
+from lib.shard import SHARD_FILE, SHARD_SIZE, ShardedWriter, open_db
+from lib.table import json_default
+
+
+# 增量构建的清单文件 记录每个资源及其依赖的内容hash
+MANIFEST_FILE = 'db.tph'
+MANIFEST_VERSION = 2
+
+# 未指定script_cache时脚本编译结果的缓存目录 位于当前用户的缓存目录下 不随输出发布
+# 缓存文件按源码hash命名并带有解释器的MAGIC_NUMBER 多次构建可以共用 见lib.script.check_script_cache
+SCRIPT_CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+    'tp-scripts',
+)
+
+
+@dataclass(kw_only=True)
+class BuildOptions:
+    # db.tpi的格式
+    index: IndexFormat = 'json'
+
+    # 增量构建 内容与依赖都未变化的资源直接复用上一次db.tpd中的字节
+    incremental: bool = False
+
+    # 并行编码的进程数 0或1为串行 输出与串行完全一致
+    workers: int = 0
+
+    # 属性/词条/Buff表输出为打包的二进制列
+    packed_tables: bool = False
+
+    # 属性名输出为整数ID 名字表作为@attributes记录写入
+    attribute_ids: bool = False
+
+    # 脚本源码去重写入@scripts记录 记录中以句柄引用 构建时检查语法并编译
+    script_table: bool = False
+
+    # 脚本编译结果的缓存目录 None为SCRIPT_CACHE_DIR
+    script_cache: str | None = None
+
+    # 重复的字符串与表格写入@pool记录 记录中以引用代替 开启时不并行编码
+    constant_pool: bool = False
+
+    # Entry记录附带预先计算的叠加矩阵 大小为(max_piece+1)*(max_piece*2+1)行
+    # 关闭时读取方由piece_attributes/plus_attributes自行计算 见lib.stats
+    entry_stacking: bool = False
+
+    # 输出装备树@equipment_tree 见lib.equipment.EquipmentTree
+    equipment_tree: bool = False
+
+    # 每件装备输出累计素材表@material_prefix.<装备ID> 见lib.equipment.material_prefix
+    material_prefix: bool = False
+
+    # 按资源类型分段输出 见lib.shard 超过shard_size字节的类型再按ID的hash分段
+    shards: bool = False
+    shard_size: int = SHARD_SIZE
+
+    # db.tpd的块压缩算法 见lib.codec None为不压缩
+    compression: str | None = None
+
+    # 压缩块解压后的大小上限 单条记录超过时独占一块
+    block_size: int = BLOCK_SIZE
+
+    # 按资源类型与阶段统计构建耗时 write_all返回BuildProfile
+    profile: bool = False
+
+    # 每条记录的每个阶段完成时调用 设置后自动开启profile
+    profile_hook: ProfileHook | None = None
+
+    def output(self) -> OutputOptions:
+        return OutputOptions(
+            packed_tables=self.packed_tables,
+            attribute_ids=self.attribute_ids,
+            script_handles=self.script_table,
+            constant_pool=self.constant_pool,
+            entry_stacking=self.entry_stacking,
+            equipment_tree=self.equipment_tree,
+            material_prefix=self.material_prefix,
+        )
+
+
+# 阶段生成(记录ID, 数据)或(记录ID, 数据, cache) 未指定cache时记录常驻
+BuildStage = Callable[[list[Resource], BuildOptions], Iterable[tuple[str, Any] | tuple[str, Any, int]]]
+
+_stages_: list[BuildStage] = []
+
+
+def build_stage(func: BuildStage) -> BuildStage:
+    '''
+    注册构建阶段 阶段生成的记录ID以@开头 写在所有资源记录之前
+    '''
+    _stages_.append(func)
+    return func
+
+
+def run_stages(resources: list[Resource], options: BuildOptions) -> list[tuple[str, bytes, int]]:
+    records = []
+    for stage in _stages_:
+        for id, data, *cache in stage(resources, options):
+            if not id.startswith('@'):
+                raise Exception('%s => stage record ID must start with "@"' % id)
+            data = json.dumps(data, separators=(',', ':'), default=json_default).encode()
+            records.append((id, data, cache[0] if cache else 1))
+    return records
+
+
+def _hash_default(obj):
+    if is_dataclass(obj):
+        return [type(obj).__name__, obj.__dict__]
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return bytes(obj).hex()
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    raise TypeError('%s is not hashable content' % type(obj).__name__)
+
+
+def content_hash(res: Resource) -> str:
+    '''
+    资源定义的内容hash 字段顺序会影响输出 因此不排序
+    '''
+    data = json.dumps(res, default=_hash_default, separators=(',', ':'))
+    return hashlib.blake2b(data.encode(), digest_size=16).hexdigest()
+
+
+def load_manifest(path: str, output: OutputOptions) -> dict[str, list] | None:
+    p_manifest = os.path.join(path, MANIFEST_FILE)
+    if not os.path.exists(p_manifest):
+        return None
+
+    with open(p_manifest, 'rb') as handle:
+        manifest = json.load(handle)
+    if manifest.get('version') != MANIFEST_VERSION:
+        return None
+    # 输出选项不同时记录内容也不同 不能复用
+    if manifest.get('output') != asdict(output):
+        return None
+    return manifest['records']
+
+
+def save_manifest(path: str, output: OutputOptions, records: dict[str, list]):
+    p_manifest = os.path.join(path, MANIFEST_FILE)
+    manifest = {'version': MANIFEST_VERSION, 'output': asdict(output), 'records': records}
+    with open(p_manifest, 'w') as handle:
+        json.dump(manifest, handle, separators=(',', ':'))
+
+
+def _reusable_records(
+    path: str,
+    resources: Sequence[Resource],
+    records: dict[str, list],
+    output: OutputOptions,
+) -> dict[str, bytes]:
+    previous = load_manifest(path, output)
+    if not previous:
+        return {}
+
+    if not os.path.exists(os.path.join(path, SHARD_FILE)):
+        if not os.path.exists(os.path.join(path, 'db.tpd')):
+            return {}
+        if not os.path.exists(os.path.join(path, 'db.tpi')):
+            return {}
+
+    reuse = {}
+    with open_db(path, capacity=0) as db:
+        for res in resources:
+            id = res.res_id
+            if id not in previous or id not in db:
+                continue
+            if records[id][1] is None or previous[id] != records[id]:
+                continue
+            reuse[id] = db.raw(id)
+    return reuse
+
+
+def encode(res: Resource) -> bytes:
+    return json.dumps(res.serialize(), separators=(',', ':'), default=json_default).encode()
+
+
+def encode_pooled(data: Any, pool: ConstantPool) -> bytes:
+    return json.dumps(pool.intern(data), separators=(',', ':'), default=json_default).encode()
+
+
+def serialize_all(resources: list[Resource], profile: BuildProfile | None = None) -> list[Any]:
+    if not profile:
+        return [res.serialize() for res in resources]
+
+    results = []
+    for res in resources:
+        profile.find_time = 0.0
+        profile.find_calls = 0
+        begin = time.perf_counter()
+        results.append(res.serialize())
+        elapsed = time.perf_counter() - begin
+        T = type(res).__name__
+        profile.add(T, 'validate', elapsed - profile.find_time)
+        profile.add(T, 'find', profile.find_time, profile.find_calls)
+    return results
+
+
+def encode_profiled(res: Resource, profile: BuildProfile) -> bytes:
+    profile.find_time = 0.0
+    profile.find_calls = 0
+
+    begin = time.perf_counter()
+    data = res.serialize()
+    middle = time.perf_counter()
+    data = json.dumps(data, separators=(',', ':'), default=json_default).encode()
+    finish = time.perf_counter()
+
+    T = type(res).__name__
+    profile.add(T, 'validate', middle - begin - profile.find_time)
+    profile.add(T, 'find', profile.find_time, profile.find_calls)
+    profile.add(T, 'dumps', finish - middle, size=len(data))
+    return data
+
+
+# fork出的worker通过该列表访问资源 避免pickle资源对象
+_shard_resources_: list[Resource] = []
+
+_shard_profile_: BuildProfile | None = None
+
+
+def _encode_shard(shard: list[int]) -> tuple[list[bytes], tuple[int, Exception] | None, dict | None]:
+    profile = _shard_profile_
+    if profile:
+        # 统计在主进程合并后才调用hook
+        profile.stats = {}
+        profile.hook = None
+
+    results = []
+    for pos in shard:
+        try:
+            if profile:
+                results.append(encode_profiled(_shard_resources_[pos], profile))
+            else:
+                results.append(encode(_shard_resources_[pos]))
+        except Exception as e:
+            return results, (pos, e), profile and profile.stats
+    return results, None, profile and profile.stats
+
+
+def _split_shards(resources: list[Resource], positions: list[int], workers: int) -> list[list[int]]:
+    groups = {}
+    for pos in positions:
+        groups.setdefault(type(resources[pos]), []).append(pos)
+
+    size = max(64, len(positions) // (workers * 4) + 1)
+    shards = []
+    for group in groups.values():
+        for start in range(0, len(group), size):
+            shards.append(group[start:start+size])
+    return shards
+
+
+def encode_parallel(
+    resources: list[Resource],
+    positions: list[int],
+    workers: int,
+    profile: BuildProfile | None = None,
+) -> dict[int, bytes]:
+    '''
+    按资源类型分片 在worker进程中校验并编码
+    出错时抛出注册顺序上第一个出错资源的异常 与串行构建一致
+    '''
+    global _shard_resources_, _shard_profile_
+
+    shards = _split_shards(resources, positions, workers)
+    encoded = {}
+    error = None
+
+    _shard_resources_ = resources
+    _shard_profile_ = profile
+    try:
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(workers, mp_context=context) as pool:
+            for shard, (results, failure, stats) in zip(shards, pool.map(_encode_shard, shards)):
+                encoded.update(zip(shard, results))
+                if stats:
+                    profile.merge(stats)
+                if failure and (error is None or failure[0] < error[0]):
+                    error = failure
+    finally:
+        _shard_resources_ = []
+        _shard_profile_ = None
+
+    if error:
+        raise error[1]
+    return encoded
+
+
+def write_all(path: str, resources: Iterable[Resource], options: BuildOptions) -> BuildProfile | None:
+    if options.script_table and options.script_cache is None:
+        options = replace(options, script_cache=SCRIPT_CACHE_DIR)
+
+    output = options.output()
+    if not options.profile and not options.profile_hook:
+        with use_output_options(output):
+            _write_all(path, list(resources), options, output, None)
+        return None
+
+    profile = BuildProfile(options.profile_hook)
+    with use_output_options(output), profile.instrument():
+        _write_all(path, list(resources), options, output, profile)
+    return profile
+
+
+def _write_all(
+    path: str,
+    resources: list[Resource],
+    options: BuildOptions,
+    output: OutputOptions,
+    profile: BuildProfile | None,
+):
+    headers = run_stages(resources, options)
+
+    # 常量池需要所有记录的内容 先全部serialize 编码时不再重复
+    pool = None
+    objects = []
+    if output.constant_pool:
+        objects = serialize_all(resources, profile)
+        pool = ConstantPool.from_records(objects)
+        headers.append(('@pool', json.dumps(pool.serialize(), separators=(',', ':'), default=json_default).encode(), 1))
+
+    records = {}
+    reuse = {}
+    if options.incremental:
+        hashes = {res.res_id: content_hash(res) for res in resources}
+        # 引用阶段记录(如@scripts)的资源在该记录变化时重新编码
+        hashes.update((id, hashlib.blake2b(data, digest_size=16).hexdigest()) for id, data, _ in headers)
+        for res in resources:
+            try:
+                refs = res.references()
+            except Exception:
+                # 定义本身有误 交给serialize报错
+                refs = [None]
+            if all(type(ref) == str for ref in refs):
+                deps = {ref: hashes.get(ref) for ref in refs}
+                if pool is not None:
+                    deps['@pool'] = hashes['@pool']
+            else:
+                deps = None
+            records[res.res_id] = [hashes[res.res_id], deps]
+        reuse = _reusable_records(path, resources, records, output)
+
+    # 构建失败时不能留下与db.tpd不一致的清单
+    p_manifest = os.path.join(path, MANIFEST_FILE)
+    if os.path.exists(p_manifest):
+        os.remove(p_manifest)
+
+    encoded = {}
+    if options.workers > 1 and pool is None and 'fork' in multiprocessing.get_all_start_methods():
+        dirty = [pos for pos, res in enumerate(resources) if res.res_id not in reuse]
+        encoded = encode_parallel(resources, dirty, options.workers, profile)
+
+    def stream():
+        yield from headers
+        for pos, res in enumerate(resources):
+            data = reuse.get(res.res_id)
+            if data is not None:
+                if profile:
+                    profile.add(type(res).__name__, 'reuse', 0.0, size=len(data))
+            else:
+                data = encoded.get(pos)
+            if data is None and pool is not None:
+                begin = time.perf_counter()
+                data = encode_pooled(objects[pos], pool)
+                if profile:
+                    profile.add(type(res).__name__, 'dumps', time.perf_counter() - begin, size=len(data))
+            if data is None:
+                data = profile and encode_profiled(res, profile) or encode(res)
+            cache = res.cache == True and 1 or 0
+            yield res.res_id, data, cache
+
+    if options.shards:
+        writer = ShardedWriter(path, options.index, options.compression, options.block_size, options.shard_size)
+    else:
+        writer = FileWriter(path, options.index, options.compression, options.block_size)
+    with writer:
+        if not profile:
+            writer.write_many(stream())
+        else:
+            # 逐条写入以便按类型计时 资源ID的前缀即类型名
+            for id, data, cache in stream():
+                begin = time.perf_counter()
+                writer.write(id, data, cache)
+                profile.add(id.split('.', 1)[0], 'write', time.perf_counter() - begin, size=len(data))
+            begin = time.perf_counter()
+            writer.close()
+            profile.add('@index', 'write', time.perf_counter() - begin)
+
+    if options.incremental:
+        save_manifest(path, output, records)
@@ -0,0 +1,246 @@
+from abc import ABC, abstractmethod
+from collections import Counter
+import lzma
+import re
+import struct
+import zlib
+from typing import *
+
+
+# db.tpb 压缩块表 (小端) 存在时db.tpd由压缩块拼接而成
+#
+# [Header] [Dict] [Block * count]
+#
+# Header 20字节
+#   magic(4s) version(u16) codec(u16) count(u32) dict_size(u32) block_size(u32)
+#   block_size为写入时的块大小上限 应用补丁时追加的块沿用 版本1没有该字段
+#
+# Block 16字节 按顺序对应db.tpd中的压缩块
+#   offset(u64) size(u32) raw_size(u32)
+#
+# 压缩时db.tpi中记录的start为 (块序号 << 32) | 块内偏移 length为解压后的长度
+# 记录不会跨块 读取一条记录只需要解压一个块
+
+BLOCK_MAGIC = b'TPB1'
+BLOCK_VERSION = 2
+
+BLOCK_SIZE = 16 * 1024
+
+_HEADER = struct.Struct('<4sHHIII')
+_HEADER_V1 = struct.Struct('<4sHHII')
+_BLOCK = struct.Struct('<QII')
+
+# 记录中的JSON片段 字符串(含其后的冒号) 数字 连续的标点
+_TOKEN = re.compile(rb'"(?:[^"\\]|\\.)*":?|-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?|[\[\]{},:]+|[a-z]+')
+
+
+class Codec(ABC):
+    '''
+    块压缩算法 id写入db.tpb 已发布的id不能修改
+    '''
+
+    id: int
+    name: str
+
+    def train(self, samples: Sequence[bytes], size: int = 32 * 1024) -> bytes:
+        return b''
+
+    @abstractmethod
+    def compress(self, data: bytes, zdict: bytes) -> bytes:
+        ...
+
+    @abstractmethod
+    def decompress(self, data: bytes, zdict: bytes) -> bytes:
+        ...
+
+
+class ZlibCodec(Codec):
+    '''
+    raw deflate 使用从记录中训练出的预设字典
+    '''
+
+    id = 1
+    name = 'zlib'
+
+    def __init__(self, level: int = 9) -> None:
+        self.level = level
+
+    def train(self, samples: Sequence[bytes], size: int = 32 * 1024) -> bytes:
+        return train_dictionary(samples, min(size, 32 * 1024))
+
+    def compress(self, data: bytes, zdict: bytes) -> bytes:
+        if zdict:
+            c = zlib.compressobj(self.level, zlib.DEFLATED, -15, zdict=zdict)
+        else:
+            c = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+        return c.compress(data) + c.flush()
+
+    def decompress(self, data: bytes, zdict: bytes) -> bytes:
+        if zdict:
+            d = zlib.decompressobj(-15, zdict=zdict)
+        else:
+            d = zlib.decompressobj(-15)
+        return d.decompress(data) + d.flush()
+
+
+class LzmaCodec(Codec):
+    '''
+    raw lzma2 标准库不支持预设字典 压缩率依赖块的大小
+    '''
+
+    id = 2
+    name = 'lzma'
+
+    _filters = [{'id': lzma.FILTER_LZMA2, 'preset': 9}]
+
+    def compress(self, data: bytes, zdict: bytes) -> bytes:
+        return lzma.compress(data, lzma.FORMAT_RAW, filters=self._filters)
+
+    def decompress(self, data: bytes, zdict: bytes) -> bytes:
+        return lzma.decompress(data, lzma.FORMAT_RAW, filters=self._filters)
+
+
+_codecs_: dict[str, Codec] = {}
+
+_codec_ids_: dict[int, Codec] = {}
+
+
+def register_codec(codec: Codec) -> Codec:
+    if codec.name in _codecs_ or codec.id in _codec_ids_:
+        raise Exception('Codec conflict: %s' % codec.name)
+    _codecs_[codec.name] = codec
+    _codec_ids_[codec.id] = codec
+    return codec
+
+
+register_codec(ZlibCodec())
+register_codec(LzmaCodec())
+
+
+def find_codec(name: str) -> Codec:
+    if name not in _codecs_:
+        raise Exception('Unknown codec: %s' % name)
+    return _codecs_[name]
+
+
+def find_codec_id(id: int) -> Codec:
+    if id not in _codec_ids_:
+        raise Exception('Unknown codec: %d' % id)
+    return _codec_ids_[id]
+
+
+def train_dictionary(samples: Sequence[bytes], size: int, limit: int = 1 << 20) -> bytes:
+    '''
+    统计样本中的JSON片段及相邻片段对 按 出现次数*长度 选取
+    收益最高的片段放在字典末尾 离压缩数据最近
+    '''
+    counter = Counter()
+    total = 0
+    for sample in samples:
+        tokens = _TOKEN.findall(sample)
+        counter.update(tokens)
+        counter.update(a + b for a, b in zip(tokens, tokens[1:]))
+        total += len(sample)
+        if total >= limit:
+            break
+
+    scored = sorted(
+        ((count * len(token), token) for token, count in counter.items() if count > 1 and len(token) > 2),
+        reverse=True,
+    )
+
+    chosen = []
+    used = 0
+    for _, token in scored:
+        if used + len(token) > size:
+            continue
+        chosen.append(token)
+        used += len(token)
+
+    chosen.reverse()
+    return b''.join(chosen)
+
+
+def block_start(block: int, offset: int) -> int:
+    return (block << 32) | offset
+
+
+def split_start(start: int) -> tuple[int, int]:
+    return start >> 32, start & 0xFFFFFFFF
+
+
+def write_block_table(
+    handle: IO[bytes],
+    codec: Codec,
+    zdict: bytes,
+    blocks: Sequence[tuple[int, int, int]],
+    block_size: int,
+):
+    buffer = bytearray(_HEADER.size + len(zdict) + _BLOCK.size * len(blocks))
+    _HEADER.pack_into(buffer, 0, BLOCK_MAGIC, BLOCK_VERSION, codec.id, len(blocks), len(zdict), block_size)
+    buffer[_HEADER.size:_HEADER.size+len(zdict)] = zdict
+
+    pos = _HEADER.size + len(zdict)
+    for block in blocks:
+        _BLOCK.pack_into(buffer, pos, *block)
+        pos += _BLOCK.size
+
+    handle.write(buffer)
+
+
+class BlockTable:
+    '''
+    db.tpb 读取压缩块 只解压记录所在的块
+    '''
+
+    codec: Codec
+    zdict: bytes
+    blocks: list[tuple[int, int, int]]
+
+    # 写入时的块大小上限 版本1的块表为None
+    block_size: int | None
+
+    def __init__(self, path: str) -> None:
+        with open(path, 'rb') as handle:
+            raw = handle.read()
+
+        if len(raw) < _HEADER_V1.size:
+            raise Exception('%s => not a block table' % path)
+        magic, version, codec, count, dict_size = _HEADER_V1.unpack_from(raw, 0)
+        if magic != BLOCK_MAGIC:
+            raise Exception('%s => not a block table' % path)
+        if version == 1:
+            header = _HEADER_V1.size
+            self.block_size = None
+        elif version == BLOCK_VERSION:
+            if len(raw) < _HEADER.size:
+                raise Exception('%s => not a block table' % path)
+            header = _HEADER.size
+            self.block_size = _HEADER.unpack_from(raw, 0)[5]
+        else:
+            raise Exception('%s => unsupported block table version %d' % (path, version))
+        if codec not in _codec_ids_:
+            raise Exception('%s => unknown codec %d' % (path, codec))
+
+        pos = header + dict_size
+        if len(raw) < pos + count * _BLOCK.size:
+            raise Exception('%s => block table is truncated' % path)
+
+        self.codec = _codec_ids_[codec]
+        self.zdict = raw[header:pos]
+        self.blocks = [_BLOCK.unpack_from(raw, pos + i * _BLOCK.size) for i in range(count)]
+
+    def __len__(self) -> int:
+        return len(self.blocks)
+
+    def decompress(self, data: bytes, block: int) -> bytes:
+        offset, size, raw_size = self.blocks[block]
+        if offset + size > len(data):
+            raise Exception('Block %d is corrupted' % block)
+        try:
+            raw = self.codec.decompress(data[offset:offset+size], self.zdict)
+        except (zlib.error, lzma.LZMAError):
+            raise Exception('Block %d is corrupted' % block)
+        if len(raw) != raw_size:
+            raise Exception('Block %d is corrupted' % block)
+        return raw
@@ -0,0 +1,254 @@
+from __future__ import annotations
+import importlib.util
+import itertools
+import json
+import os
+import sys
+import time
+from typing import *
+from lib.base import Resource
+
+
+# 按需加载的内容包
+#
+# root目录下的每个.py为一个资源定义模块 导入时注册其中的资源
+# 索引文件记录每个模块定义的资源ID 以及模块的mtime与大小
+#   打开内容包时只stat各模块 新增或修改过的模块才导入以更新索引
+#   之后通过Resource.find/Resource.is_id找不到的ID 或Resource.all/Resource.count请求的类型
+#   才导入对应的模块
+#
+# 资源ID的前缀即类型名 因此按类型加载只需查索引
+
+CONTENT_INDEX_FILE = 'content_index.json'
+CONTENT_INDEX_VERSION = 1
+
+# 导入的模块在sys.modules中的名字前缀
+MODULE_PREFIX = '_content_'
+
+
+class ContentPack:
+    '''
+    install后成为Resource的加载器
+    '''
+
+    root: str
+    index_path: str
+
+    # {模块相对路径: {'mtime': int, 'size': int, 'ids': [资源ID, ...]}}
+    modules: dict[str, dict[str, Any]]
+    loaded: set[str]
+
+    import_count: int
+    import_time: float
+
+    def __init__(self, root: str, index: str | None = None, refresh: bool = True) -> None:
+        self.root = os.path.abspath(root)
+        self.index_path = index or os.path.join(self.root, CONTENT_INDEX_FILE)
+        self.modules = {}
+        self.loaded = set()
+        self.import_count = 0
+        self.import_time = 0.0
+        self._owners = {}
+        self._types = {}
+        # 正在导入的模块 每层记录嵌套导入的模块注册的资源ID
+        self._loading = []
+
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'rb') as handle:
+                index = json.load(handle)
+            if index.get('version') == CONTENT_INDEX_VERSION and index.get('root') == self.root:
+                self.modules = index['modules']
+        self._build_maps()
+
+        if refresh:
+            self.refresh()
+
+    def __enter__(self):
+        return self.install()
+
+    def __exit__(self, type, value, trace):
+        self.uninstall()
+
+    def install(self) -> ContentPack:
+        if Resource._loader_ is not None and Resource._loader_ is not self:
+            raise Exception('%s => another content pack is installed' % self.root)
+        Resource._loader_ = self
+        return self
+
+    def uninstall(self):
+        if Resource._loader_ is self:
+            Resource._loader_ = None
+
+    def _build_maps(self):
+        self._owners = {}
+        self._types = {}
+        for rel, info in self.modules.items():
+            for id in info['ids']:
+                self._owners[id] = rel
+                self._types.setdefault(id.split('.', 1)[0], []).append(rel)
+
+    def _scan(self) -> dict[str, os.stat_result]:
+        found = {}
+        pending = [self.root]
+        while pending:
+            with os.scandir(pending.pop()) as it:
+                for entry in it:
+                    if entry.name.startswith(('.', '_')):
+                        continue
+                    if entry.is_dir():
+                        pending.append(entry.path)
+                    elif entry.name.endswith('.py'):
+                        found[os.path.relpath(entry.path, self.root).replace(os.sep, '/')] = entry.stat()
+        return found
+
+    def refresh(self) -> list[str]:
+        '''
+        导入新增或修改过的模块并更新索引 返回这些模块
+        '''
+        found = self._scan()
+        changed = [rel for rel, st in sorted(found.items())
+                   if rel not in self.modules
+                   or self.modules[rel]['mtime'] != st.st_mtime_ns
+                   or self.modules[rel]['size'] != st.st_size]
+        removed = [rel for rel in self.modules if rel not in found]
+
+        for rel in changed:
+            if rel in self.loaded:
+                raise Exception('%s => changed after it was loaded' % rel)
+
+        for rel in removed:
+            del self.modules[rel]
+        for rel in changed:
+            st = found[rel]
+            self.modules[rel] = {'mtime': st.st_mtime_ns, 'size': st.st_size, 'ids': []}
+        # 导入时可能嵌套导入其他修改过的模块 已导入的直接跳过
+        for rel in changed:
+            self.load_module(rel)
+
+        if changed or removed:
+            self._build_maps()
+            self._save()
+        return changed
+
+    def _save(self):
+        data = {'version': CONTENT_INDEX_VERSION, 'root': self.root, 'modules': self.modules}
+        temp = '%s.%d.tmp' % (self.index_path, os.getpid())
+        with open(temp, 'w') as handle:
+            json.dump(data, handle, separators=(',', ':'))
+        os.replace(temp, self.index_path)
+
+    def load_module(self, rel: str) -> list[str]:
+        '''
+        导入模块 返回其中注册的资源ID 并更新索引中该模块的ID列表
+        导入期间通过Resource.find等嵌套导入的其他模块 其资源只计入那个模块
+        '''
+        if rel in self.loaded:
+            return [*self.modules[rel]['ids']]
+        self.loaded.add(rel)
+
+        name = MODULE_PREFIX + '.' + rel[:-3].replace('/', '.')
+        spec = importlib.util.spec_from_file_location(name, os.path.join(self.root, rel))
+        module = importlib.util.module_from_spec(spec)
+
+        before = len(Resource._res_dict_)
+        nested = set()
+        self._loading.append(nested)
+        begin = time.perf_counter()
+        sys.modules[name] = module
+        try:
+            spec.loader.exec_module(module)
+        except Exception:
+            del sys.modules[name]
+            self.loaded.discard(rel)
+            raise
+        finally:
+            self._loading.pop()
+            self.import_time += time.perf_counter() - begin
+            self.import_count += 1
+
+        # 新注册的资源在注册表末尾
+        added = [*itertools.islice(reversed(Resource._res_dict_), len(Resource._res_dict_) - before)][::-1]
+        if self._loading:
+            self._loading[-1].update(added)
+        ids = [id for id in added if id not in nested]
+        if rel in self.modules:
+            self.modules[rel]['ids'] = ids
+        return [*ids]
+
+    def load_id(self, res_id: str) -> bool:
+        '''
+        导入定义res_id的模块 没有导入任何模块时返回False
+        '''
+        rel = self._owners.get(res_id)
+        if rel is None or rel in self.loaded:
+            return False
+        self.load_module(rel)
+        return True
+
+    def load_type(self, T: Type[Resource] | str):
+        name = T if type(T) == str else T.__name__
+        for rel in self._types.get(name, ()):
+            if rel not in self.loaded:
+                self.load_module(rel)
+
+    def load_dir(self, path: str):
+        '''
+        导入root下某个目录中的全部模块
+        '''
+        prefix = path.strip('/') + '/'
+        for rel in self.modules:
+            if rel.startswith(prefix) and rel not in self.loaded:
+                self.load_module(rel)
+
+    def load_all(self):
+        for rel in sorted(self.modules):
+            if rel not in self.loaded:
+                self.load_module(rel)
+
+    def ordered(self, T: Type[Resource] | None = None) -> list[Resource]:
+        '''
+        导入T类型(None为全部)所在的模块 返回其中的资源
+        不属于内容包的资源按注册顺序在前 之后按模块路径与模块中的声明顺序
+        模块按需导入的先后不影响结果 构建输出的记录顺序因此固定
+        '''
+        if T is None:
+            self.load_all()
+            registry = Resource._res_dict_
+            modules = sorted(self.modules)
+        else:
+            self.load_type(T)
+            registry = Resource._type_dicts_.get(T, {})
+            modules = sorted(set(self._types.get(T.__name__, ())))
+
+        result = [res for id, res in registry.items() if id not in self._owners]
+        for rel in modules:
+            for id in self.modules[rel]['ids']:
+                res = registry.get(id)
+                if res is not None:
+                    result.append(res)
+        return result
+
+    def resources(self, *types: Type[Resource]) -> list[Resource]:
+        '''
+        指定类型的资源 按类型顺序排列 每种类型内按注册顺序
+        '''
+        result = []
+        for T in types:
+            result.extend(Resource.all(T))
+        return result
+
+    def reset(self):
+        '''
+        Resource.clear()之后调用 之后的请求重新导入模块
+        '''
+        for rel in self.loaded:
+            sys.modules.pop(MODULE_PREFIX + '.' + rel[:-3].replace('/', '.'), None)
+        self.loaded = set()
+
+    def stats(self) -> dict[str, int | float]:
+        return {
+            'modules': len(self.modules),
+            'loaded': len(self.loaded),
+            'import_count': self.import_count,
+            'import_time': self.import_time,
+        }
@@ -1,5 +1,5 @@
 from __future__ import annotations
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from lib.base import *
 from lib.attribute import *
 from lib.buff import *
@@ -27,8 +27,13 @@ def ser_entry_type(val, where: str = '?', optional: bool = False):
     return val
 
 
+inline_check(ser_entry_type, lambda const: 'v in %s' % const(frozenset(get_args(EntryType))))
+
+
 SlotType = Literal['Attack', 'Defense', 'Special', 'Extra']
 
+_SlotTypes_ = frozenset(get_args(SlotType))
+
 
 def ser_slot_type(val, name: str = '?', optional: bool = False):
     if optional and val is None:
@@ -53,10 +58,10 @@ class Entry(Resource):
     max_piece: int
 
     # 同一词条叠加带来的提升 List长度必须等于max_piece
-    piece_values: Mapping[Attribute | ResID, AttributesList | BuffsList] = {}
+    piece_values: Mapping[Attribute | ResID, AttributesList | BuffsList] = field(default_factory=dict)
 
     # 「+」值堆叠带来的提升 List长度必须等于max_piece*2
-    plus_values: Mapping[Attribute, AttributesList] = {}
+    plus_values: Mapping[Attribute, AttributesList] = field(default_factory=dict)
 
     # 展示用的名字
     name: str
@@ -71,62 +76,102 @@ class Entry(Resource):
     def find(res_id: str, where: str = '?') -> Entry:
         return Resource.find(res_id, Entry, where)
 
-    @clean()
-    def serialize(self) -> dict[str, Any]:
-        return {
-            **super().serialize(),
-            'type': ser_entry_type(self.type, self.here('type')),
-            'max_piece': ser_int(self.max_piece, min=0, max=99, where=self.here('max_piece')),
-            **self._ser_piece_values(),
-            **self._ser_plus_values(),
-            'name': ser_str(self.name, self.here('name')),
-            'rare': ser_rare_level(self.rare, self.here('rare')),
-            'icon': ser_str(self.icon, self.here('icon')),
-        }
+    def references(self) -> list[ResID]:
+        return [key for key in self.piece_values if not is_attribute(key)]
+
+    _schema_ = (
+        rule('type', ser_entry_type),
+        rule('max_piece', ser_int, min=0, max=99),
+        method(None, '_ser_piece_values'),
+        method(None, '_ser_plus_values'),
+        method(None, '_ser_stacking'),
+        rule('name', ser_str),
+        rule('rare', ser_rare_level),
+        rule('icon', ser_str),
+    )
 
     @clean()
     def _ser_piece_values(self):
         if not isinstance(self.piece_values, Mapping):
             raise Exception('%s => must be a Mapping' % self.here('piece_values'))
 
+        where = self.here('piece_values.(value)')
+
         attributes = {}
         buffs = {}
 
         for key, list in self.piece_values.items():
             if is_attribute(key):
-                attributes[key] = ser_attributes_list(
-                    list, self.max_piece, self.here('piece_values.(value)'))
+                attributes[key] = ser_attributes_list(list, self.max_piece, where)
             elif Resource.is_id(key, Buff):
-                buffs[key] = ser_buffs_list(
-                    list, self.max_piece, self.here('piece_values.(value)'))
+                buffs[key] = ser_buffs_list(list, self.max_piece, Buff.find(key), where)
             else:
                 raise Exception('%s => must be an Attribute|BuffID' %
                                 self.here('piece_values.(key)'))
 
         return {
-            'attributes': dict_table(attributes, self.max_piece),
-            'buffs': dict_table(buffs, self.max_piece),
+            'piece_attributes': attribute_table(attributes, self.max_piece),
+            'piece_buffs': dict_table(buffs, self.max_piece),
         }
 
     def _ser_plus_values(self):
         if not isinstance(self.plus_values, Mapping):
             raise Exception(self.here('plus_values')+': must be a Mapping')
 
+        where = self.here('plus_values.(value)')
+
         attributes = {}
 
         for key, list in self.plus_values.items():
             if is_attribute(key):
-                attributes[key] = ser_attributes_list(
-                    list, self.max_piece, self.here('plus_values.(value)'))
+                attributes[key] = ser_attributes_list(list, self.max_piece * 2, where)
             else:
                 raise Exception('%s => must be an Attribute' %
                                 self.here('plus_values.(key)'))
 
         return {
-            'attributes': dict_table(attributes, self.max_piece * 2),
+            'plus_attributes': attribute_table(attributes, self.max_piece * 2),
+        }
+
+    def _ser_stacking(self):
+        '''
+        叠加矩阵 每个属性一列 第piece*(max_piece*2+1)+plus行为该状态下piece与plus的加成之和
+        piece为0时词条不生效 整行为0 超出上限的piece/plus由运行时截断到max_piece/max_piece*2
+        在_ser_piece_values/_ser_plus_values校验之后执行 列表长度已经确定
+        只在开启entry_stacking时输出
+        '''
+        if not output_options.entry_stacking:
+            return {}
+
+        pieces = self.max_piece + 1
+        pluses = self.max_piece * 2 + 1
+
+        keys = [key for key in self.piece_values if is_attribute(key)]
+        keys.extend(key for key in self.plus_values if key not in self.piece_values)
+
+        columns = {}
+        for key in keys:
+            piece = _values(self.piece_values.get(key), self.max_piece)
+            plus = _values(self.plus_values.get(key), self.max_piece * 2)
+            column = [0] * pluses
+            for p in range(1, pieces):
+                column.extend(piece[p] + q for q in plus)
+            columns[key] = column
+
+        return {
+            'stacking': attribute_table(columns, pieces * pluses),
         }
 
 
+def _values(list, size: int) -> Sequence[number]:
+    # 前面补0 下标即piece/plus的数量
+    if list is None:
+        return [0] * (size + 1)
+    if is_numeric_array(list):
+        list = list.tolist()
+    return [0, *list]
+
+
 # 宝石镶嵌列表 [[SlotType, ...], ...]
 SlotsList = Sequence[Sequence[SlotType]]
 
@@ -146,13 +191,14 @@ def ser_slots_list(list, size: int, where: str = '?', optional: bool = False):
             raise Exception('%s.(item) => must be a Sequence' % where)
 
         for item in line:
-            ser_slot_type(item, where+'.(item).(item)')
+            if item not in _SlotTypes_:
+                ser_slot_type(item, where+'.(item).(item)')
 
     return list_table(list)
 
 
 # 词条列表 [[词条piece, 词条plus], ...]
-EntriesList = Sequence[Sequence[int, int]]
+EntriesList = Sequence[Sequence[int]]
 
 
 def ser_entries_list(list, size: int, where: str):
@@ -166,7 +212,8 @@ def ser_entries_list(list, size: int, where: str):
         if not isinstance(line, Sequence):
             raise Exception('%s.(item) => must be a Sequence' % where)
 
-        for item in line:
-            ser_rangei(item, min=0, max=99, where=where+'.(item).(item)')
+        if len(line) != 2 or type(line[0]) != int or type(line[1]) != int or \
+                not (0 <= line[0] <= 99 and 0 <= line[1] <= 99):
+            ser_veci(line, 2, min=0, max=99, where=where+'.(item)')
 
     return list
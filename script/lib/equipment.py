@@ -1,10 +1,12 @@
 from __future__ import annotations
 from dataclasses import dataclass
+from itertools import accumulate
 from lib.base import *
 from lib.attribute import *
 from lib.buff import *
 from lib.entry import *
 from lib.script import *
+from lib.build import BuildOptions, build_stage
 
 
 Equipment1 = 'Equipment1'
@@ -15,7 +17,7 @@ EquipmentType = Literal['Equipment1', 'Equipment2', 'Equipment3']
 
 
 def ser_equipment_type(val, where: str = '?', optional: bool = False):
-    if optional and list is None:
+    if optional and val is None:
         return None
 
     if val not in get_args(EquipmentType):
@@ -24,6 +26,9 @@ def ser_equipment_type(val, where: str = '?', optional: bool = False):
     return val
 
 
+inline_check(ser_equipment_type, lambda const: 'v in %s' % const(frozenset(get_args(EquipmentType))))
+
+
 @dataclass(kw_only=True)
 class Equipment(Resource):
     '''
@@ -39,7 +44,7 @@ class Equipment(Resource):
     # 等级范围 [最低等级, 最高等级]
     level: Sequence[int, int]
 
-    # 装备树中的父节点 [装备ID, 等级]
+    # 装备树中的父节点 [装备ID, 等级] 输出累计素材时最多一个父节点 见material_prefix
     parents: Mapping[ResID, int]
 
     # 每一级的武器强化素材列表
@@ -70,21 +75,28 @@ class Equipment(Resource):
     def find(res_id: str, where: str = '?') -> Equipment:
         return Resource.find(res_id, Equipment, where)
 
-    @clean()
-    def serialize(self) -> dict[str, Any]:
-        return {
-            **super().serialize(),
-            'type': ser_equipment_type(self.type, self.here('type')),
-            # 'enable_if': ser_script(self.type, optional=True, where=self.here('enable_if')),
-            'level': ser_rangei(self.level, min=0, max=99, where=self.here('level')),
-            'parents': self._ser_parents(),
-            'materials': self._ser_materials(),
-            **self._ser_values(),
-            'name': ser_str(self.name, self.here('name')),
-            'rare': ser_rare_level(self.rare, self.here('rare')),
-            'icon': ser_str(self.icon, self.here('icon')),
-            'sub_icon': ser_str(self.icon, self.here('sub_icon')),
-        }
+    def references(self) -> list[ResID]:
+        refs = [*self.parents]
+        for dict in self.materials:
+            refs.extend(dict)
+        refs.extend(key for key in self.values if not is_attribute(key) and key != Slots)
+        if output_options.script_handles and self.scripts:
+            refs.append('@scripts')
+        return refs
+
+    _schema_ = (
+        rule('type', ser_equipment_type),
+        # rule('enable_if', ser_script, optional=True),
+        rule('level', ser_rangei, min=0, max=99),
+        method('parents', '_ser_parents'),
+        method('materials', '_ser_materials'),
+        method(None, '_ser_values'),
+        method('scripts', '_ser_scripts'),
+        rule('name', ser_str),
+        rule('rare', ser_rare_level),
+        rule('icon', ser_str),
+        rule('sub_icon', ser_str),
+    )
 
     def _ser_parents(self):
         if not isinstance(self.parents, Mapping):
@@ -111,16 +123,27 @@ class Equipment(Resource):
                 raise Exception('%s => must be a Mapping' % self.here('materials.(item)'))
 
             for id, cnt in dict.items():
-                Resource.find(id, where='materials.(item).(key)')
-                ser_int(cnt, min=0, where='materials.(item).(value)')
+                if id not in Resource._res_dict_:
+                    Resource.find(id, where=self.here('materials.(item).(key)'))
+                if type(cnt) != int or cnt < 0:
+                    ser_int(cnt, min=0, where=self.here('materials.(item).(value)'))
 
         return list_table(self.materials)
 
+    def _ser_scripts(self):
+        if not isinstance(self.scripts, Sequence):
+            raise Exception('%s => must be a Sequence' % self.here('scripts'))
+
+        where = self.here('scripts.(item)')
+        return [ser_script(script, where) for script in self.scripts] or None
+
     @clean(None, {})
     def _ser_values(self):
         if not isinstance(self.values, Mapping):
             raise Exception('%s => must be a Mapping' % self.here('values'))
 
+        where = self.here('values.(value)')
+
         attributes = {}
         slots = None
         buffs = {}
@@ -129,28 +152,210 @@ class Equipment(Resource):
 
         for key, list in self.values.items():
             if is_attribute(key):
-                attributes[key] = ser_attributes_list(
-                    list, level, self.here('values.(value)'))
+                attributes[key] = ser_attributes_list(list, level, where)
             elif key == Slots:
-                slots = ser_slots_list(list, level, self.here('values.(value)'))
+                slots = ser_slots_list(list, level, where)
             elif Resource.is_id(key, Entry):
-                entries[key] = ser_entries_list(
-                    list, level, self.here('values.(value)'))
+                entries[key] = ser_entries_list(list, level, where)
             elif Resource.is_id(key, Buff):
-                buffs[key] = ser_buffs_list(
-                    list, level, self.here('values.(value)'))
+                buffs[key] = ser_buffs_list(list, level, Buff.find(key), where)
             else:
                 raise Exception('%s => must be an Attribute|"Slots"|Entries|BuffID' %
                                 self.here('values.(key)'))
 
         return {
-            'attributes': dict_table(attributes, level),
+            'attributes': attribute_table(attributes, level),
             'slots': slots,
             'entries': dict_table(entries, level),
             'buffs': dict_table(buffs, level),
         }
 
 
+class EquipmentTree:
+    '''
+    装备树 所有装备按parents拓扑排序 父节点总在子节点之前
+    装备在order中的下标即树中的整数ID 祖先/后代闭包按offsets+values压缩存储
+    '''
+
+    # 拓扑序的装备ID
+    order: list[ResID]
+
+    # 装备ID => 整数ID
+    index: dict[ResID, int]
+
+    # 直接父节点与分支等级 parents[i]为[(父节点, 等级), ...]
+    parents: list[list[tuple[int, int]]]
+
+    # 闭包 第i件装备为values[offsets[i]:offsets[i+1]] 按整数ID升序
+    ancestor_offsets: list[int]
+    ancestor_values: list[int]
+    descendant_offsets: list[int]
+    descendant_values: list[int]
+
+    def __init__(self, equipments: Iterable[Equipment]) -> None:
+        equipments = {e.res_id: e for e in equipments}
+        self.order = _topological_order(equipments)
+        self.index = {id: i for i, id in enumerate(self.order)}
+        self.parents = [
+            sorted((self.index[id], level) for id, level in _parents(equipments[eid], equipments).items())
+            for eid in self.order
+        ]
+
+        # 按拓扑序合并父节点的闭包
+        ancestors = []
+        for i, parents in enumerate(self.parents):
+            closure = set()
+            for parent, _ in parents:
+                closure.add(parent)
+                closure.update(ancestors[parent])
+            ancestors.append(closure)
+
+        descendants = [[] for _ in self.order]
+        for i, closure in enumerate(ancestors):
+            for ancestor in closure:
+                descendants[ancestor].append(i)
+
+        self.ancestor_offsets, self.ancestor_values = _compress(sorted(c) for c in ancestors)
+        self.descendant_offsets, self.descendant_values = _compress(descendants)
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def ancestors(self, id: ResID) -> list[ResID]:
+        i = self.index[id]
+        return [self.order[k] for k in self.ancestor_values[self.ancestor_offsets[i]:self.ancestor_offsets[i+1]]]
+
+    def descendants(self, id: ResID) -> list[ResID]:
+        i = self.index[id]
+        return [self.order[k] for k in self.descendant_values[self.descendant_offsets[i]:self.descendant_offsets[i+1]]]
+
+    def serialize(self) -> dict[str, Any]:
+        return {
+            'ids': self.order,
+            'parents': [[p for p, _ in parents] for parents in self.parents],
+            'parent_levels': [[l for _, l in parents] for parents in self.parents],
+            'ancestors': {'o': self.ancestor_offsets, 'v': self.ancestor_values},
+            'descendants': {'o': self.descendant_offsets, 'v': self.descendant_values},
+        }
+
+
+def _parents(equipment: Equipment, equipments: Mapping[ResID, Equipment]) -> Mapping[ResID, int]:
+    # 不存在的父节点交给_ser_parents报错
+    if not isinstance(equipment.parents, Mapping):
+        return {}
+    return {id: level for id, level in equipment.parents.items() if type(id) == str and id in equipments}
+
+
+def _topological_order(equipments: Mapping[ResID, Equipment]) -> list[ResID]:
+    children = {id: [] for id in equipments}
+    degrees = {}
+    for id, equipment in equipments.items():
+        parents = _parents(equipment, equipments)
+        degrees[id] = len(parents)
+        for parent in parents:
+            children[parent].append(id)
+
+    # 同一层内保持注册顺序
+    order = [id for id, degree in degrees.items() if degree == 0]
+    for id in order:
+        for child in children[id]:
+            degrees[child] -= 1
+            if degrees[child] == 0:
+                order.append(child)
+
+    if len(order) != len(equipments):
+        raise Exception('%s => cycle: %s' % (Equipment.here('parents'), ' -> '.join(_find_cycle(equipments, degrees))))
+    return order
+
+
+def _find_cycle(equipments: Mapping[ResID, Equipment], degrees: Mapping[ResID, int]) -> list[ResID]:
+    # 剩余节点都至少有一个同样剩余的父节点 沿父节点走必然回到走过的节点
+    id = next(id for id, degree in degrees.items() if degree > 0)
+    path = []
+    seen = {}
+    while id not in seen:
+        seen[id] = len(path)
+        path.append(id)
+        id = next(p for p in _parents(equipments[id], equipments) if degrees[p] > 0)
+    cycle = path[seen[id]:]
+    return [*reversed(cycle), cycle[-1]]
+
+
+def _compress(lists: Iterable[Sequence[int]]) -> tuple[list[int], list[int]]:
+    offsets = [0]
+    values = []
+    for list in lists:
+        values.extend(list)
+        offsets.append(len(values))
+    return offsets, values
+
+
+def material_prefix(tree: EquipmentTree, equipments: Mapping[ResID, Equipment]) -> dict[ResID, dict[ResID, list[int]]]:
+    '''
+    每件装备的累计素材表 table[素材][k]为从最初的祖先开始 升级到level[0]+k所需的素材总数
+    在分支等级处接上父节点的累计值 有多个父节点时累计值不唯一 报错
+    装备从等级a升级到b的消耗为 table[m][b-level[0]] - table[m][a-level[0]]
+    '''
+    tables = {}
+    for id in tree.order:
+        equipment = equipments[id]
+        table = {}
+
+        parents = _parents(equipment, equipments)
+        if len(parents) > 1:
+            raise Exception('%s => material prefix requires at most one parent: %s <- %s' %
+                            (Equipment.here('parents'), id, ', '.join(parents)))
+        if parents:
+            parent, level = next(iter(parents.items()))
+            base = equipments[parent].level[0]
+            for material, values in tables[parent].items():
+                table[material] = [values[max(0, min(level - base, len(values) - 1))]]
+
+        # 先按列记录每一级的增量 再整列累加
+        steps = _materials(equipment)
+        deltas = {material: [0] * len(steps) for material in table}
+        for k, dict in enumerate(steps):
+            for material, cnt in dict.items():
+                if material not in deltas:
+                    table[material] = [0]
+                    deltas[material] = [0] * len(steps)
+                deltas[material][k] += cnt
+
+        for material, values in table.items():
+            table[material] = [*accumulate(deltas[material], initial=values[0])]
+        tables[id] = table
+    return tables
+
+
+def _materials(equipment: Equipment) -> list[Mapping[ResID, int]]:
+    # 格式有误时交给_ser_materials报错
+    if not isinstance(equipment.materials, Sequence):
+        return []
+    return [dict for dict in equipment.materials
+            if isinstance(dict, Mapping) and all(type(cnt) == int for cnt in dict.values())]
+
+
+@build_stage
+def _equipment_tree(resources: list[Resource], options: BuildOptions):
+    if not options.equipment_tree and not options.material_prefix:
+        return
+    equipments = {res.res_id: res for res in resources if type(res) is Equipment}
+    tree = EquipmentTree(equipments.values())
+    if len(tree) == 0:
+        return
+    if options.equipment_tree:
+        yield '@equipment_tree', tree.serialize()
+    if not options.material_prefix:
+        return
+
+    # 每件装备一条记录 按需读取 不常驻
+    for id, table in material_prefix(tree, equipments).items():
+        yield '@material_prefix.' + id, {
+            'level': equipments[id].level[0],
+            'prefix': dict_table(table, len(_materials(equipments[id])) + 1),
+        }, 0
+
+
 # @dataclass(kw_only=True)
 # class EquipmentX(Serializer):
 #     id: str
@@ -0,0 +1,159 @@
+from collections.abc import Mapping as AbcMapping
+import hashlib
+import json
+import mmap
+import os
+import struct
+from typing import *
+
+
+# db.tpi 二进制索引格式 (小端)
+#
+# [Header] [Entry * count] [Strings]
+#
+# Header 32字节
+#   magic(4s) version(u16) entry_size(u16) count(u32) strings_offset(u64) padding(12)
+#
+# Entry 32字节 按(hash, id)升序排列 可直接在mmap上二分查找
+#   hash(u64) offset(u64) length(u32) name_offset(u32) name_length(u16) cache(u8) padding(5)
+#
+# Strings 所有ID的utf-8字节 name_offset相对于Strings起始位置
+
+INDEX_MAGIC = b'TPI1'
+INDEX_VERSION = 1
+
+_HEADER = struct.Struct('<4sHHIQ12x')
+_ENTRY = struct.Struct('<QQIIHB5x')
+
+
+def id_hash(id: str) -> int:
+    digest = hashlib.blake2b(id.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+def write_binary_index(handle: IO[bytes], index: Mapping[str, tuple[int, int, int]]):
+    items = []
+    for id, (start, length, cache) in index.items():
+        name = id.encode()
+        items.append((id_hash(id), name, start, length, cache))
+    items.sort(key=lambda item: (item[0], item[1]))
+
+    entries_size = _ENTRY.size * len(items)
+    strings_offset = _HEADER.size + entries_size
+
+    buffer = bytearray(strings_offset)
+    _HEADER.pack_into(buffer, 0, INDEX_MAGIC, INDEX_VERSION, _ENTRY.size, len(items), strings_offset)
+
+    strings = []
+    name_offset = 0
+    pos = _HEADER.size
+    for hash, name, start, length, cache in items:
+        if len(name) > 0xFFFF:
+            raise Exception('ID too long: %s' % name.decode())
+        _ENTRY.pack_into(buffer, pos, hash, start, length, name_offset, len(name), cache)
+        strings.append(name)
+        name_offset += len(name)
+        pos += _ENTRY.size
+
+    handle.write(buffer)
+    handle.write(b''.join(strings))
+
+
+class BinaryIndex(AbcMapping):
+    '''
+    基于mmap的db.tpi只读视图 查找为O(log n) 不会整体加载索引
+    '''
+
+    _handle: IO[bytes] | None
+    _mmap: mmap.mmap | None
+    _count: int
+    _strings: int
+
+    def __init__(self, path: str) -> None:
+        self._handle = None
+        self._mmap = None
+
+        self._handle = open(path, 'rb')
+        if os.fstat(self._handle.fileno()).st_size < _HEADER.size:
+            raise Exception('%s => not a binary index' % path)
+        self._mmap = mmap.mmap(self._handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, entry_size, count, strings = _HEADER.unpack_from(self._mmap, 0)
+        if magic != INDEX_MAGIC:
+            raise Exception('%s => not a binary index' % path)
+        if version != INDEX_VERSION or entry_size != _ENTRY.size:
+            raise Exception('%s => unsupported index version %d' % (path, version))
+
+        self._count = count
+        self._strings = strings
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        if self._mmap:
+            self._mmap.close()
+            self._mmap = None
+        if self._handle:
+            self._handle.close()
+            self._handle = None
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self) -> Iterator[str]:
+        for idx in range(self._count):
+            yield self._name(self._entry(idx))
+
+    def __getitem__(self, id: str) -> tuple[int, int, int]:
+        entry = self._search(id)
+        if entry is None:
+            raise KeyError(id)
+        return (entry[1], entry[2], entry[5])
+
+    def __contains__(self, id: object) -> bool:
+        return type(id) == str and self._search(id) is not None
+
+    def _entry(self, idx: int) -> tuple:
+        return _ENTRY.unpack_from(self._mmap, _HEADER.size + idx * _ENTRY.size)
+
+    def _name(self, entry: tuple) -> str:
+        start = self._strings + entry[3]
+        return self._mmap[start:start+entry[4]].decode()
+
+    def _search(self, id: str) -> tuple | None:
+        hash = id_hash(id)
+        name = id.encode()
+
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._entry(mid)[0] < hash:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        # hash冲突时 相邻的条目按名字区分
+        while lo < self._count:
+            entry = self._entry(lo)
+            if entry[0] != hash:
+                break
+            start = self._strings + entry[3]
+            if self._mmap[start:start+entry[4]] == name:
+                return entry
+            lo += 1
+        return None
+
+
+def load_index(path: str) -> Mapping[str, tuple[int, int, int]]:
+    '''
+    读取db.tpi 自动识别JSON或二进制格式
+    '''
+    with open(path, 'rb') as handle:
+        magic = handle.read(len(INDEX_MAGIC))
+
+    if magic == INDEX_MAGIC:
+        return BinaryIndex(path)
+
+    with open(path, 'rb') as handle:
+        return {id: tuple(value) for id, value in json.load(handle).items()}
@@ -0,0 +1,342 @@
+from __future__ import annotations
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+import heapq
+import multiprocessing
+from typing import *
+from lib.base import *
+from lib.entry import *
+from lib.equipment import *
+from lib.accessory import *
+from lib.stats import Loadout, StatCalculator, numpy
+
+
+# 分支定界搜索top-k的loadout 需要NumPy
+#
+# 搜索顺序 装备(等级) -> 装饰品组合(等级) -> 每个镶嵌槽的宝石
+#   镶嵌槽来自装备/装饰品在该等级的Slots 宝石词条的type需与槽相同 Extra槽可镶嵌任意type
+#   每颗宝石使词条piece+1 合计的piece不超过Entry.max_piece
+#
+# 上界 = 已选部分的累加值 + 剩余装饰品各属性的最大加成 + 可能出现的词条在叠加矩阵中各属性的最大加成
+#   XDown取最小加成 再按StatCalculator计算最终属性并打分
+#   要求打分函数对最终属性单调不减 且基础属性X非负 否则剪枝可能丢失最优解
+#
+# 装备按上界从高到低排序后轮流分给各进程 每个进程各自维护top-k 最后合并
+
+
+# 对最终属性(len(names),)打分 或者 {最终属性名: 非负权重}
+Score = Callable[[Any], float] | Mapping[str, float]
+
+
+@dataclass(kw_only=True)
+class SearchSpace:
+    '''
+    可用的装备 装饰品与宝石
+    '''
+
+    # {装备ID: 可用的等级} None为全部等级
+    equipments: Mapping[ResID, Sequence[int] | None]
+
+    # {装饰品ID: 可用的等级} None为全部等级 同一装饰品只能佩戴一件
+    accessories: Mapping[ResID, Sequence[int] | None] = field(default_factory=dict)
+
+    # 同时佩戴的装饰品数量上限
+    accessory_count: int = 0
+
+    # {宝石词条ID: 数量上限} None为不限
+    gems: Mapping[ResID, int | None] = field(default_factory=dict)
+
+
+@dataclass
+class OptimizeResult:
+    score: float
+
+    # 宝石合计在entries中 每颗piece为1
+    loadout: Loadout
+
+    # 每个镶嵌槽的(槽类型, 宝石词条ID) 空槽为None
+    gems: list[tuple[SlotType, ResID | None]]
+
+
+class _Option:
+    '''
+    装备/装饰品在某个等级的属性累加值 词条与镶嵌槽
+    '''
+
+    __slots__ = ('id', 'level', 'attr', 'pieces', 'plus', 'slots')
+
+    def __init__(self, id: ResID, level: int, attr, pieces: dict[int, int], plus: dict[int, int], slots: list[str]):
+        self.id = id
+        self.level = level
+        self.attr = attr
+        self.pieces = pieces
+        self.plus = plus
+        self.slots = slots
+
+
+def _merge(a: dict[int, int], b: dict[int, int]) -> dict[int, int]:
+    if not b:
+        return a
+    out = dict(a)
+    for j, v in b.items():
+        out[j] = out.get(j, 0) + v
+    return out
+
+
+class _Search:
+    '''
+    一次搜索的预处理结果与递归 fork出的worker直接使用
+    '''
+
+    def __init__(self, calc: StatCalculator, space: SearchSpace, score: Score, top_k: int) -> None:
+        if top_k <= 0:
+            raise Exception('top_k => must greater than 0')
+        if space.accessory_count < 0:
+            raise Exception('accessory_count => must not less than 0')
+
+        self.calc = calc
+        self.top_k = top_k
+        self.score = self._compile_score(score)
+        self.down = numpy.asarray([name.endswith('Down') for name in calc.attributes])
+
+        self.equipments = self._options('equipment', space.equipments)
+        self.accessories = self._options('accessory', space.accessories)
+        self.accessory_count = min(space.accessory_count, len({o.id for o in self.accessories}))
+
+        # 宝石 (词条下标, type, 数量上限)
+        self.gems = []
+        for id, limit in space.gems.items():
+            if id not in calc.entry_index:
+                raise Exception('gems => %s is not an Entry' % id)
+            entry = Resource.find(id)
+            self.gems.append((calc.entry_index[id], entry.type, limit is None and entry.max_piece or limit))
+        self.gem_entries = {j for j, _, _ in self.gems}
+        self.max_piece = [int(m) for m in calc._max_piece]
+
+        # 每个词条的最大加成
+        A = len(calc.attributes)
+        self.entry_bounds = {}
+        for j in {j for o in [*self.equipments, *self.accessories] for j in o.pieces} | self.gem_entries:
+            idx, lo, hi = calc.stacking_bounds(j)
+            vec = numpy.zeros(A)
+            vec[idx] = numpy.where(self.down[idx], numpy.minimum(lo, 0.0), numpy.maximum(hi, 0.0))
+            self.entry_bounds[j] = vec
+
+        # 从第s个装饰品开始的后缀 各属性的最大加成 出现的词条 是否有镶嵌槽
+        n = len(self.accessories)
+        self.accessory_bound = numpy.zeros((n + 1, A))
+        self.accessory_entries = [set() for _ in range(n + 1)]
+        self.accessory_slots = [False] * (n + 1)
+        for s in range(n - 1, -1, -1):
+            o = self.accessories[s]
+            prev = self.accessory_bound[s + 1]
+            self.accessory_bound[s] = numpy.where(self.down, numpy.minimum(prev, o.attr), numpy.maximum(prev, o.attr))
+            self.accessory_entries[s] = self.accessory_entries[s + 1] | set(o.pieces)
+            self.accessory_slots[s] = self.accessory_slots[s + 1] or bool(o.slots)
+
+        self.heap = []
+        self.counter = 0
+        self.nodes = 0
+        self.pruned = 0
+
+    def _compile_score(self, score: Score) -> Callable[[Any], float]:
+        if callable(score):
+            return score
+        weights = numpy.zeros(len(self.calc.names))
+        for name, w in score.items():
+            if name not in self.calc.names:
+                raise Exception('score => %s is not a stat name' % name)
+            if w < 0:
+                raise Exception('score => weight of %s must not less than 0' % name)
+            weights[self.calc.names.index(name)] = w
+        return lambda final: float(final @ weights)
+
+    def _options(self, kind: str, items: Mapping[ResID, Sequence[int] | None]) -> list[_Option]:
+        source = kind == 'equipment' and self.calc.equipment_index or self.calc.accessory_index
+        options = []
+        for id, levels in items.items():
+            if id not in source:
+                raise Exception('%s => %s not found' % (id, kind))
+            res = Resource.find(id)
+            base, end = kind == 'equipment' and res.level or (0, res.max_level)
+            slots = res.values.get(Slots)
+            for level in range(base, end) if levels is None else levels:
+                attr, pieces, plus = self.calc.item(kind, id, level)
+                options.append(_Option(id, level, attr, pieces, plus, slots and [*slots[level - base]] or []))
+        return options
+
+    def evaluate(self, totals) -> float:
+        return self.score(self.calc._finalize(totals[:, None])[:, 0])
+
+    def exact(self, attr, pieces: dict[int, int], plus: dict[int, int]) -> float:
+        totals = attr.copy()
+        for j, p in pieces.items():
+            if p > 0:
+                idx, values = self.calc.stacking(j, p, plus.get(j, 0))
+                totals[idx] += values
+        return self.evaluate(totals)
+
+    def bound(self, attr, pieces: dict[int, int], accessories: int, start: int, slots: bool) -> float:
+        totals = attr.copy()
+        entries = set(pieces)
+        if accessories and start < len(self.accessories):
+            totals += self.accessory_bound[start] * accessories
+            entries |= self.accessory_entries[start]
+            slots = slots or self.accessory_slots[start]
+        if slots:
+            entries |= self.gem_entries
+        for j in entries:
+            totals += self.entry_bounds[j]
+        return self.evaluate(totals)
+
+    def worse(self, bound: float) -> bool:
+        self.nodes += 1
+        if len(self.heap) >= self.top_k and bound <= self.heap[0][0]:
+            self.pruned += 1
+            return True
+        return False
+
+    def push(self, score: float, result: tuple):
+        self.counter += 1
+        item = (score, -self.counter, result)
+        if len(self.heap) < self.top_k:
+            heapq.heappush(self.heap, item)
+        elif score > self.heap[0][0]:
+            heapq.heapreplace(self.heap, item)
+
+    def run(self, positions: Sequence[int]) -> tuple[list, int, int]:
+        for e in positions:
+            o = self.equipments[e]
+            if self.worse(self.bound(o.attr, o.pieces, self.accessory_count, 0, bool(o.slots))):
+                continue
+            self._accessories(e, (), o.attr, o.pieces, o.plus, o.slots, 0)
+        return self.heap, self.nodes, self.pruned
+
+    def _accessories(self, e: int, chosen: tuple[int, ...], attr, pieces, plus, slots: list[str], start: int):
+        # 到此为止不再佩戴装饰品
+        self._gems(e, chosen, attr, pieces, plus, sorted(slots))
+
+        left = self.accessory_count - len(chosen)
+        if left <= 0:
+            return
+        worn = {self.accessories[a].id for a in chosen}
+        for a in range(start, len(self.accessories)):
+            o = self.accessories[a]
+            if o.id in worn:
+                continue
+            next_attr = attr + o.attr
+            next_pieces = _merge(pieces, o.pieces)
+            next_slots = slots + o.slots
+            if self.worse(self.bound(next_attr, next_pieces, left - 1, a + 1, bool(next_slots))):
+                continue
+            self._accessories(e, chosen + (a,), next_attr, next_pieces, _merge(plus, o.plus), next_slots, a + 1)
+
+    def _gems(self, e: int, chosen: tuple[int, ...], attr, pieces, plus, slots: list[str]):
+        if slots and self.gems:
+            if self.worse(self.bound(attr, pieces, 0, 0, True)):
+                return
+            self._fill(e, chosen, attr, dict(pieces), plus, slots, 0, [], {})
+        else:
+            self.push(self.exact(attr, pieces, plus), (e, chosen, ()))
+
+    def _fill(self, e, chosen, attr, pieces, plus, slots, k, picked: list[int], used: dict[int, int]):
+        if k == len(slots):
+            self.push(self.exact(attr, pieces, plus), (e, chosen, tuple(picked)))
+            return
+
+        # 同类型的相邻槽按宝石下标不减的顺序镶嵌 避免重复的排列 -1为空槽
+        low = -1
+        if k and slots[k - 1] == slots[k]:
+            low = picked[-1]
+        for g in range(low, len(self.gems)):
+            if g >= 0:
+                j, type, limit = self.gems[g]
+                if slots[k] != 'Extra' and slots[k] != type:
+                    continue
+                if pieces.get(j, 0) >= self.max_piece[j] or used.get(j, 0) >= limit:
+                    continue
+                pieces[j] = pieces.get(j, 0) + 1
+                used[j] = used.get(j, 0) + 1
+            picked.append(g)
+            self._fill(e, chosen, attr, pieces, plus, slots, k + 1, picked, used)
+            picked.pop()
+            if g >= 0:
+                pieces[j] -= 1
+                used[j] -= 1
+
+
+# fork出的worker通过该对象访问搜索状态 避免pickle
+_search_: _Search | None = None
+
+
+def _run_shard(positions: list[int]) -> tuple[list, int, int]:
+    return _search_.run(positions)
+
+
+class LoadoutOptimizer:
+    '''
+    在注册的资源中搜索得分最高的loadout
+    '''
+
+    calc: StatCalculator
+
+    # 上一次搜索访问/剪枝的节点数
+    nodes: int
+    pruned: int
+
+    def __init__(self, calc: StatCalculator | None = None) -> None:
+        self.calc = calc or StatCalculator()
+        self.nodes = 0
+        self.pruned = 0
+
+    def search(self, space: SearchSpace, score: Score, top_k: int = 10, workers: int = 1) -> list[OptimizeResult]:
+        '''
+        返回按得分从高到低排列的至多top_k个结果
+        '''
+        global _search_
+
+        search = _Search(self.calc, space, score, top_k)
+
+        # 上界高的装备先搜索 尽早得到较高的第k名
+        bounds = [search.bound(o.attr, o.pieces, search.accessory_count, 0, bool(o.slots))
+                  for o in search.equipments]
+        order = sorted(range(len(bounds)), key=lambda e: -bounds[e])
+
+        if workers > 1 and len(order) > 1 and 'fork' in multiprocessing.get_all_start_methods():
+            shards = [order[w::workers] for w in range(workers)]
+            heap = []
+            self.nodes = self.pruned = 0
+            _search_ = search
+            try:
+                context = multiprocessing.get_context('fork')
+                with ProcessPoolExecutor(workers, mp_context=context) as pool:
+                    for items, nodes, pruned in pool.map(_run_shard, shards):
+                        heap.extend(items)
+                        self.nodes += nodes
+                        self.pruned += pruned
+            finally:
+                _search_ = None
+        else:
+            heap, self.nodes, self.pruned = search.run(order)
+
+        best = sorted(heap, reverse=True)[:top_k]
+        return [self._result(search, score, result) for score, _, result in best]
+
+    def _result(self, search: _Search, score: float, result: tuple) -> OptimizeResult:
+        e, chosen, picked = result
+        equipment = search.equipments[e]
+        accessories = [search.accessories[a] for a in chosen]
+
+        slots = sorted(equipment.slots + [s for o in accessories for s in o.slots])
+        gems = []
+        entries = {}
+        for k, slot in enumerate(slots):
+            if k < len(picked) and picked[k] >= 0:
+                id = self.calc._entries[search.gems[picked[k]][0]].res_id
+                entries[id] = (entries.get(id, (0, 0))[0] + 1, 0)
+                gems.append((slot, id))
+            else:
+                gems.append((slot, None))
+
+        loadout = Loadout(equipment.id, equipment.level, [(o.id, o.level) for o in accessories], entries)
+        return OptimizeResult(score, loadout, gems)
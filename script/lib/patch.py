@@ -0,0 +1,515 @@
+from __future__ import annotations
+from dataclasses import dataclass
+import hashlib
+import json
+import os
+import struct
+import time
+from typing import *
+from lib.build import MANIFEST_FILE
+from lib.codec import BLOCK_SIZE, BlockTable, block_start, find_codec, find_codec_id, write_block_table
+from lib.index import BinaryIndex, write_binary_index
+from lib.reader import ResourceDB
+from lib.shard import SHARD_FILE, load_shards, open_db, record_type, remove_segment, save_shards, segment_of
+from lib.writer import FileWriter, IndexFormat
+
+
+# 两次write_all输出之间的增量补丁 只包含新增 修改 删除的记录
+#
+# .tpp 补丁文件 (小端)
+#
+# [Header] [Meta] [Payload]
+#
+# Header 32字节
+#   magic(4s) version(u16) codec(u16) meta_size(u32) payload_size(u64) raw_size(u64) padding(4)
+#
+# Meta 目标构建的JSON描述
+#   {'index': 'json'|'binary', 'compression': 名字|None, 'block_size': 压缩块大小|None,
+#    'shards': {类型: [段名, ...]}|None, 'count': 记录数, 'db_size': 输出文件的总字节数}
+#   应用时追加的块与重写的段使用block_size 补丁中没有时沿用段的块表 都没有时为BLOCK_SIZE
+#
+# Payload 按codec压缩的Op序列 codec为0时不压缩
+#   Op 24字节 后接ID与数据
+#     op(u8) cache(u8) name_length(u16) prefix(u32) suffix(u32) data_length(u32) check(8s)
+#   新增 数据为整条记录
+#   修改 新记录 = 旧记录[:prefix] + 数据 + 旧记录[-suffix:] 数据值只在数值等局部变化时很短
+#   删除 没有数据
+#   check为修改或删除前的记录的blake2b-8 应用时与db中的记录比较 不一致时拒绝应用
+#
+# 应用补丁时新增与修改的记录追加到db.tpd末尾 压缩时追加新的块 只重写索引与块表
+#   旧的记录留在db.tpd中 失效的字节超过compact比例时重写整个段
+#   分片输出中段的划分变化的类型(新增 删除 拆分的类型)整体重写
+#   增量构建的清单对应补丁前的记录 应用时删除
+#
+# 应用分三步 任何一条记录校验失败时db不变
+#   1. 读取所有涉及的段 校验并还原全部Op
+#   2. 追加数据 新的索引/块表/重写的段写入临时文件 旧的索引不引用追加的部分
+#   3. 临时文件替换正式文件 最后替换分片清单
+
+PATCH_MAGIC = b'TPP1'
+PATCH_VERSION = 1
+
+OP_ADD = 1
+OP_CHANGE = 2
+OP_REMOVE = 3
+
+# 失效字节超过段大小的该比例时重写
+COMPACT_RATIO = 0.5
+
+_HEADER = struct.Struct('<4sHHIQQ4x')
+_OP = struct.Struct('<BBHIII8s')
+
+_NO_CHECK = bytes(8)
+
+# (op, ID, cache, prefix, suffix, 数据, check)
+PatchOp = tuple[int, str, int, int, int, bytes, bytes]
+
+
+@dataclass
+class PatchStats:
+    added: int
+    changed: int
+    removed: int
+
+    # 补丁文件的大小 以及目标构建完整输出的大小
+    size: int
+    db_size: int
+
+    time: float
+
+    # 应用时重写的段数
+    compacted: int = 0
+
+
+def _check(data: bytes) -> bytes:
+    return hashlib.blake2b(data, digest_size=8).digest()
+
+
+def _delta(old: bytes, new: bytes) -> tuple[int, int]:
+    '''
+    公共前缀与公共后缀的长度 两者不重叠
+    二分比较切片 @pool等大记录也不需要逐字节比较
+    '''
+    limit = min(len(old), len(new))
+    lo, hi = 0, limit
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if old[:mid] == new[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    prefix = lo
+
+    lo, hi = 0, limit - prefix
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if old[len(old)-mid:] == new[len(new)-mid:]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return prefix, lo
+
+
+def _layout(db: ResourceDB) -> tuple[IndexFormat, str | None, int | None]:
+    index = isinstance(db._index, BinaryIndex) and 'binary' or 'json'
+    if db._blocks is None:
+        return index, None, None
+    return index, db._blocks.codec.name, db._blocks.block_size
+
+
+def _db_size(path: str, types: Mapping[str, Sequence[str]] | None) -> int:
+    names = types is None and ['db'] or [name for segments in types.values() for name in segments]
+    files = [name + ext for name in names for ext in ('.tpd', '.tpi', '.tpb')]
+    if types is not None:
+        files.append(SHARD_FILE)
+    return sum(os.path.getsize(os.path.join(path, f)) for f in files if os.path.exists(os.path.join(path, f)))
+
+
+def diff(base: str, target: str) -> tuple[dict[str, Any], list[PatchOp]]:
+    '''
+    比较两个输出目录 返回(Meta, Op) 新增与修改按目标中的顺序 删除在最后
+    '''
+    with open_db(base, capacity=0) as db:
+        previous = {id: (data, cache) for id, data, cache in db.records()}
+
+    ops = []
+    with open_db(target, capacity=0) as db:
+        count = 0
+        for id, data, cache in db.records():
+            count += 1
+            old = previous.pop(id, None)
+            if old is None:
+                ops.append((OP_ADD, id, cache, 0, 0, data, _NO_CHECK))
+            elif old[0] != data or old[1] != cache:
+                prefix, suffix = _delta(old[0], data)
+                ops.append((OP_CHANGE, id, cache, prefix, suffix, data[prefix:len(data)-suffix], _check(old[0])))
+
+        types = load_shards(target)
+        if types is None:
+            index, compression, block_size = _layout(db)
+        else:
+            segments = [name for names in types.values() for name in names]
+            index, compression, block_size = segments and _layout(db.segment(segments[0])) or ('json', None, None)
+
+    for id, (data, _) in previous.items():
+        ops.append((OP_REMOVE, id, 0, 0, 0, b'', _check(data)))
+
+    meta = {
+        'index': index,
+        'compression': compression,
+        'block_size': block_size,
+        'shards': types,
+        'count': count,
+        'db_size': _db_size(target, types),
+    }
+    return meta, ops
+
+
+def write_patch(base: str, target: str, p_patch: str, compression: str | None = 'zlib') -> PatchStats:
+    '''
+    生成从base到target的补丁 两者都是write_all的输出目录
+    '''
+    begin = time.perf_counter()
+    meta, ops = diff(base, target)
+
+    chunks = []
+    for op, id, cache, prefix, suffix, data, check in ops:
+        name = id.encode()
+        if len(name) > 0xFFFF:
+            raise Exception('ID too long: %s' % id)
+        chunks.append(_OP.pack(op, cache, len(name), prefix, suffix, len(data), check))
+        chunks.append(name)
+        chunks.append(data)
+    raw = b''.join(chunks)
+
+    codec = compression and find_codec(compression) or None
+    payload = codec and codec.compress(raw, b'') or raw
+    meta_data = json.dumps(meta, separators=(',', ':')).encode()
+
+    temp = p_patch + '.tmp'
+    with open(temp, 'wb') as handle:
+        handle.write(_HEADER.pack(PATCH_MAGIC, PATCH_VERSION, codec and codec.id or 0, len(meta_data), len(payload), len(raw)))
+        handle.write(meta_data)
+        handle.write(payload)
+    os.replace(temp, p_patch)
+
+    return _stats(meta, ops, os.path.getsize(p_patch), time.perf_counter() - begin)
+
+
+def read_patch(p_patch: str) -> tuple[dict[str, Any], list[PatchOp]]:
+    with open(p_patch, 'rb') as handle:
+        raw = handle.read()
+
+    if len(raw) < _HEADER.size:
+        raise Exception('%s => not a patch' % p_patch)
+    magic, version, codec, meta_size, payload_size, raw_size = _HEADER.unpack_from(raw, 0)
+    if magic != PATCH_MAGIC:
+        raise Exception('%s => not a patch' % p_patch)
+    if version != PATCH_VERSION:
+        raise Exception('%s => unsupported patch version %d' % (p_patch, version))
+    if len(raw) != _HEADER.size + meta_size + payload_size:
+        raise Exception('%s => truncated patch' % p_patch)
+
+    meta = json.loads(raw[_HEADER.size:_HEADER.size+meta_size])
+    payload = raw[_HEADER.size+meta_size:]
+    if codec:
+        payload = find_codec_id(codec).decompress(payload, b'')
+    if len(payload) != raw_size:
+        raise Exception('%s => patch is corrupted' % p_patch)
+
+    ops = []
+    pos = 0
+    while pos < len(payload):
+        op, cache, name_length, prefix, suffix, data_length, check = _OP.unpack_from(payload, pos)
+        pos += _OP.size
+        id = payload[pos:pos+name_length].decode()
+        pos += name_length
+        ops.append((op, id, cache, prefix, suffix, payload[pos:pos+data_length], check))
+        pos += data_length
+    return meta, ops
+
+
+def _stats(meta: Mapping[str, Any], ops: Sequence[PatchOp], size: int, elapsed: float, compacted: int = 0) -> PatchStats:
+    counts = {OP_ADD: 0, OP_CHANGE: 0, OP_REMOVE: 0}
+    for op in ops:
+        counts[op[0]] += 1
+    return PatchStats(
+        added=counts[OP_ADD],
+        changed=counts[OP_CHANGE],
+        removed=counts[OP_REMOVE],
+        size=size,
+        db_size=meta['db_size'],
+        time=elapsed,
+        compacted=compacted,
+    )
+
+
+def _resolve(
+    ops: Iterable[PatchOp],
+    lookup: Callable[[str], bytes | None],
+) -> tuple[list[tuple[str, bytes, int]], list[str]]:
+    '''
+    校验Op并还原记录 返回(新增与修改后的记录, 删除的ID)
+    '''
+    updated = []
+    removed = []
+    for op, id, cache, prefix, suffix, data, check in ops:
+        old = lookup(id)
+        if op == OP_ADD:
+            if old is not None:
+                raise Exception('%s => already exists' % id)
+            updated.append((id, data, cache))
+            continue
+
+        if old is None:
+            raise Exception('%s not found' % id)
+        if _check(old) != check:
+            raise Exception('%s => record does not match the patch base' % id)
+        if op == OP_REMOVE:
+            removed.append(id)
+        elif op == OP_CHANGE:
+            updated.append((id, old[:prefix] + data + old[len(old)-suffix:], cache))
+        else:
+            raise Exception('%s => unknown patch op %d' % (id, op))
+    return updated, removed
+
+
+def _stage(p_file: str, write: Callable[[IO[bytes]], Any]) -> tuple[str, str]:
+    temp = p_file + '.tmp'
+    with open(temp, 'wb') as handle:
+        write(handle)
+    return temp, p_file
+
+
+def _block_size(meta: Mapping[str, Any], table: BlockTable | None = None) -> int:
+    return meta.get('block_size') or table and table.block_size or BLOCK_SIZE
+
+
+def _plan_segment(path: str, name: str, ops: Sequence[PatchOp], meta: Mapping[str, Any]) -> dict[str, Any]:
+    '''
+    校验段中的Op 返回应用后的索引与需要追加的记录 不写入任何文件
+    '''
+    with ResourceDB(path, 0, name) as db:
+        index = dict(db._index.items())
+        updated, removed = _resolve(ops, lambda id: db.raw(id) if id in index else None)
+        plan = {
+            'name': name,
+            'binary': isinstance(db._index, BinaryIndex),
+            'table': db._blocks,
+            'block_size': _block_size(meta, db._blocks),
+            'updated': updated,
+        }
+
+    for id in removed:
+        del index[id]
+    plan['index'] = index
+    return plan
+
+
+def _stage_segment(path: str, plan: dict[str, Any]) -> list[tuple[str, str]]:
+    '''
+    追加记录 新的块表与索引写入临时文件 返回[(临时文件, 正式文件), ...]
+    '''
+    name = plan['name']
+    index = plan['index']
+    table = plan['table']
+    block_size = plan['block_size']
+
+    with open(os.path.join(path, name + '.tpd'), 'r+b') as handle:
+        end = handle.seek(0, os.SEEK_END)
+        if table is None:
+            chunks = []
+            for id, data, cache in plan['updated']:
+                index[id] = (end, len(data), cache)
+                chunks.append(data)
+                chunks.append(b'\n')
+                end += len(data) + 1
+            handle.write(b''.join(chunks))
+        else:
+            # 与写入时相同 使用原有的字典压缩新的块
+            chunk = []
+            size = 0
+
+            def flush():
+                nonlocal end, chunk, size
+                raw = b''.join(chunk)
+                data = table.codec.compress(raw, table.zdict)
+                handle.write(data)
+                table.blocks.append((end, len(data), len(raw)))
+                end += len(data)
+                chunk = []
+                size = 0
+
+            for id, data, cache in plan['updated']:
+                if chunk and size + len(data) + 1 > block_size:
+                    flush()
+                index[id] = (block_start(len(table.blocks), size), len(data), cache)
+                chunk.append(data)
+                chunk.append(b'\n')
+                size += len(data) + 1
+            if chunk:
+                flush()
+
+    plan['end'] = end
+    staged = []
+    # 块表先于索引替换 索引替换前旧的索引仍然有效
+    if table is not None:
+        staged.append(_stage(os.path.join(path, name + '.tpb'),
+                             lambda handle: write_block_table(handle, table.codec, table.zdict, table.blocks, block_size)))
+    if plan['binary']:
+        staged.append(_stage(os.path.join(path, name + '.tpi'), lambda handle: write_binary_index(handle, index)))
+    else:
+        staged.append(_stage(os.path.join(path, name + '.tpi'), lambda handle: handle.write(json.dumps(index).encode())))
+    return staged
+
+
+def _swap_segment(path: str, temp: str, name: str):
+    '''
+    用段temp替换段name 数据先于索引替换
+    '''
+    for ext in ('.tpd', '.tpb', '.tpi'):
+        if os.path.exists(os.path.join(path, temp + ext)):
+            os.replace(os.path.join(path, temp + ext), os.path.join(path, name + ext))
+        elif os.path.exists(os.path.join(path, name + ext)):
+            os.remove(os.path.join(path, name + ext))
+
+
+def _compact_segment(path: str, plan: dict[str, Any], compact: float | None) -> bool:
+    '''
+    失效的字节超过compact比例时重写段 重写时返回True
+    '''
+    table = plan['table']
+    live = sum(length + 1 for _, length, _ in plan['index'].values())
+    total = table is None and plan['end'] or sum(raw_size for _, _, raw_size in table.blocks)
+    if compact is None or not total or (total - live) / total <= compact:
+        return False
+
+    name = plan['name']
+    temp = name + '.tmp'
+    with ResourceDB(path, 0, name) as db:
+        writer = FileWriter(path, plan['binary'] and 'binary' or 'json', table and table.codec.name or None,
+                            plan['block_size'], temp)
+        with writer:
+            writer.write_many(db.records())
+    _swap_segment(path, temp, name)
+    return True
+
+
+def _plan_type(path: str, old: Sequence[str], ops: Sequence[PatchOp]) -> dict[str, tuple[bytes, int]]:
+    '''
+    段的划分变化的类型 读出全部记录并应用Op 返回{ID: (数据, cache)}
+    '''
+    records = {}
+    for name in old:
+        with ResourceDB(path, 0, name) as db:
+            for id, data, cache in db.records():
+                records[id] = (data, cache)
+
+    updated, removed = _resolve(ops, lambda id: id in records and records[id][0] or None)
+    for id in removed:
+        del records[id]
+    for id, data, cache in updated:
+        records[id] = (data, cache)
+    return records
+
+
+def _stage_type(
+    path: str,
+    new: Sequence[str],
+    records: Mapping[str, tuple[bytes, int]],
+    meta: Mapping[str, Any],
+) -> list[tuple[str, str]]:
+    '''
+    按新的划分把记录写入临时段 返回[(临时段, 段名), ...]
+    '''
+    if records and not new:
+        raise Exception('%s => type removed by the patch' % next(iter(records)))
+
+    groups = {name: [] for name in new}
+    for id, (data, cache) in records.items():
+        groups[segment_of(id, new)].append((id, data, cache))
+
+    staged = []
+    for name, group in groups.items():
+        writer = FileWriter(path, meta['index'], meta['compression'], _block_size(meta), name + '.tmp')
+        with writer:
+            writer.write_many(group)
+        staged.append((name + '.tmp', name))
+    return staged
+
+
+def apply_patch(path: str, p_patch: str, compact: float | None = COMPACT_RATIO) -> PatchStats:
+    '''
+    把补丁应用到path中的输出 db中被修改或删除的记录必须与生成补丁时的base一致
+    compact为None时不重写段
+    '''
+    begin = time.perf_counter()
+    meta, ops = read_patch(p_patch)
+
+    types = load_shards(path)
+    if (types is None) != (meta['shards'] is None):
+        raise Exception('%s => patch is for a %s db' % (path, meta['shards'] is None and 'single-file' or 'sharded'))
+
+    # 1. 校验
+    plans = []
+    rebuilt = {}
+    target = meta['shards']
+    if types is None:
+        plans.append(_plan_segment(path, 'db', ops, meta))
+    else:
+        rebuild = {T for T in {*types, *target} if types.get(T) != target.get(T)}
+        segments = {}
+        grouped = {T: [] for T in rebuild}
+        for op in ops:
+            T = record_type(op[1])
+            if T in rebuild:
+                grouped[T].append(op)
+            elif T in types:
+                segments.setdefault(segment_of(op[1], types[T]), []).append(op)
+            else:
+                raise Exception('%s not found' % op[1])
+
+        for name, group in segments.items():
+            plans.append(_plan_segment(path, name, group, meta))
+        for T in sorted(rebuild):
+            rebuilt[T] = _plan_type(path, types.get(T, ()), grouped[T])
+
+    # 2. 写入临时文件
+    staged = []
+    swapped = []
+    try:
+        for plan in plans:
+            staged.extend(_stage_segment(path, plan))
+        for T, records in rebuilt.items():
+            swapped.extend(_stage_type(path, target.get(T, ()), records, meta))
+    except BaseException:
+        for temp, _ in staged:
+            if os.path.exists(temp):
+                os.remove(temp)
+        for temp, _ in swapped:
+            remove_segment(path, temp)
+        raise
+
+    # 3. 替换
+    # 清单中的hash对应补丁前的记录 继续使用会让增量构建复用错误的字节
+    p_manifest = os.path.join(path, MANIFEST_FILE)
+    if os.path.exists(p_manifest):
+        os.remove(p_manifest)
+
+    for temp, p_file in staged:
+        os.replace(temp, p_file)
+    for temp, name in swapped:
+        _swap_segment(path, temp, name)
+    if rebuilt:
+        save_shards(path, target)
+        keep = {name for names in target.values() for name in names}
+        for T in rebuilt:
+            for name in types.get(T, ()):
+                if name not in keep:
+                    remove_segment(path, name)
+
+    compacted = 0
+    for plan in plans:
+        compacted += _compact_segment(path, plan, compact)
+
+    return _stats(meta, ops, os.path.getsize(p_patch), time.perf_counter() - begin, compacted)
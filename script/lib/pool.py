@@ -0,0 +1,149 @@
+from __future__ import annotations
+import json
+from typing import *
+from lib.table import json_default
+
+
+# 常量池 开启constant_pool时重复出现的字符串与表格只写入@pool记录一次
+#   记录中对应的值输出为{"$": 下标}
+#   字符串 dict的值或列表中的字符串 dict的key不参与 类型标记T不参与 不经过hook也能按T分类
+#   表格 dict_table/list_table/attribute_table的输出 即含'x'与'y'的dict 表格内部不再拆分
+# 出现两次以上且替换后总长度变短的值才放入常量池 按第一次出现的顺序排列
+#
+# 记录中原有的以$开头的key多加一个$ 读取时去掉 因此{"$": 下标}只可能是引用
+# 读取时通过json.loads的object_hook替换为同一个解码后的对象 多条记录共享 不要修改
+# @pool记录本身不经过转义 读取时也不使用hook
+
+POOL_REF = '$'
+
+# 不放入常量池的key
+POOL_SKIP = 'T'
+
+
+def _key(value) -> str:
+    return json.dumps(value, separators=(',', ':'), default=json_default)
+
+
+def _is_table(value: Mapping) -> bool:
+    return 'x' in value and 'y' in value
+
+
+def _escape(obj) -> Any:
+    '''
+    以$开头的key前面再加一个$
+    '''
+    if isinstance(obj, dict):
+        return {(key[:1] == POOL_REF and POOL_REF + key or key): _escape(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_escape(value) for value in obj]
+    return obj
+
+
+def _values(obj) -> Iterator:
+    '''
+    可放入常量池的值 不进入表格内部
+    '''
+    if isinstance(obj, str):
+        yield obj
+    elif isinstance(obj, dict):
+        if _is_table(obj):
+            yield obj
+            return
+        for key, value in obj.items():
+            if key != POOL_SKIP:
+                yield from _values(value)
+    elif isinstance(obj, (list, tuple)):
+        for value in obj:
+            yield from _values(value)
+
+
+class ConstantPool:
+    values: list
+
+    # 字符串按原值 表格按json查找下标
+    strings: dict[str, int]
+    tables: dict[str, int]
+
+    def __init__(self, values: Sequence = ()) -> None:
+        self.values = [*values]
+        self.strings = {}
+        self.tables = {}
+        for i, value in enumerate(self.values):
+            if isinstance(value, str):
+                self.strings[value] = i
+            else:
+                self.tables[_key(value)] = i
+        # from_records中计算过的表格json id(表格) -> (表格, json)
+        self._keys = {}
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    @classmethod
+    def from_records(cls, records: Iterable[Any]) -> ConstantPool:
+        counts = {}
+        first = {}
+        sizes = {}
+        keys = {}
+        for record in records:
+            for value in _values(record):
+                # 字符串以(值,)计数 与表格的json区分
+                if isinstance(value, str):
+                    key = (value,)
+                else:
+                    key = _key(value)
+                    keys[id(value)] = (value, key)
+                if key in counts:
+                    counts[key] += 1
+                else:
+                    counts[key] = 1
+                    first[key] = value
+                    sizes[key] = len(_key(value)) if isinstance(value, str) else len(key)
+
+        # 引用的长度按常量池最大下标估算
+        candidates = [key for key, count in counts.items() if count > 1]
+        ref = len('{"%s":%d}' % (POOL_REF, len(candidates)))
+        pool = cls([first[key] for key in candidates if (counts[key] - 1) * sizes[key] > counts[key] * ref])
+        pool._keys = keys
+        return pool
+
+    def intern(self, obj) -> Any:
+        '''
+        把记录中池内的值替换为引用
+        '''
+        if isinstance(obj, str):
+            i = self.strings.get(obj)
+            return obj if i is None else {POOL_REF: i}
+        if isinstance(obj, dict):
+            if _is_table(obj):
+                memo = self._keys.get(id(obj))
+                key = memo[1] if memo and memo[0] is obj else _key(obj)
+                i = self.tables.get(key)
+                if i is not None:
+                    return {POOL_REF: i}
+                # 表格内部没有以$开头的key时不复制
+                return _escape(obj) if '"' + POOL_REF in key else obj
+            return {
+                (key[:1] == POOL_REF and POOL_REF + key or key): value if key == POOL_SKIP else self.intern(value)
+                for key, value in obj.items()
+            }
+        if isinstance(obj, (list, tuple)):
+            return [self.intern(value) for value in obj]
+        return obj
+
+    def serialize(self) -> list:
+        return self.values
+
+
+def pool_hook(values: Sequence) -> Callable[[dict], Any]:
+    '''
+    json.loads的object_hook 引用替换为values中的对象
+    '''
+    def hook(obj: dict):
+        if len(obj) == 1 and POOL_REF in obj:
+            return values[obj[POOL_REF]]
+        # 转义过的key
+        if any(key[:1] == POOL_REF for key in obj):
+            return {(key[:1] == POOL_REF and key[1:] or key): value for key, value in obj.items()}
+        return obj
+    return hook
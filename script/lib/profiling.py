@@ -0,0 +1,94 @@
+from contextlib import contextmanager
+import json
+import time
+from typing import *
+from lib.base import Resource
+
+
+# 构建阶段
+#   validate  serialize中除find以外的部分 即各ser_*校验与表格构建
+#   find      Resource.find/Resource.is_id 引用查找
+#   dumps     json.dumps与encode
+#   write     FileWriter写入 索引记在@index下
+#   reuse     增量构建中直接复用的记录 只记录次数与字节数
+ProfileStage = Literal['validate', 'find', 'dumps', 'write', 'reuse']
+
+# (资源类型, 阶段, 耗时, 调用次数, 字节数)
+ProfileHook = Callable[[str, str, float, int, int], None]
+
+
+class BuildProfile:
+    '''
+    按资源类型与阶段统计的构建耗时 调用次数 输出字节数
+    '''
+
+    # stats[类型][阶段] = [耗时, 调用次数, 字节数]
+    stats: dict[str, dict[str, list]]
+    hook: ProfileHook | None
+
+    find_time: float
+    find_calls: int
+
+    def __init__(self, hook: ProfileHook | None = None) -> None:
+        self.stats = {}
+        self.hook = hook
+        self.find_time = 0.0
+        self.find_calls = 0
+
+    def add(self, T: str, stage: ProfileStage, elapsed: float, calls: int = 1, size: int = 0):
+        stat = self.stats.setdefault(T, {}).setdefault(stage, [0.0, 0, 0])
+        stat[0] += elapsed
+        stat[1] += calls
+        stat[2] += size
+        if self.hook:
+            self.hook(T, stage, elapsed, calls, size)
+
+    def merge(self, stats: Mapping[str, Mapping[str, Sequence]]):
+        '''
+        合并worker进程中的统计
+        '''
+        for T, stages in stats.items():
+            for stage, (elapsed, calls, size) in stages.items():
+                self.add(T, stage, elapsed, calls, size)
+
+    def report(self) -> dict[str, Any]:
+        types = {}
+        total = {}
+        for T, stages in self.stats.items():
+            types[T] = {}
+            for stage, (elapsed, calls, size) in stages.items():
+                types[T][stage] = {'time': elapsed, 'calls': calls, 'bytes': size}
+                stat = total.setdefault(stage, {'time': 0.0, 'calls': 0, 'bytes': 0})
+                stat['time'] += elapsed
+                stat['calls'] += calls
+                stat['bytes'] += size
+        return {'types': types, 'total': total}
+
+    def to_json(self, indent: int | None = 2) -> str:
+        return json.dumps(self.report(), indent=indent)
+
+    @contextmanager
+    def instrument(self):
+        '''
+        构建期间替换Resource.find/Resource.is_id以统计引用查找 关闭profile时没有任何开销
+        '''
+        saved = Resource.__dict__['find'], Resource.__dict__['is_id']
+        find, is_id = saved[0].__func__, saved[1].__func__
+        profile = self
+
+        def timed(func):
+            def wrapper(cls, *args, **kwargs):
+                begin = time.perf_counter()
+                try:
+                    return func(cls, *args, **kwargs)
+                finally:
+                    profile.find_time += time.perf_counter() - begin
+                    profile.find_calls += 1
+            return classmethod(wrapper)
+
+        Resource.find = timed(find)
+        Resource.is_id = timed(is_id)
+        try:
+            yield self
+        finally:
+            Resource.find, Resource.is_id = saved
@@ -0,0 +1,271 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+import gc
+import json
+import mmap
+import os
+import time
+from typing import *
+from lib.codec import BlockTable, split_start
+from lib.index import BinaryIndex, load_index
+from lib.pool import pool_hook
+
+
+@contextmanager
+def gc_paused():
+    '''
+    暂停循环GC 已经暂停时不做任何事 嵌套使用时只有最外层恢复
+    '''
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class ResourceDB:
+    '''
+    db.tpd/db.tpi的只读访问
+    数据文件通过mmap映射 记录在第一次访问时才解码
+    cache=1的记录解码后常驻 其余记录放在容量有限的LRU中
+    存在db.tpb时db.tpd为压缩块 读取记录时只解压所在的块 最近解压的几个块会保留
+    存在@pool记录时 记录中的常量池引用解码为@pool中的同一个对象
+    应用过补丁(见lib.patch)的db.tpd中可能留有索引不再引用的字节
+    '''
+
+    BLOCK_CACHE = 4
+
+    _h_data: IO[bytes] | None
+    _data: mmap.mmap | bytes
+    _index: Mapping[str, tuple[int, int, int]]
+    _pinned: dict[str, Any]
+    _lru: OrderedDict[str, Any]
+    _capacity: int
+    _blocks: BlockTable | None
+    _block_cache: OrderedDict[int, bytes]
+    _hook: Callable[[dict], Any] | None
+    _close: bool
+
+    hits: int
+    misses: int
+    evictions: int
+    decode_count: int
+    decode_time: float
+    block_count: int
+
+    def __init__(
+        self,
+        path: str,
+        capacity: int = 4096,
+        name: str = 'db',
+        object_hook: Callable[[dict], Any] | None = None,
+    ) -> None:
+        '''
+        读取<name>.tpd/<name>.tpi/<name>.tpb object_hook默认由@pool记录生成
+        '''
+        self._h_data = None
+        self._data = b''
+        self._index = {}
+        self._pinned = {}
+        self._lru = OrderedDict()
+        self._capacity = capacity
+        self._blocks = None
+        self._block_cache = OrderedDict()
+        self._hook = None
+        self._close = False
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.decode_count = 0
+        self.decode_time = 0.0
+        self.block_count = 0
+
+        if capacity < 0:
+            raise Exception('capacity must large or equal than 0')
+
+        self._index = load_index(os.path.join(path, name + '.tpi'))
+        if os.path.exists(os.path.join(path, name + '.tpb')):
+            self._blocks = BlockTable(os.path.join(path, name + '.tpb'))
+        self._h_data = open(os.path.join(path, name + '.tpd'), 'rb')
+        if os.fstat(self._h_data.fileno()).st_size > 0:
+            self._data = mmap.mmap(self._h_data.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if object_hook is not None:
+            self._hook = object_hook
+        elif '@pool' in self._index:
+            self._hook = pool_hook(self.get('@pool'))
+
+    def __del__(self):
+        self.close()
+
+    def __enter__(self):
+        if self._close:
+            raise Exception('Already closed')
+        return self
+
+    def __exit__(self, type, value, trace):
+        self.close()
+
+    def close(self):
+        if self._close:
+            return
+        self._close = True
+
+        self._pinned = {}
+        self._lru = OrderedDict()
+        self._block_cache = OrderedDict()
+        self._hook = None
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._data = b''
+        if isinstance(self._index, BinaryIndex):
+            self._index.close()
+        if self._h_data:
+            self._h_data.close()
+            self._h_data = None
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, id: str) -> bool:
+        return id in self._index
+
+    def __getitem__(self, id: str) -> Any:
+        return self.get(id)
+
+    def ids(self) -> Iterator[str]:
+        return iter(self._index)
+
+    def raw(self, id: str) -> bytes:
+        '''
+        记录的原始字节 不经过解码和缓存
+        '''
+        if self._close:
+            raise Exception('Already closed')
+
+        if id not in self._index:
+            raise Exception('%s not found' % id)
+
+        start, length, _ = self._index[id]
+        return self._record(start, length)
+
+    def _record(self, start: int, length: int) -> bytes:
+        if self._blocks is None:
+            return self._data[start:start+length]
+
+        block, offset = split_start(start)
+        if block in self._block_cache:
+            self._block_cache.move_to_end(block)
+            raw = self._block_cache[block]
+        else:
+            raw = self._blocks.decompress(self._data, block)
+            self.block_count += 1
+            self._block_cache[block] = raw
+            if len(self._block_cache) > self.BLOCK_CACHE:
+                self._block_cache.popitem(last=False)
+        return raw[offset:offset+length]
+
+    def get(self, id: str) -> Any:
+        if self._close:
+            raise Exception('Already closed')
+
+        if id in self._pinned:
+            self.hits += 1
+            return self._pinned[id]
+
+        if id in self._lru:
+            self.hits += 1
+            self._lru.move_to_end(id)
+            return self._lru[id]
+
+        self.misses += 1
+        if id not in self._index:
+            raise Exception('%s not found' % id)
+
+        start, length, cache = self._index[id]
+        begin = time.perf_counter()
+        res = json.loads(self._record(start, length), object_hook=self._hook)
+        self.decode_time += time.perf_counter() - begin
+        self.decode_count += 1
+
+        if cache:
+            self._pinned[id] = res
+        elif self._capacity > 0:
+            self._lru[id] = res
+            while len(self._lru) > self._capacity:
+                self._lru.popitem(last=False)
+                self.evictions += 1
+
+        return res
+
+    def records(self) -> Iterator[tuple[str, bytes, int]]:
+        '''
+        按文件中的顺序产生(ID, 原始字节, cache) 不经过解码和缓存 每个压缩块只解压一次
+        '''
+        if self._close:
+            raise Exception('Already closed')
+
+        for id, (start, length, cache) in sorted(self._index.items(), key=lambda item: item[1][0]):
+            yield id, self._record(start, length), cache
+
+    def decode_all(self) -> dict[str, Any]:
+        '''
+        一次解析全部记录 按写入顺序返回{ID: 记录} 不经过缓存
+        '''
+        if self._close:
+            raise Exception('Already closed')
+
+        entries = sorted(self._index.items(), key=lambda item: item[1][0])
+        if not entries:
+            return {}
+
+        if self._blocks is None:
+            raw = self._data[:]
+            starts = [start for _, (start, _, _) in entries]
+        else:
+            chunks = [self._blocks.decompress(self._data, block) for block in range(len(self._blocks))]
+            self.block_count += len(chunks)
+            bases = [0]
+            for chunk in chunks:
+                bases.append(bases[-1] + len(chunk))
+            raw = b''.join(chunks)
+            starts = []
+            for _, (start, _, _) in entries:
+                block, offset = split_start(start)
+                starts.append(bases[block] + offset)
+
+        # 记录之间以换行分隔 JSON输出中不含换行
+        # 应用过补丁的文件中留有失效的记录 此时只拼接索引中的记录
+        if sum(length + 1 for _, (_, length, _) in entries) == len(raw):
+            body = raw[:-1].replace(b'\n', b',')
+        else:
+            body = b','.join([raw[start:start+entry[1][1]] for start, entry in zip(starts, entries)])
+
+        # 解析期间新建的对象都会保留 暂停循环GC 否则反复扫描已解析的部分
+        with gc_paused():
+            begin = time.perf_counter()
+            try:
+                values = json.loads(b'[' + body + b']', object_hook=self._hook)
+            finally:
+                self.decode_time += time.perf_counter() - begin
+        self.decode_count += len(values)
+
+        if len(values) != len(entries):
+            raise Exception('%d records decoded, %d expected' % (len(values), len(entries)))
+        return dict(zip([id for id, _ in entries], values))
+
+    def stats(self) -> dict[str, int | float]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'decode_count': self.decode_count,
+            'decode_time': self.decode_time,
+            'block_count': self.block_count,
+            'pinned': len(self._pinned),
+            'cached': len(self._lru),
+            'capacity': self._capacity,
+        }
@@ -0,0 +1,180 @@
+from __future__ import annotations
+from array import array
+import random
+from typing import *
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# 随机池的抽取 别名法(Vose) 建表O(n) 每次抽取O(1)
+#
+# 别名表 prob[k] alias[k]
+#   均匀选一个下标k 以prob[k]的概率取k 否则取alias[k]
+#
+# 构建时别名表写入RandomAttributes/RandomEntries记录的'alias'
+# 有NumPy时按批量向量化抽取 否则退回random.Random逐个抽取 两者的随机序列不同
+
+
+def alias_table(weights: Sequence[int | float]) -> tuple[list[float], list[int]]:
+    n = len(weights)
+    total = sum(weights)
+    if n == 0 or total <= 0:
+        raise Exception('Total weight must greater than 0')
+
+    scaled = [w * n / total for w in weights]
+    prob = [1.0] * n
+    alias = list(range(n))
+
+    small = [k for k, p in enumerate(scaled) if p < 1.0]
+    large = [k for k, p in enumerate(scaled) if p >= 1.0]
+    while small and large:
+        s = small.pop()
+        l = large.pop()
+        prob[s] = scaled[s]
+        alias[s] = l
+        scaled[l] = scaled[l] + scaled[s] - 1.0
+        if scaled[l] < 1.0:
+            small.append(l)
+        else:
+            large.append(l)
+
+    # 剩余的下标只受浮点误差影响 概率视为1
+    return prob, alias
+
+
+def make_rng(seed: int | None = None):
+    '''
+    相同的seed得到相同的抽取结果
+    '''
+    if numpy is not None:
+        return numpy.random.default_rng(seed)
+    return random.Random(seed)
+
+
+class PoolSampler:
+    '''
+    RandomAttributes/RandomEntries的抽取器
+    values[k][level]为第k项在该等级的值 属性池为数值 词条池为[piece, plus]
+    '''
+
+    pool_id: str
+    random_ids: Sequence[int]
+    values: Sequence[Sequence]
+    prob: Sequence[float]
+    alias: Sequence[int]
+
+    def __init__(
+        self,
+        pool_id: str,
+        random_ids: Sequence[int],
+        values: Sequence[Sequence],
+        prob: Sequence[float],
+        alias: Sequence[int],
+    ) -> None:
+        self.pool_id = pool_id
+        if numpy is not None:
+            self.random_ids = numpy.asarray(random_ids, dtype=numpy.uint16)
+            self.values = numpy.asarray(values)
+            self.prob = numpy.asarray(prob, dtype=numpy.float64)
+            self.alias = numpy.asarray(alias, dtype=numpy.intp)
+        else:
+            self.random_ids = array('H', random_ids)
+            self.values = [[*v] for v in values]
+            self.prob = [*prob]
+            self.alias = [*alias]
+
+    @classmethod
+    def from_pool(cls, pool) -> PoolSampler:
+        prob, alias = alias_table([v.weight for v in pool.values])
+        return cls(
+            pool.res_id,
+            [v.random_id for v in pool.values],
+            [v.values.tolist() if hasattr(v.values, 'tolist') else v.values for v in pool.values],
+            prob,
+            alias,
+        )
+
+    @classmethod
+    def from_record(cls, record: Mapping[str, Any]) -> PoolSampler:
+        '''
+        从db中的记录构建 直接使用构建时生成的别名表
+        '''
+        return cls(
+            record['res_id'],
+            [v['random_id'] for v in record['values']],
+            [v['values'] for v in record['values']],
+            record['alias']['p'],
+            record['alias']['a'],
+        )
+
+    def __len__(self) -> int:
+        return len(self.prob)
+
+    def indices(self, count: int, rng) -> Sequence[int]:
+        n = len(self.prob)
+        if numpy is not None and isinstance(rng, numpy.random.Generator):
+            k = rng.integers(0, n, count)
+            return numpy.where(rng.random(count) < self.prob[k], k, self.alias[k])
+
+        result = array('l')
+        for _ in range(count):
+            k = int(rng.random() * n)
+            result.append(k if rng.random() < self.prob[k] else self.alias[k])
+        return result
+
+    def roll(self, count: int, level: int | Sequence[int], rng) -> dict[str, Any]:
+        '''
+        抽取count次 level为等级下标(0 <= level < max_level) 也可以是每次抽取各自的等级
+        返回{'random_id': [...], 'values': [...]}
+        '''
+        idx = self.indices(count, rng)
+        if numpy is not None and isinstance(self.values, numpy.ndarray):
+            return {
+                'random_id': self.random_ids[idx],
+                'values': self.values[idx, numpy.asarray(level)],
+            }
+
+        levels = [level] * count if type(level) == int else level
+        return {
+            'random_id': array('H', (self.random_ids[k] for k in idx)),
+            'values': [self.values[k][l] for k, l in zip(idx, levels)],
+        }
+
+
+class AccessorySampler:
+    '''
+    装饰品的随机属性/随机词条 每个池各抽取一项
+    '''
+
+    pools: list[PoolSampler]
+
+    def __init__(self, pools: Sequence[PoolSampler]) -> None:
+        self.pools = [*pools]
+
+    @classmethod
+    def from_accessory(cls, accessory) -> AccessorySampler:
+        '''
+        池的顺序与db记录一致 先随机属性后随机词条 同一seed与from_db抽取结果相同
+        '''
+        from lib.base import Resource
+        from lib.accessory import RandomEntries
+        pools = [Resource.find(id) for id in accessory.random_values]
+        pools.sort(key=lambda pool: isinstance(pool, RandomEntries))
+        return cls([PoolSampler.from_pool(pool) for pool in pools])
+
+    @classmethod
+    def from_db(cls, db, accessory_id: str) -> AccessorySampler:
+        '''
+        db为lib.reader.ResourceDB 记录需为未打包的输出
+        '''
+        accessory = db[accessory_id]
+        # 空的池列表不会写入记录
+        pools = [*accessory.get('random_attributes', []), *accessory.get('random_entries', [])]
+        return cls([PoolSampler.from_record(db[id]) for id in pools])
+
+    def roll(self, count: int, level: int | Sequence[int], seed: int | None = None, rng=None) -> dict[str, dict[str, Any]]:
+        rng = rng or make_rng(seed)
+        return {pool.pool_id: pool.roll(count, level, rng) for pool in self.pools}
@@ -0,0 +1,261 @@
+from __future__ import annotations
+from dataclasses import dataclass
+import time
+from typing import *
+from lib.script import TickScript
+
+
+# TickScript的分层时间轮调度 每次tick的开销与到期的数量成正比
+#
+# 语义 在第now次tick后注册的脚本
+#   第一次在now+1+delay触发 之后每隔interval触发一次 共触发times次 times为0时直到取消为止
+#   interval为0时同一次tick中连续触发剩余的次数
+#
+# 时间轮 4层 每层256个槽 第L层的槽按到期时间的第8L~8L+7位分配
+#   放在与now最高的不同位所在的层 低层转完一圈时把高层对应槽中的定时器重新分配到低层
+#   超过2^32次tick的定时器放在overflow中 第3层转完一圈时重新分配
+#
+# 取消只做标记 定时器在到达所在的槽时丢弃
+
+WHEEL_BITS = 8
+WHEEL_SIZE = 1 << WHEEL_BITS
+WHEEL_MASK = WHEEL_SIZE - 1
+WHEEL_LEVELS = 4
+
+# (第几次tick, 触发次数, 耗时)
+SchedulerHook = Callable[[int, int, float], None]
+
+
+class TickTimer:
+    '''
+    已注册的脚本 作为取消时的句柄
+    '''
+
+    __slots__ = ('script', 'owner', 'due', 'interval', 'remaining', 'fired', 'cancelled')
+
+    script: Any
+    owner: Any
+
+    # 下一次触发的tick
+    due: int
+    interval: int
+
+    # 剩余的触发次数 None为不限
+    remaining: int | None
+    fired: int
+    cancelled: bool
+
+    def __init__(self, script: Any, owner: Any, due: int, interval: int, remaining: int | None) -> None:
+        self.script = script
+        self.owner = owner
+        self.due = due
+        self.interval = interval
+        self.remaining = remaining
+        self.fired = 0
+        self.cancelled = False
+
+    @property
+    def active(self) -> bool:
+        return not self.cancelled and self.remaining != 0
+
+
+@dataclass
+class SchedulerMetrics:
+    # 已处理的tick数
+    now: int
+
+    # 等待触发的定时器数量
+    pending: int
+
+    # 上一次tick的触发次数与耗时
+    fired: int
+    tick_time: float
+
+    # 累计的触发次数 tick耗时 从高层重新分配的定时器数量
+    total_fired: int
+    total_time: float
+    cascaded: int
+
+
+def _timing(script: Any) -> tuple[int, int, int]:
+    # TickScript或者db中的TickScript记录
+    if isinstance(script, TickScript):
+        delay, interval, times = script.delay, script.interval, script.times
+    elif isinstance(script, Mapping) and script.get('T') == 'TickScript':
+        delay, interval, times = script['delay'], script['interval'], script['times']
+    else:
+        raise Exception('%s => must be a TickScript' % type(script).__name__)
+
+    if type(delay) != int or delay < 0 or type(interval) != int or interval < 0 or type(times) != int or times < 0:
+        raise Exception('TickScript => delay/interval/times must be int not less than 0')
+    if interval == 0 and times == 0:
+        raise Exception('TickScript => interval 0 requires times greater than 0')
+    return delay, interval, times
+
+
+class TickScheduler:
+    '''
+    tick()推进一次 返回本次触发的定时器 同一定时器在一次tick中触发几次就出现几次
+    '''
+
+    now: int
+    pending: int
+    hook: SchedulerHook | None
+
+    def __init__(self, now: int = 0, hook: SchedulerHook | None = None) -> None:
+        self.now = now
+        self.pending = 0
+        self.hook = hook
+        self._wheels = [[[] for _ in range(WHEEL_SIZE)] for _ in range(WHEEL_LEVELS)]
+        self._overflow = []
+
+        self._fired = 0
+        self._tick_time = 0.0
+        self._total_fired = 0
+        self._total_time = 0.0
+        self._cascaded = 0
+
+    def _place(self, timer: TickTimer):
+        due = timer.due
+        diff = due ^ self.now
+        for level in range(WHEEL_LEVELS):
+            if diff < 1 << WHEEL_BITS * (level + 1):
+                self._wheels[level][due >> WHEEL_BITS * level & WHEEL_MASK].append(timer)
+                return
+        self._overflow.append(timer)
+
+    def schedule(self, script: TickScript | Mapping[str, Any], owner: Any = None) -> TickTimer:
+        delay, interval, times = _timing(script)
+        timer = TickTimer(script, owner, self.now + 1 + delay, interval, times or None)
+        self._place(timer)
+        self.pending += 1
+        return timer
+
+    def schedule_many(self, items: Iterable[tuple[TickScript | Mapping[str, Any], Any]]) -> list[TickTimer]:
+        '''
+        批量注册 [(脚本, owner), ...] 任何一个脚本有误时都不注册
+        '''
+        start = self.now + 1
+        timers = []
+        for script, owner in items:
+            delay, interval, times = _timing(script)
+            timers.append(TickTimer(script, owner, start + delay, interval, times or None))
+
+        place = self._place
+        for timer in timers:
+            place(timer)
+        self.pending += len(timers)
+        return timers
+
+    def schedule_buff(self, buff, owner: Any = None) -> TickTimer | None:
+        '''
+        注册Buff.on_tick 没有TickScript时返回None
+        '''
+        if isinstance(buff.on_tick, TickScript):
+            return self.schedule(buff.on_tick, owner)
+        return None
+
+    def cancel(self, timer: TickTimer) -> bool:
+        if not timer.active:
+            return False
+        timer.cancelled = True
+        self.pending -= 1
+        return True
+
+    def cancel_many(self, timers: Iterable[TickTimer]) -> int:
+        count = 0
+        for timer in timers:
+            if timer.active:
+                timer.cancelled = True
+                count += 1
+        self.pending -= count
+        return count
+
+    def cancel_owner(self, owner: Any) -> int:
+        '''
+        取消owner的所有定时器 需要遍历整个时间轮
+        '''
+        timers = [timer for wheel in self._wheels for slot in wheel for timer in slot if timer.owner is owner]
+        timers.extend(timer for timer in self._overflow if timer.owner is owner)
+        return self.cancel_many(timers)
+
+    def _cascade(self, level: int):
+        slot = self._wheels[level][self.now >> WHEEL_BITS * level & WHEEL_MASK]
+        if not slot:
+            return
+        self._wheels[level][self.now >> WHEEL_BITS * level & WHEEL_MASK] = []
+        for timer in slot:
+            if not timer.cancelled:
+                self._place(timer)
+                self._cascaded += 1
+
+    def tick(self) -> list[TickTimer]:
+        begin = time.perf_counter()
+        self.now += 1
+        now = self.now
+
+        # 低层转完一圈 从高层取下一批
+        if now & WHEEL_MASK == 0:
+            for level in range(1, WHEEL_LEVELS):
+                self._cascade(level)
+                if now >> WHEEL_BITS * level & WHEEL_MASK:
+                    break
+            else:
+                overflow, self._overflow = self._overflow, []
+                for timer in overflow:
+                    if not timer.cancelled:
+                        self._place(timer)
+                        self._cascaded += 1
+
+        wheel = self._wheels[0]
+        slot = wheel[now & WHEEL_MASK]
+        fired = []
+        if slot:
+            wheel[now & WHEEL_MASK] = []
+            for timer in slot:
+                if timer.cancelled:
+                    continue
+                if timer.interval == 0:
+                    fired.extend([timer] * timer.remaining)
+                    timer.fired += timer.remaining
+                    timer.remaining = 0
+                    self.pending -= 1
+                    continue
+
+                fired.append(timer)
+                timer.fired += 1
+                if timer.remaining is not None:
+                    timer.remaining -= 1
+                    if timer.remaining == 0:
+                        self.pending -= 1
+                        continue
+                timer.due = now + timer.interval
+                self._place(timer)
+
+        elapsed = time.perf_counter() - begin
+        self._fired = len(fired)
+        self._tick_time = elapsed
+        self._total_fired += len(fired)
+        self._total_time += elapsed
+        if self.hook:
+            self.hook(now, len(fired), elapsed)
+        return fired
+
+    def advance(self, ticks: int) -> Iterator[tuple[int, list[TickTimer]]]:
+        '''
+        推进ticks次 依次产生(第几次tick, 触发的定时器)
+        '''
+        for _ in range(ticks):
+            fired = self.tick()
+            yield self.now, fired
+
+    def metrics(self) -> SchedulerMetrics:
+        return SchedulerMetrics(
+            now=self.now,
+            pending=self.pending,
+            fired=self._fired,
+            tick_time=self._tick_time,
+            total_fired=self._total_fired,
+            total_time=self._total_time,
+            cascaded=self._cascaded,
+        )
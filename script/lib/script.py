@@ -1,5 +1,121 @@
 from dataclasses import dataclass, field
+import hashlib
+import importlib.util
+import marshal
+import os
 from lib.base import *
+from lib.build import BuildOptions, build_stage
+
+
+# 脚本表 开启script_table时所有脚本源码按内容hash去重写入@scripts记录
+#   {'hash': [hash, ...], 'script': [源码, ...]} 句柄即下标 记录中的'script'输出为句柄
+#
+# 脚本在构建时编译一次(Python语法) 编译结果以marshal格式缓存在script_cache目录下的<hash>.pyc
+# 缓存文件以当前解释器的MAGIC_NUMBER开头 解释器版本不同时重新编译
+# 命中缓存时不再检查语法 缓存目录必须只有当前用户可写 否则其他用户可以放入任意代码
+
+
+def script_hash(source: str) -> str:
+    return hashlib.blake2b(source.encode(), digest_size=16).hexdigest()
+
+
+class ScriptTable:
+    '''
+    去重后的脚本源码 按首次出现的顺序分配句柄
+    '''
+
+    hashes: list[str]
+    sources: list[str]
+    handles: dict[str, int]
+
+    def __init__(self) -> None:
+        self.hashes = []
+        self.sources = []
+        self.handles = {}
+
+    def __len__(self) -> int:
+        return len(self.sources)
+
+    def add(self, source: str) -> int:
+        hash = script_hash(source)
+        handle = self.handles.get(hash)
+        if handle is None:
+            handle = self.handles[hash] = len(self.sources)
+            self.hashes.append(hash)
+            self.sources.append(source)
+        return handle
+
+    def handle(self, source: str, where: str = '?') -> int:
+        handle = self.handles.get(script_hash(source))
+        if handle is None:
+            raise Exception('%s => not in the script table' % where)
+        return handle
+
+    def serialize(self) -> dict[str, list[str]]:
+        return {'hash': self.hashes, 'script': self.sources}
+
+
+# 最近一次构建的脚本表 fork出的worker直接使用
+_script_table_: ScriptTable | None = None
+
+
+def check_script_cache(cache: str, where: str = '?'):
+    '''
+    不存在时以0700创建 已存在时必须属于当前用户且其他用户不可写
+    '''
+    os.makedirs(cache, mode=0o700, exist_ok=True)
+    if os.name != 'posix':
+        return
+
+    stat = os.stat(cache)
+    if stat.st_uid != os.getuid():
+        raise Exception('%s => script cache %s is not owned by the current user' % (where, cache))
+    if stat.st_mode & 0o022:
+        raise Exception('%s => script cache %s is writable by other users' % (where, cache))
+
+
+def compile_script(source: str, where: str = '?', cache: str | None = None):
+    '''
+    检查语法并编译 cache为缓存目录 命中时不再编译
+    '''
+    hash = script_hash(source)
+    p_cache = cache and os.path.join(cache, hash + '.pyc')
+    magic = importlib.util.MAGIC_NUMBER
+
+    if cache:
+        check_script_cache(cache, where)
+
+    # 不属于当前用户的缓存文件不使用 重新编译后覆盖
+    if p_cache and os.path.exists(p_cache) and (os.name != 'posix' or os.stat(p_cache).st_uid == os.getuid()):
+        with open(p_cache, 'rb') as handle:
+            data = handle.read()
+        if data.startswith(magic):
+            try:
+                return marshal.loads(data[len(magic):])
+            except (EOFError, ValueError, TypeError):
+                # 缓存损坏 重新编译
+                pass
+
+    try:
+        code = compile(source, '<script %s>' % hash, 'exec', dont_inherit=True)
+    except SyntaxError as e:
+        raise Exception('%s => invalid script at line %s: %s' % (where, e.lineno, e.msg))
+
+    if p_cache:
+        temp = '%s.%d.tmp' % (p_cache, os.getpid())
+        with open(temp, 'wb') as handle:
+            handle.write(magic + marshal.dumps(code))
+        os.replace(temp, p_cache)
+    return code
+
+
+def ser_script_source(val, where: str = '?'):
+    val = ser_str(val, where)
+    if output_options.script_handles:
+        if _script_table_ is None:
+            raise Exception('%s => script table is not built' % where)
+        return _script_table_.handle(val, where)
+    return val
 
 
 @dataclass
@@ -25,7 +141,7 @@ class BuildScript(Script):
     def serialize(self, where: str = '?') -> dict[str, Any]:
         return {
             **super().serialize(),
-            'script': ser_str(self.script, where)
+            'script': ser_script_source(self.script, where)
         }
 
 
@@ -46,7 +162,7 @@ class HitScript(Script):
     def serialize(self, where: str = '?') -> dict[str, Any]:
         return {
             **super().serialize(),
-            'script': ser_str(self.script, where)
+            'script': ser_script_source(self.script, where)
         }
 
 
@@ -67,7 +183,7 @@ class HurtScript(Script):
     def serialize(self, where: str = '?') -> dict[str, Any]:
         return {
             **super().serialize(),
-            'script': ser_str(self.script, where)
+            'script': ser_script_source(self.script, where)
         }
 
 
@@ -88,7 +204,7 @@ class HealScript(Script):
     def serialize(self, where: str = '?') -> dict[str, Any]:
         return {
             **super().serialize(),
-            'script': ser_str(self.script, where)
+            'script': ser_script_source(self.script, where)
         }
 
 
@@ -112,8 +228,59 @@ class TickScript(Script):
     def serialize(self, where: str = '?') -> dict[str, Any]:
         return {
             **super().serialize(),
-            'script': ser_str(self.script, where),
+            'script': ser_script_source(self.script, where),
             'delay': ser_int(self.delay, min=0, where=where),
             'interval': ser_int(self.interval, min=0, where=where),
             'times': ser_int(self.times, min=0, where=where),
         }
+
+
+def ser_script(val, where: str = '?', optional: bool = False):
+    if optional and val is None:
+        return None
+
+    if not isinstance(val, Script):
+        raise Exception('%s => must be a Script' % where)
+
+    return val.serialize(where)
+
+
+def resource_scripts(res: Resource) -> Iterator[tuple[str, Script]]:
+    '''
+    资源字段中的脚本 (字段名, 脚本)
+    '''
+    for name, value in vars(res).items():
+        if isinstance(value, Script):
+            yield name, value
+        elif isinstance(value, (list, tuple)):
+            for i, item in enumerate(value):
+                if isinstance(item, Script):
+                    yield '%s[%d]' % (name, i), item
+
+
+@build_stage
+def _script_table(resources: list[Resource], options: BuildOptions):
+    global _script_table_
+
+    if not options.script_table:
+        return
+
+    table = ScriptTable()
+    for res in resources:
+        for name, script in resource_scripts(res):
+            where = '%s.%s' % (res.res_id, name)
+            source = ser_str(getattr(script, 'script', None), where + '.script')
+            if script_hash(source) not in table.handles:
+                compile_script(source, where + '.script', options.script_cache)
+            table.add(source)
+
+    _script_table_ = table
+    yield '@scripts', table.serialize()
+
+
+def load_scripts(record: Mapping[str, Sequence[str]], cache: str | None = None) -> list:
+    '''
+    由@scripts记录得到按句柄排列的编译结果
+    '''
+    return [compile_script(source, '@scripts[%d]' % handle, cache)
+            for handle, source in enumerate(record['script'])]
@@ -0,0 +1,318 @@
+from __future__ import annotations
+import json
+import os
+from typing import *
+from lib.codec import BLOCK_SIZE
+from lib.index import id_hash
+from lib.reader import ResourceDB, gc_paused
+from lib.writer import FileWriter, IndexFormat
+
+
+# 分片输出 每种资源类型一个段 构建阶段的@记录在段db.@中
+#   段是独立的<段名>.tpd/<段名>.tpi/<段名>.tpb 可以单独用ResourceDB(path, name=段名)读取
+#   某类型的记录超过shard_size字节时按ID的hash均分为n段 db.<类型>.<k> @段不拆分
+#   ID的hash为lib.index.id_hash 第k段为hash * n >> 64 == k的ID
+#
+# db.tps 分片清单 {'version': 1, 'types': {类型: [段名, ...]}}
+#   存在db.tps时db.tpd/db.tpi不再使用 读取时用open_db自动选择
+
+SHARD_FILE = 'db.tps'
+SHARD_VERSION = 1
+
+# 单个段的目标大小
+SHARD_SIZE = 64 << 20
+
+_SEGMENT_EXTS = ('.tpd', '.tpi', '.tpb')
+
+
+def record_type(id: str) -> str:
+    '''
+    资源ID的前缀即类型名 构建阶段的记录归为@
+    '''
+    if id.startswith('@'):
+        return '@'
+    return id.split('.', 1)[0]
+
+
+def segment_of(id: str, segments: Sequence[str]) -> str:
+    if len(segments) == 1:
+        return segments[0]
+    return segments[id_hash(id) * len(segments) >> 64]
+
+
+def load_shards(path: str) -> dict[str, list[str]] | None:
+    p_shards = os.path.join(path, SHARD_FILE)
+    if not os.path.exists(p_shards):
+        return None
+
+    with open(p_shards, 'rb') as handle:
+        manifest = json.load(handle)
+    if manifest.get('version') != SHARD_VERSION:
+        raise Exception('%s => unsupported shard version %s' % (p_shards, manifest.get('version')))
+    return manifest['types']
+
+
+def save_shards(path: str, types: Mapping[str, Sequence[str]]):
+    p_shards = os.path.join(path, SHARD_FILE)
+    temp = p_shards + '.tmp'
+    with open(temp, 'w') as handle:
+        json.dump({'version': SHARD_VERSION, 'types': types}, handle)
+    os.replace(temp, p_shards)
+
+
+def remove_segment(path: str, name: str):
+    for ext in _SEGMENT_EXTS:
+        p_file = os.path.join(path, name + ext)
+        if os.path.exists(p_file):
+            os.remove(p_file)
+
+
+def remove_shards(path: str):
+    '''
+    删除分片清单与其中的段
+    '''
+    types = load_shards(path)
+    if types is None:
+        return
+    os.remove(os.path.join(path, SHARD_FILE))
+    for segments in types.values():
+        for name in segments:
+            remove_segment(path, name)
+
+
+class ShardedWriter:
+    '''
+    与FileWriter相同的写入接口 记录按类型暂存 关闭时决定分段并逐段写入
+    '''
+
+    _records: dict[str, list[tuple[str, bytes, int]]]
+    _sizes: dict[str, int]
+    _ids: set[str]
+    _close: bool
+
+    def __init__(
+        self,
+        path: str,
+        index: IndexFormat = 'json',
+        compression: str | None = None,
+        block_size: int = BLOCK_SIZE,
+        shard_size: int = SHARD_SIZE,
+    ) -> None:
+        if index not in get_args(IndexFormat):
+            raise Exception('Unknown index format: %s' % index)
+        if shard_size <= 0:
+            raise Exception('shard_size must greater than 0')
+
+        self._path = path
+        self._index_format = index
+        self._compression = compression
+        self._block_size = block_size
+        self._shard_size = shard_size
+        self._records = {}
+        self._sizes = {}
+        self._ids = set()
+        self._close = False
+
+    def __enter__(self):
+        if self._close:
+            raise Exception('Already closed')
+        return self
+
+    def __exit__(self, type, value, trace):
+        if not self._close:
+            self.close(type != None)
+
+    def write(self, id: str, data: str | bytes, cache: int):
+        if self._close:
+            raise Exception('Already closed')
+        if id in self._ids:
+            raise Exception('ID conflict: %s' % id)
+        if type(data) == str:
+            data = str.encode(data)
+
+        self._ids.add(id)
+        T = record_type(id)
+        if T not in self._records:
+            self._records[T] = []
+            self._sizes[T] = 0
+        self._records[T].append((id, data, cache))
+        self._sizes[T] += len(data) + 1
+
+    def write_many(self, records: Iterable[tuple[str, bytes, int]], **kwargs: Any):
+        for id, data, cache in records:
+            self.write(id, data, cache)
+
+    def close(self, clear: bool = False):
+        if self._close:
+            raise Exception('Already closed')
+        self._close = True
+
+        # 写入过程中出错时不能留下与段不一致的清单
+        p_shards = os.path.join(self._path, SHARD_FILE)
+        previous = load_shards(self._path) or {}
+        if os.path.exists(p_shards):
+            os.remove(p_shards)
+
+        # 旧的单文件输出
+        remove_segment(self._path, 'db')
+
+        types = {}
+        if not clear:
+            for T, records in self._records.items():
+                count = T != '@' and max(1, -(-self._sizes[T] // self._shard_size)) or 1
+                if count == 1:
+                    segments = ['db.%s' % T]
+                else:
+                    segments = ['db.%s.%d' % (T, k) for k in range(count)]
+                types[T] = segments
+
+                groups = {name: [] for name in segments}
+                for record in records:
+                    groups[segment_of(record[0], segments)].append(record)
+                for name, group in groups.items():
+                    writer = FileWriter(self._path, self._index_format, self._compression, self._block_size, name)
+                    with writer:
+                        writer.write_many(group)
+
+        keep = {name for segments in types.values() for name in segments}
+        for segments in previous.values():
+            for name in segments:
+                if name not in keep:
+                    remove_segment(self._path, name)
+
+        save_shards(self._path, types)
+
+        self._records = {}
+        self._ids = set()
+
+
+class ShardedDB:
+    '''
+    与ResourceDB相同的读取接口 按ID的类型与hash找到所在的段
+    段在第一次访问时才打开
+    '''
+
+    types: dict[str, list[str]]
+    _segments: dict[str, ResourceDB]
+    _close: bool
+
+    def __init__(self, path: str, capacity: int = 4096) -> None:
+        self._segments = {}
+        self._close = False
+
+        types = load_shards(path)
+        if types is None:
+            self._close = True
+            raise Exception('%s => not a sharded db' % path)
+
+        self._path = path
+        self._capacity = capacity
+        self.types = types
+        self._hook = None
+
+        # 常量池在@段中 所有段共用
+        if '@' in types:
+            header = self.segment(types['@'][0])
+            if '@pool' in header:
+                self._hook = header._hook
+
+    def __del__(self):
+        self.close()
+
+    def __enter__(self):
+        if self._close:
+            raise Exception('Already closed')
+        return self
+
+    def __exit__(self, type, value, trace):
+        self.close()
+
+    def close(self):
+        if self._close:
+            return
+        self._close = True
+        for db in self._segments.values():
+            db.close()
+        self._segments = {}
+
+    def segment(self, name: str) -> ResourceDB:
+        if self._close:
+            raise Exception('Already closed')
+        db = self._segments.get(name)
+        if db is None:
+            db = self._segments[name] = ResourceDB(self._path, self._capacity, name, self._hook)
+        return db
+
+    def _find(self, id: str) -> ResourceDB | None:
+        segments = self.types.get(record_type(id))
+        if not segments:
+            return None
+        return self.segment(segment_of(id, segments))
+
+    def __len__(self) -> int:
+        return sum(len(self.segment(name)) for segments in self.types.values() for name in segments)
+
+    def __contains__(self, id: str) -> bool:
+        db = self._find(id)
+        return db is not None and id in db
+
+    def __getitem__(self, id: str) -> Any:
+        return self.get(id)
+
+    def ids(self) -> Iterator[str]:
+        for segments in self.types.values():
+            for name in segments:
+                yield from self.segment(name).ids()
+
+    def raw(self, id: str) -> bytes:
+        db = self._find(id)
+        if db is None:
+            raise Exception('%s not found' % id)
+        return db.raw(id)
+
+    def get(self, id: str) -> Any:
+        db = self._find(id)
+        if db is None:
+            raise Exception('%s not found' % id)
+        return db.get(id)
+
+    def records(self) -> Iterator[tuple[str, bytes, int]]:
+        for segments in self.types.values():
+            for name in segments:
+                yield from self.segment(name).records()
+
+    def decode_type(self, T: str) -> dict[str, Any]:
+        '''
+        一次解析某类型的全部段
+        '''
+        return self.decode_types([T])[T]
+
+    def decode_types(self, types: Iterable[str]) -> dict[str, dict[str, Any]]:
+        '''
+        依次解析多个类型 整个过程只暂停一次循环GC
+        json.loads持有GIL 多线程解析没有加速
+        '''
+        result = {}
+        with gc_paused():
+            for T in types:
+                result[T] = {}
+                for name in self.types.get(T, ()):
+                    result[T].update(self.segment(name).decode_all())
+        return result
+
+    def stats(self) -> dict[str, int | float]:
+        total = {}
+        for db in self._segments.values():
+            for key, value in db.stats().items():
+                total[key] = total.get(key, 0) + value
+        total['segments'] = len(self._segments)
+        return total
+
+
+def open_db(path: str, capacity: int = 4096) -> ResourceDB | ShardedDB:
+    '''
+    存在db.tps时按分片读取
+    '''
+    if os.path.exists(os.path.join(path, SHARD_FILE)):
+        return ShardedDB(path, capacity)
+    return ResourceDB(path, capacity)
@@ -0,0 +1,354 @@
+from __future__ import annotations
+from dataclasses import dataclass, field
+from typing import *
+from lib.base import *
+from lib.attribute import *
+from lib.entry import *
+from lib.equipment import *
+from lib.accessory import *
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# 批量计算角色属性 需要NumPy
+#
+# 1. 装备/装饰品在对应等级的属性与词条数累加 loadout中额外的词条数也累加进来
+# 2. 每个词条按叠加矩阵(见Entry._ser_stacking)取一行 piece/plus截断到上限
+# 3. 同名的X/XUp/XDown合并为 X * max(0, 1 + XUp - XDown)
+#    只有Up/Down的XBonusUp/XBonusDown合并为 XBonus = XBonusUp - XBonusDown
+#    XPass作用于对方的X 原样保留
+#
+# 装备等级L对应values中的下标L-level[0] 装饰品等级即下标
+
+
+@dataclass
+class Loadout:
+    # 装备ID与等级
+    equipment: ResID
+    level: int
+
+    # [(装饰品ID, 等级), ...]
+    accessories: Sequence[tuple[ResID, int]] = ()
+
+    # 额外的词条 {词条ID: (piece, plus)}
+    entries: Mapping[ResID, tuple[int, int]] = field(default_factory=dict)
+
+
+@dataclass
+class LoadoutBatch:
+    '''
+    N个loadout的数组形式 可以不经过Loadout直接构造
+    装备/装饰品/词条都使用StatCalculator中的下标 装饰品的空位为-1
+    '''
+
+    # (N,)
+    equipment: Any
+    equipment_level: Any
+
+    # (N, K)
+    accessories: Any
+    accessory_levels: Any
+
+    # (N, E)
+    entry_pieces: Any
+    entry_plus: Any
+
+    def __len__(self) -> int:
+        return len(self.equipment)
+
+
+class _Source:
+    '''
+    装备或装饰品的稀疏属性表 每项的属性/词条按最大数量补齐
+    '''
+
+    def __init__(
+        self,
+        items: Sequence[Resource],
+        levels: Callable[[Resource], tuple[int, int]],
+        attributes: Mapping[str, int],
+        entries: Mapping[str, int],
+    ) -> None:
+        self.index = {item.res_id: i for i, item in enumerate(items)}
+
+        n = len(items)
+        bases = [levels(item)[0] for item in items]
+        counts = [levels(item)[1] for item in items]
+        attrs = [[key for key in item.values if is_attribute(key)] for item in items]
+        ents = [[key for key in item.values if key in entries] for item in items]
+
+        L = max(counts, default=0) or 1
+        Ma = max(map(len, attrs), default=0) or 1
+        Me = max(map(len, ents), default=0) or 1
+
+        self.base = numpy.asarray(bases, dtype=numpy.intp)
+        self.count = numpy.asarray(counts, dtype=numpy.intp)
+        self.attr_idx = numpy.zeros((n, Ma), dtype=numpy.intp)
+        self.values = numpy.zeros((n, L, Ma))
+        self.entry_idx = numpy.zeros((n, Me), dtype=numpy.intp)
+        self.pieces = numpy.zeros((n, L, Me), dtype=numpy.int64)
+        self.plus = numpy.zeros((n, L, Me), dtype=numpy.int64)
+
+        for i, item in enumerate(items):
+            for k, key in enumerate(attrs[i]):
+                self.attr_idx[i, k] = attributes[key]
+                self.values[i, :counts[i], k] = numpy.asarray(item.values[key], dtype=numpy.float64)
+            for k, key in enumerate(ents[i]):
+                self.entry_idx[i, k] = entries[key]
+                pairs = numpy.asarray(item.values[key], dtype=numpy.int64).reshape(-1, 2)
+                self.pieces[i, :counts[i], k] = pairs[:, 0]
+                self.plus[i, :counts[i], k] = pairs[:, 1]
+
+    def add(self, ids, levels, total, pieces, plus, name: str):
+        '''
+        ids/levels为(N, K) 结果按列累加到total(A*N) pieces/plus(E*N)
+        '''
+        N, K = ids.shape
+        mask = ids >= 0
+        safe = numpy.where(mask, ids, 0)
+        level = levels - self.base[safe]
+        bad = mask & ((level < 0) | (level >= self.count[safe]))
+        if bad.any():
+            row, col = numpy.argwhere(bad)[0]
+            raise Exception('loadouts[%d] => %s level %d out of range' % (row, name, levels[row, col]))
+        level = numpy.where(mask, level, 0)
+
+        rows = numpy.arange(N)[:, None, None]
+
+        values = self.values[safe, level] * mask[..., None]
+        total += numpy.bincount((self.attr_idx[safe] * N + rows).ravel(),
+                                weights=values.ravel(), minlength=len(total))
+
+        # 没有词条时pieces/plus为空 补齐的词条位置仍会产生N个bin
+        if not len(pieces):
+            return
+
+        idx = (self.entry_idx[safe] * N + rows).ravel()
+        pieces += numpy.bincount(idx, weights=(self.pieces[safe, level] * mask[..., None]).ravel(),
+                                 minlength=len(pieces)).astype(numpy.int64)
+        plus += numpy.bincount(idx, weights=(self.plus[safe, level] * mask[..., None]).ravel(),
+                               minlength=len(plus)).astype(numpy.int64)
+
+
+class StatCalculator:
+    '''
+    按loadout批量计算最终属性 结果为(N, len(names))的数组
+    '''
+
+    # Attribute按AttributeIDs排序 totals的列
+    attributes: list[Attribute]
+
+    # 最终属性的列名 compute的列
+    names: list[str]
+
+    def __init__(self, resources: Iterable[Resource] | None = None) -> None:
+        if numpy is None:
+            raise Exception('StatCalculator requires numpy')
+
+        if resources is None:
+            resources = Resource.all()
+        resources = [*resources]
+
+        self.attributes = [*AttributeIDs]
+        self._entries = [res for res in resources if type(res) is Entry]
+        self.entry_index = {entry.res_id: i for i, entry in enumerate(self._entries)}
+
+        self._equipments = _Source(
+            [res for res in resources if type(res) is Equipment],
+            lambda e: (e.level[0], e.level[1] - e.level[0]),
+            AttributeIDs, self.entry_index,
+        )
+        self._accessories = _Source(
+            [res for res in resources if type(res) is Accessory],
+            lambda a: (0, a.max_level),
+            AttributeIDs, self.entry_index,
+        )
+        self.equipment_index = self._equipments.index
+        self.accessory_index = self._accessories.index
+
+        self._compile_entries()
+        self._compile_families()
+
+    def _compile_entries(self):
+        # 每个词条每个属性的叠加矩阵 展开为一维 下标为piece*(max_piece*2+1)+plus
+        entries = self._entries
+        E = len(entries)
+        attrs = [[*dict.fromkeys(k for k in [*e.piece_values, *e.plus_values] if is_attribute(k))]
+                 for e in entries]
+        M = max(map(len, attrs), default=0) or 1
+
+        self._max_piece = numpy.asarray([e.max_piece for e in entries], dtype=numpy.int64)
+        self._stack_len = [len(a) for a in attrs]
+        self._stack_idx = numpy.zeros((E, M), dtype=numpy.intp)
+        self._stacks = [[] for _ in entries]
+        for j, entry in enumerate(entries):
+            m = entry.max_piece
+            for k, key in enumerate(attrs[j]):
+                piece = numpy.zeros(m + 1)
+                plus = numpy.zeros(m * 2 + 1)
+                if key in entry.piece_values:
+                    piece[1:] = numpy.asarray(entry.piece_values[key], dtype=numpy.float64)
+                if key in entry.plus_values:
+                    plus[1:] = numpy.asarray(entry.plus_values[key], dtype=numpy.float64)
+                matrix = piece[:, None] + plus[None, :]
+                matrix[0] = 0
+                self._stack_idx[j, k] = AttributeIDs[key]
+                self._stacks[j].append(matrix.ravel())
+
+    def _compile_families(self):
+        attrs = set(self.attributes)
+        names = []
+        scale = []
+        net = []
+        keep = []
+        for name in self.attributes:
+            if name.endswith('Up') or name.endswith('Down'):
+                continue
+            if name + 'Up' in attrs and name + 'Down' in attrs:
+                scale.append((len(names), AttributeIDs[name], AttributeIDs[name + 'Up'], AttributeIDs[name + 'Down']))
+            else:
+                keep.append((len(names), AttributeIDs[name]))
+            names.append(name)
+        for name in self.attributes:
+            if name.endswith('Up') and name[:-2] not in attrs and name[:-2] + 'Down' in attrs:
+                net.append((len(names), AttributeIDs[name], AttributeIDs[name[:-2] + 'Down']))
+                names.append(name[:-2])
+
+        self.names = names
+        self._scale = numpy.asarray(scale, dtype=numpy.intp).reshape(-1, 4)
+        self._net = numpy.asarray(net, dtype=numpy.intp).reshape(-1, 3)
+        self._keep = numpy.asarray(keep, dtype=numpy.intp).reshape(-1, 2)
+
+    def batch(self, loadouts: Sequence[Loadout]) -> LoadoutBatch:
+        N = len(loadouts)
+        K = max((len(l.accessories) for l in loadouts), default=0)
+        E = len(self._entries)
+
+        batch = LoadoutBatch(
+            equipment=numpy.empty(N, dtype=numpy.intp),
+            equipment_level=numpy.empty(N, dtype=numpy.intp),
+            accessories=numpy.full((N, K), -1, dtype=numpy.intp),
+            accessory_levels=numpy.zeros((N, K), dtype=numpy.intp),
+            entry_pieces=numpy.zeros((N, E), dtype=numpy.int64),
+            entry_plus=numpy.zeros((N, E), dtype=numpy.int64),
+        )
+        for i, loadout in enumerate(loadouts):
+            batch.equipment[i] = self.equipment_index[loadout.equipment]
+            batch.equipment_level[i] = loadout.level
+            for k, (id, level) in enumerate(loadout.accessories):
+                batch.accessories[i, k] = self.accessory_index[id]
+                batch.accessory_levels[i, k] = level
+            for id, (piece, plus) in loadout.entries.items():
+                batch.entry_pieces[i, self.entry_index[id]] += piece
+                batch.entry_plus[i, self.entry_index[id]] += plus
+        return batch
+
+    def totals(self, batch: LoadoutBatch | Sequence[Loadout]):
+        '''
+        各属性的累加值 (N, len(attributes))
+        '''
+        return self._totals(batch).T
+
+    def _totals(self, batch: LoadoutBatch | Sequence[Loadout]):
+        # 内部按属性优先(A, N)存放 每个属性的N个值连续
+        if not isinstance(batch, LoadoutBatch):
+            batch = self.batch(batch)
+
+        N = len(batch)
+        A = len(self.attributes)
+        E = len(self._entries)
+
+        if N == 0:
+            return numpy.zeros((A, 0))
+
+        total = numpy.zeros(A * N)
+        pieces = numpy.asarray(batch.entry_pieces, dtype=numpy.int64).reshape(N, E).T.ravel()
+        plus = numpy.asarray(batch.entry_plus, dtype=numpy.int64).reshape(N, E).T.ravel()
+
+        equipment = numpy.asarray(batch.equipment, dtype=numpy.intp).reshape(N, 1)
+        level = numpy.asarray(batch.equipment_level, dtype=numpy.intp).reshape(N, 1)
+        self._equipments.add(equipment, level, total, pieces, plus, 'equipment')
+
+        accessories = numpy.asarray(batch.accessories, dtype=numpy.intp).reshape(N, -1)
+        if accessories.size:
+            levels = numpy.asarray(batch.accessory_levels, dtype=numpy.intp).reshape(N, -1)
+            self._accessories.add(accessories, levels, total, pieces, plus, 'accessory')
+
+        total = total.reshape(A, N)
+        pieces = pieces.reshape(E, N)
+        plus = plus.reshape(E, N)
+
+        # 只处理batch中出现过的词条 每个词条在N个loadout上向量化
+        for j in numpy.flatnonzero(pieces.any(axis=1)):
+            m = self._max_piece[j]
+            row = numpy.clip(pieces[j], 0, m) * (m * 2 + 1) + numpy.clip(plus[j], 0, m * 2)
+            for k in range(self._stack_len[j]):
+                total[self._stack_idx[j, k]] += self._stacks[j][k][row]
+
+        return total
+
+    def compute(self, batch: LoadoutBatch | Sequence[Loadout]):
+        '''
+        最终属性 (N, len(names))
+        '''
+        return self._finalize(self._totals(batch)).T
+
+    def finalize(self, totals):
+        '''
+        由累加值(N, len(attributes))计算最终属性(N, len(names))
+        '''
+        return self._finalize(numpy.asarray(totals, dtype=numpy.float64).T).T
+
+    def _finalize(self, total):
+        out = numpy.empty((len(self.names), total.shape[1]))
+
+        col, base, up, down = self._scale.T
+        out[col] = total[base] * numpy.maximum(0.0, 1.0 + total[up] - total[down])
+        col, up, down = self._net.T
+        out[col] = total[up] - total[down]
+        col, base = self._keep.T
+        out[col] = total[base]
+        return out
+
+    def item(self, kind: Literal['equipment', 'accessory'], id: ResID, level: int):
+        '''
+        单件装备/装饰品在该等级的 (属性累加值(A,), {词条下标: piece}, {词条下标: plus})
+        '''
+        source = kind == 'equipment' and self._equipments or self._accessories
+        i = source.index[id]
+        k = level - source.base[i]
+        if not 0 <= k < source.count[i]:
+            raise Exception('%s => %s level %d out of range' % (id, kind, level))
+
+        total = numpy.zeros(len(self.attributes))
+        numpy.add.at(total, source.attr_idx[i], source.values[i, k])
+        pieces = {}
+        plus = {}
+        for j, p, q in zip(source.entry_idx[i], source.pieces[i, k], source.plus[i, k]):
+            if p or q:
+                pieces[int(j)] = pieces.get(int(j), 0) + int(p)
+                plus[int(j)] = plus.get(int(j), 0) + int(q)
+        return total, pieces, plus
+
+    def stacking(self, j: int, piece: int, plus: int):
+        '''
+        第j个词条在piece/plus时的加成 (属性下标, 值)
+        '''
+        m = self._max_piece[j]
+        row = min(max(piece, 0), m) * (m * 2 + 1) + min(max(plus, 0), m * 2)
+        M = self._stack_len[j]
+        return self._stack_idx[j, :M], numpy.asarray([self._stacks[j][k][row] for k in range(M)])
+
+    def stacking_bounds(self, j: int):
+        '''
+        第j个词条在所有piece/plus下各属性加成的(最小值, 最大值) (属性下标, 最小值, 最大值)
+        '''
+        M = self._stack_len[j]
+        return (
+            self._stack_idx[j, :M],
+            numpy.asarray([self._stacks[j][k].min() for k in range(M)]),
+            numpy.asarray([self._stacks[j][k].max() for k in range(M)]),
+        )
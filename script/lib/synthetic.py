@@ -0,0 +1,215 @@
+from __future__ import annotations
+from dataclasses import dataclass
+import random
+from lib.base import *
+from lib.attribute import *
+from lib.buff import *
+from lib.entry import *
+from lib.equipment import *
+from lib.accessory import *
+from lib.script import *
+
+
+@dataclass(kw_only=True)
+class SyntheticScale:
+    '''
+    合成内容包的规模 生成的资源都能通过校验
+    '''
+
+    # 随机种子 相同的规模与种子生成完全相同的内容
+    seed: int = 0
+
+    # 强化素材的数量
+    materials: int = 20
+
+    # Buff的数量与每个Buff的参数个数
+    buffs: int = 50
+    buff_arguments: int = 4
+
+    # 词条的数量与叠加上限
+    entries: int = 100
+    max_piece: int = 7
+
+    # 装备的数量 分布在trees棵装备树中 每棵树最深depth层
+    equipments: int = 500
+    trees: int = 10
+    depth: int = 16
+
+    # 每件装备的等级数 值列表的长度
+    levels: int = 99
+
+    # 每件装备values中的属性/词条/Buff数量
+    attributes: int = 24
+    equipment_entries: int = 4
+    equipment_buffs: int = 2
+
+    # 随机属性池/随机词条池的数量与每个池的大小
+    random_pools: int = 20
+    pool_size: int = 16
+
+    # 装饰品的数量与等级数
+    accessories: int = 200
+    accessory_levels: int = 20
+
+
+SyntheticScales: dict[str, SyntheticScale] = {
+    'small': SyntheticScale(
+        materials=5, buffs=10, entries=20, equipments=50, trees=5, depth=8, levels=20,
+        attributes=8, random_pools=4, pool_size=4, accessories=20,
+    ),
+    'medium': SyntheticScale(),
+    'large': SyntheticScale(
+        materials=50, buffs=200, entries=500, equipments=3000, trees=30, depth=32,
+        attributes=40, random_pools=100, pool_size=32, accessories=1000,
+    ),
+}
+
+
+_Attributes_ = get_args(Attribute)
+
+_Slots_ = get_args(SlotType)
+
+_Scripts_ = (BuildScript, HitScript, HurtScript, TickScript)
+
+
+def _script(rng: random.Random, name: str) -> Script:
+    T = rng.choice(_Scripts_)
+    script = '%s = %s * %d' % (name, name, rng.randint(1, 9))
+    if T is TickScript:
+        return TickScript(script=script, delay=rng.randint(0, 10), interval=rng.randint(1, 10),
+                          times=rng.randint(1, 10))
+    return T(script=script)
+
+
+def _attributes_list(rng: random.Random, size: int) -> list[float]:
+    base = rng.randint(1, 100)
+    return [float(base * (i + 1)) for i in range(size)]
+
+
+def _entries_list(rng: random.Random, size: int) -> list[list[int]]:
+    return [[rng.randint(0, 7), rng.randint(0, 14)] for _ in range(size)]
+
+
+def _buffs_list(rng: random.Random, size: int, buff: Buff) -> list[dict[str, float]]:
+    args = [*buff.arguments]
+    return [{arg: float(rng.randint(0, 99)) for arg in rng.sample(args, rng.randint(0, len(args)))}
+            for _ in range(size)]
+
+
+def generate(scale: SyntheticScale = SyntheticScale()) -> list[Resource]:
+    '''
+    生成合成内容包并注册到Resource._res_dict_ 返回按注册顺序排列的资源
+    '''
+    rng = random.Random(scale.seed)
+    resources = []
+
+    materials = []
+    for i in range(scale.materials):
+        materials.append(Resource('Resource.Material%d' % i, cache=i % 4 == 0))
+    resources.extend(materials)
+
+    buffs = []
+    for i in range(scale.buffs):
+        names = ['arg%d' % k for k in range(scale.buff_arguments)]
+        buff = Buff(
+            'Buff.Synthetic%d' % i,
+            arguments={name: float(rng.randint(0, 99)) for name in names},
+            on_start=rng.random() < 0.5 and _script(rng, names[0]) or None,
+            on_hit=rng.random() < 0.5 and _script(rng, names[-1]) or None,
+            on_tick=TickScript(script='hp = hp - %s' % names[0], interval=rng.randint(1, 5),
+                               times=rng.randint(1, 20)),
+            name='Buff %d' % i,
+            icon='buff/%d.png' % (i % 16),
+        )
+        buffs.append(buff)
+    resources.extend(buffs)
+
+    entries = []
+    for i in range(scale.entries):
+        piece = {attr: _attributes_list(rng, scale.max_piece)
+                 for attr in rng.sample(_Attributes_, 3)}
+        if buffs:
+            buff = rng.choice(buffs)
+            piece[buff.res_id] = _buffs_list(rng, scale.max_piece, buff)
+        entry = Entry(
+            'Entry.Synthetic%d' % i,
+            type=rng.choice(get_args(EntryType)),
+            max_piece=scale.max_piece,
+            piece_values=piece,
+            plus_values={attr: _attributes_list(rng, scale.max_piece * 2)
+                         for attr in rng.sample(_Attributes_, 2)},
+            name='Entry %d' % i,
+            rare=rng.choice(get_args(RareLevel)),
+            icon='entry/%d.png' % (i % 16),
+        )
+        entries.append(entry)
+    resources.extend(entries)
+
+    # 第i件装备属于第i%trees棵树 父节点为同一棵树中的上一层装备
+    equipments = []
+    types = get_args(EquipmentType)
+    for i in range(scale.equipments):
+        tree = i % scale.trees
+        layer = i // scale.trees
+        parents = {}
+        if layer % scale.depth != 0:
+            parent = equipments[i - scale.trees]
+            parents[parent.res_id] = rng.randint(*parent.level)
+
+        values = {attr: _attributes_list(rng, scale.levels)
+                  for attr in rng.sample(_Attributes_, min(scale.attributes, len(_Attributes_)))}
+        values[Slots] = [rng.sample(_Slots_, rng.randint(0, 3)) for _ in range(scale.levels)]
+        for entry in rng.sample(entries, min(scale.equipment_entries, len(entries))):
+            values[entry.res_id] = _entries_list(rng, scale.levels)
+        for buff in rng.sample(buffs, min(scale.equipment_buffs, len(buffs))):
+            values[buff.res_id] = _buffs_list(rng, scale.levels, buff)
+
+        equipment = Equipment(
+            'Equipment.Synthetic%d' % i,
+            type=types[tree % len(types)],
+            level=[0, scale.levels],
+            parents=parents,
+            materials=[{m.res_id: rng.randint(1, 20) for m in rng.sample(materials, min(2, len(materials)))}
+                       for _ in range(scale.levels)],
+            values=values,
+            scripts=[],
+            name='Equipment %d' % i,
+            rare=rng.choice(get_args(RareLevel)),
+            icon='equipment/%d.png' % (i % 64),
+            sub_icon='equipment/sub%d.png' % (i % 8),
+        )
+        equipments.append(equipment)
+    resources.extend(equipments)
+
+    pools = []
+    for i in range(scale.random_pools):
+        attributes = RandomAttributes(
+            'RandomAttributes.Synthetic%d' % i,
+            max_level=scale.accessory_levels,
+            values=[RandomAttribute(k, rng.choice(_Attributes_), _attributes_list(rng, scale.accessory_levels))
+                    for k in range(scale.pool_size)],
+        )
+        pools.append(attributes)
+        if entries:
+            pools.append(RandomEntries(
+                'RandomEntries.Synthetic%d' % i,
+                max_level=scale.accessory_levels,
+                values=[RandomEntry(k, rng.choice(entries).res_id, _entries_list(rng, scale.accessory_levels))
+                        for k in range(scale.pool_size)],
+            ))
+    resources.extend(pools)
+
+    for i in range(scale.accessories):
+        values = {attr: _attributes_list(rng, scale.accessory_levels)
+                  for attr in rng.sample(_Attributes_, 4)}
+        resources.append(Accessory(
+            'Accessory.Synthetic%d' % i,
+            max_level=scale.accessory_levels,
+            values=values,
+            random_values=[pool.res_id for pool in rng.sample(pools, min(2, len(pools)))],
+            name='Accessory %d' % i,
+            rare=rng.choice(get_args(RareLevel)),
+            icon='accessory/%d.png' % (i % 32),
+        ))
+
+    return resources
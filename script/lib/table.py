@@ -0,0 +1,209 @@
+from array import array
+import base64
+import struct
+import sys
+from typing import *
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# 打包的数值表格 (小端)
+#
+# [Header] [Column * x]
+#
+# Header 6字节
+#   x(u16) 列数 y(u16) 每列的行数 z(u8) 每行的元素数 dtype(u8)
+#
+# Column 每列y*z个元素 各列连续存放 运行时可以直接memcpy
+#
+# dict_table的输出中 'k'为列名 'a'为Buff表每列的参数名 'p'为base64编码的数据
+
+DTYPE_U16 = 1
+DTYPE_F32 = 2
+DTYPE_F64 = 3
+
+_TYPECODES = {DTYPE_U16: 'H', DTYPE_F32: 'f', DTYPE_F64: 'd'}
+
+_HEADER = struct.Struct('<HHBB')
+
+_NAN = float('nan')
+
+_ARRAY_TYPECODES = frozenset('bBhHiIlLqQfd')
+
+_ARRAY_DTYPES = {'H': DTYPE_U16, 'f': DTYPE_F32, 'd': DTYPE_F64}
+
+_NUMPY_DTYPES = {'uint16': DTYPE_U16, 'float32': DTYPE_F32, 'float64': DTYPE_F64}
+
+
+def is_numeric_array(val) -> bool:
+    '''
+    一维的array.array或NumPy数组
+    '''
+    if isinstance(val, array):
+        return val.typecode in _ARRAY_TYPECODES
+    if numpy is not None and isinstance(val, numpy.ndarray):
+        return val.ndim == 1 and val.dtype.kind in 'iuf'
+    return False
+
+
+def is_integer_array(val) -> bool:
+    if isinstance(val, array):
+        return val.typecode not in 'fd'
+    return val.dtype.kind in 'iu'
+
+
+def array_bounds(val) -> tuple[int | float, int | float]:
+    '''
+    数组的最小值与最大值 整个数组只遍历一次 不逐个元素校验
+    '''
+    if isinstance(val, array):
+        return min(val), max(val)
+    return val.min().item(), val.max().item()
+
+
+def out_of_bounds(val, min: int | float | None, max: int | float | None) -> bool:
+    if len(val) == 0 or (min is None and max is None):
+        return False
+    low, high = array_bounds(val)
+    return (min is not None and low < min) or (max is not None and max < high)
+
+
+def json_default(obj):
+    '''
+    json.dumps的default 数组按列表输出
+    '''
+    if is_numeric_array(obj):
+        return obj.tolist()
+    raise TypeError('Object of type %s is not JSON serializable' % type(obj).__name__)
+
+
+def _array_dtype(column) -> int | None:
+    if isinstance(column, array):
+        return _ARRAY_DTYPES.get(column.typecode)
+    if numpy is not None and isinstance(column, numpy.ndarray) and column.ndim == 1:
+        return _NUMPY_DTYPES.get(column.dtype.name)
+    return None
+
+
+def _array_bytes(column) -> memoryview | bytes:
+    if isinstance(column, array):
+        if sys.byteorder == 'little':
+            return memoryview(column)
+        column = array(column.typecode, column)
+        column.byteswap()
+        return column.tobytes()
+    # 已经是小端且连续时不会复制
+    return memoryview(numpy.ascontiguousarray(column, dtype=column.dtype.newbyteorder('<')))
+
+
+def _same(a: list, b: list) -> bool:
+    return all(x == y or (x != x and y != y) for x, y in zip(a, b))
+
+
+def pick_dtype(values: Sequence[int | float]) -> int:
+    '''
+    能无损表示所有值的最小类型 整数值的float也可以存为u16
+    '''
+    if all(0 <= v <= 0xFFFF and v == int(v) for v in values):
+        return DTYPE_U16
+    try:
+        if _same(array('f', values).tolist(), values):
+            return DTYPE_F32
+    except OverflowError:
+        pass
+    return DTYPE_F64
+
+
+def pack_columns(columns: Sequence[Sequence[int | float]], y: int, z: int = 1) -> str:
+    # 同类型的数组直接拼接内存 不经过Python对象
+    dtypes = {_array_dtype(column) for column in columns}
+    if z == 1 and len(dtypes) == 1 and None not in dtypes:
+        if any(len(column) != y for column in columns):
+            raise Exception('Packed table size must equal to %d*%d*%d' % (len(columns), y, z))
+        header = _HEADER.pack(len(columns), y, z, dtypes.pop())
+        data = b''.join([header, *(_array_bytes(column) for column in columns)])
+        return base64.b64encode(data).decode()
+
+    flat = [v for column in columns for v in column]
+    if len(flat) != len(columns) * y * z:
+        raise Exception('Packed table size must equal to %d*%d*%d' % (len(columns), y, z))
+
+    dtype = pick_dtype(flat)
+    if dtype == DTYPE_U16:
+        flat = [int(v) for v in flat]
+    data = array(_TYPECODES[dtype], flat)
+    if sys.byteorder != 'little':
+        data.byteswap()
+
+    header = _HEADER.pack(len(columns), y, z, dtype)
+    return base64.b64encode(header + data.tobytes()).decode()
+
+
+def unpack_columns(blob: str) -> tuple[int, int, int, list[list[int | float]]]:
+    raw = base64.b64decode(blob)
+    x, y, z, dtype = _HEADER.unpack_from(raw, 0)
+
+    data = array(_TYPECODES[dtype])
+    data.frombytes(raw[_HEADER.size:])
+    if sys.byteorder != 'little':
+        data.byteswap()
+
+    size = y * z
+    flat = data.tolist()
+    return x, y, z, [flat[i*size:(i+1)*size] for i in range(x)]
+
+
+def pack_table(table: Mapping[str, Sequence], y: int) -> dict[str, Any]:
+    '''
+    dict_table的打包版本
+    值为数值列表的属性表 [[piece, plus], ...]形式的词条表 [{参数: 值}, ...]形式的Buff表
+    '''
+    keys = list(table)
+    sample = next((cell for values in table.values() for cell in values), 0)
+
+    if isinstance(sample, Mapping):
+        # Buff表 每个(Buff, 参数)为一列 未填写的参数为NaN 运行时使用Buff的默认值
+        args = []
+        columns = []
+        for values in table.values():
+            names = [*dict.fromkeys(arg for cell in values for arg in cell)]
+            args.append(names)
+            for arg in names:
+                columns.append([cell.get(arg, _NAN) for cell in values])
+        return {'x': len(keys), 'y': y, 'k': keys, 'a': args, 'p': pack_columns(columns, y)}
+
+    if isinstance(sample, Sequence):
+        z = len(sample)
+        columns = [[v for cell in values for v in cell] for values in table.values()]
+        return {'x': len(keys), 'y': y, 'k': keys, 'p': pack_columns(columns, y, z)}
+
+    return {'x': len(keys), 'y': y, 'k': keys, 'p': pack_columns([*table.values()], y)}
+
+
+def unpack_table(packed: Mapping[str, Any]) -> dict[str, Any]:
+    '''
+    将pack_table的输出还原为dict_table的格式
+    '''
+    _, y, z, columns = unpack_columns(packed['p'])
+    keys = packed['k']
+
+    if 'a' in packed:
+        table = {}
+        idx = 0
+        for key, names in zip(keys, packed['a']):
+            cells = [{} for _ in range(y)]
+            for arg in names:
+                for cell, value in zip(cells, columns[idx]):
+                    if value == value:
+                        cell[arg] = value
+                idx += 1
+            table[key] = cells
+    elif z > 1:
+        table = {key: [column[i*z:(i+1)*z] for i in range(y)] for key, column in zip(keys, columns)}
+    else:
+        table = dict(zip(keys, columns))
+
+    return {'x': len(keys), 'y': y, 't': table}
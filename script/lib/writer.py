@@ -2,23 +2,76 @@ from io import BufferedRandom
 import json
 import os
 from typing import *
+from lib.codec import BLOCK_SIZE, Codec, block_start, find_codec, write_block_table
+from lib.index import write_binary_index
+
+
+# db.tpi的格式
+IndexFormat = Literal['json', 'binary']
+
+# write_many合并写入的缓冲大小
+WRITE_BUFFER = 1 << 20
+
+_IOV_MAX = hasattr(os, 'sysconf') and 'SC_IOV_MAX' in os.sysconf_names and os.sysconf('SC_IOV_MAX') or 1024
 
 
 class FileWriter:
     _h_data: BufferedRandom
     _h_index: BufferedRandom
-    _index: Mapping[str, tuple[int, int]]
+    _index: Mapping[str, tuple[int, int, int]]
+    _index_format: IndexFormat
+    _codec: Codec | None
+    _block_size: int
+    _pending: list[tuple[str, bytes]]
+    _path: str
+    _name: str
+    _offset: int
+    _allocated: int
     _close: bool
 
-    def __init__(self, path: str) -> None:
+    def __init__(
+        self,
+        path: str,
+        index: IndexFormat = 'json',
+        compression: str | None = None,
+        block_size: int = BLOCK_SIZE,
+        name: str = 'db',
+    ) -> None:
+        '''
+        写入<name>.tpd/<name>.tpi/<name>.tpb 分片输出的每个段以段名作为name
+        '''
+        self._h_data = None
+        self._h_index = None
+
+        if index not in get_args(IndexFormat):
+            raise Exception('Unknown index format: %s' % index)
+
         self._index = {}
+        self._index_format = index
+        self._codec = compression and find_codec(compression) or None
+        self._block_size = block_size
+        self._pending = []
+        self._path = path
+        self._name = name
+        self._offset = 0
+        self._allocated = 0
         self._close = False
 
-        p_data = os.path.join(path, 'db.tpd')
+        # 压缩时由db.tpb描述db.tpd中的块 不压缩时不能留下旧的块表
+        p_blocks = os.path.join(path, name + '.tpb')
+        if os.path.exists(p_blocks):
+            os.remove(p_blocks)
+
+        # 不分片输出时不能留下旧的分片 否则读取时会优先使用分片
+        if name == 'db':
+            from lib.shard import remove_shards
+            remove_shards(path)
+
+        p_data = os.path.join(path, name + '.tpd')
         self._h_data = open(p_data, 'wb+')
         self._h_data.truncate()
 
-        p_index = os.path.join(path, 'db.tpi')
+        p_index = os.path.join(path, name + '.tpi')
         self._h_index = open(p_index, 'wb+')
         self._h_index.truncate()
 
@@ -42,18 +95,105 @@ class FileWriter:
             self.close(type != None)
             self._close = True
 
-    def write(self, id: str, data: str, cache: int):
+    def write(self, id: str, data: str | bytes, cache: int):
         if self._close:
             raise Exception('Already closed')
 
         if id in self._index:
             raise Exception('ID conflict: %s' % id)
 
-        start = self._h_data.tell()
-        self._h_data.write(str.encode(data))
-        finish = self._h_data.tell()
-        self._h_data.write(str.encode('\n'))
-        self._index[id] = (start, finish-start, cache)
+        if type(data) == str:
+            data = str.encode(data)
+
+        # 压缩需要先用全部记录训练字典 关闭时再分块写入
+        if self._codec:
+            self._pending.append((id, data))
+            self._index[id] = (0, len(data), cache)
+            return
+
+        self._h_data.write(data)
+        self._h_data.write(b'\n')
+        self._index[id] = (self._offset, len(data), cache)
+        self._offset += len(data) + 1
+
+    def write_many(
+        self,
+        records: Iterable[tuple[str, bytes, int]],
+        preallocate: int = 0,
+        vectored: bool = False,
+    ):
+        '''
+        批量写入(id, data, cache) 记录合并成大块后再写入 偏移直接累加计算
+        preallocate为预计的总字节数 vectored为True时用os.writev代替拼接 小记录时拼接更快
+        '''
+        if self._close:
+            raise Exception('Already closed')
+
+        if self._codec:
+            for id, data, cache in records:
+                self.write(id, data, cache)
+            return
+
+        index = self._index
+        offset = self._offset
+        # 已经写入文件的末尾 缓冲中的记录ID
+        flushed = offset
+        pending = []
+        chunks = []
+        size = 0
+
+        self._h_data.flush()
+        fd = self._h_data.fileno()
+        if preallocate > 0 and hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(fd, offset, preallocate)
+                self._allocated = max(self._allocated, offset + preallocate)
+            except OSError:
+                pass
+        vectored = vectored and hasattr(os, 'writev')
+
+        def flush():
+            if vectored:
+                for i in range(0, len(chunks), _IOV_MAX):
+                    _writev(fd, chunks[i:i+_IOV_MAX])
+            else:
+                _write(fd, b''.join(chunks))
+
+        try:
+            for id, data, cache in records:
+                if id in index:
+                    raise Exception('ID conflict: %s' % id)
+                if type(data) == str:
+                    data = str.encode(data)
+
+                index[id] = (offset, len(data), cache)
+                offset += len(data) + 1
+                pending.append(id)
+                chunks.append(data)
+                chunks.append(b'\n')
+                size += len(data) + 1
+
+                if size >= WRITE_BUFFER:
+                    flush()
+                    flushed = offset
+                    pending = []
+                    chunks = []
+                    size = 0
+
+            flush()
+            flushed = offset
+        except BaseException:
+            # 出错时缓冲中的记录不再写入 从索引中移除 保持索引与数据一致
+            for id in pending:
+                del index[id]
+            # 写入一半失败时去掉文件中多出的部分
+            if os.lseek(fd, 0, os.SEEK_CUR) > flushed:
+                os.ftruncate(fd, flushed)
+            raise
+        finally:
+            self._offset = flushed
+            # 文件位置已由os.write移动 让缓冲对象重新同步
+            self._h_data.seek(flushed)
 
     def close(self, clear: bool = False):
         if self._close:
@@ -63,17 +203,73 @@ class FileWriter:
         if self._h_data:
             if clear:
                 self._h_data.truncate()
+            elif self._codec:
+                self._write_blocks()
             self._h_data.flush()
+            # 预分配的空间多于实际写入的部分
+            if not clear and self._allocated > self._offset:
+                self._h_data.truncate(self._offset)
 
         if self._h_index:
             if clear:
                 self._h_index.truncate()
+            elif self._index_format == 'binary':
+                write_binary_index(self._h_index, self._index)
+                self._h_index.flush()
             else:
                 data = json.dumps(self._index)
                 self._h_index.write(str.encode(data))
                 self._h_index.flush()
 
         self._index = None
+        self._pending = []
+
+    def _write_blocks(self):
+        codec = self._codec
+        zdict = codec.train([data for _, data in self._pending])
+
+        blocks = []
+        chunk = []
+        size = 0
+        offset = 0
+
+        def flush():
+            nonlocal chunk, size, offset
+            raw = b''.join(chunk)
+            data = codec.compress(raw, zdict)
+            self._h_data.write(data)
+            blocks.append((offset, len(data), len(raw)))
+            offset += len(data)
+            chunk = []
+            size = 0
+
+        for id, data in self._pending:
+            if chunk and size + len(data) + 1 > self._block_size:
+                flush()
+            start, length, cache = self._index[id]
+            self._index[id] = (block_start(len(blocks), size), length, cache)
+            chunk.append(data)
+            chunk.append(b'\n')
+            size += len(data) + 1
+        if chunk:
+            flush()
+
+        with open(os.path.join(self._path, self._name + '.tpb'), 'wb') as handle:
+            write_block_table(handle, codec, zdict, blocks, self._block_size)
+
+
+def _write(fd: int, data: bytes):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def _writev(fd: int, chunks: list[bytes]):
+    total = sum(len(chunk) for chunk in chunks)
+    written = os.writev(fd, chunks)
+    if written < total:
+        # 短写时剩余部分逐个写入
+        _write(fd, b''.join(chunks)[written:])
 
 
 # class ResSet:
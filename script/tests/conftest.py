@@ -0,0 +1,19 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib.base import Resource
+
+
+@pytest.fixture(autouse=True)
+def registry():
+    '''
+    每个测试使用空的资源注册表
+    '''
+    Resource.clear()
+    yield
+    if Resource._loader_ is not None:
+        Resource._loader_.uninstall()
+    Resource.clear()
@@ -0,0 +1,82 @@
+from array import array
+import os
+import pytest
+from lib.base import *
+from lib.attribute import *
+from lib.build import BuildOptions, write_all
+from lib.equipment import Equipment, EquipmentType
+from lib.shard import open_db
+from lib.table import unpack_table
+
+
+ATK, DEF = get_args(Attribute)[:2]
+
+
+def test_arrays_are_kept():
+    numpy = pytest.importorskip('numpy')
+    for values in [array('d', [1.0, 2.0]), array('i', [1, 2]), numpy.asarray([1.0, 2.0]), numpy.arange(2)]:
+        assert ser_attributes_list(values, 2) is values
+
+
+def test_array_errors():
+    numpy = pytest.importorskip('numpy')
+    with pytest.raises(Exception, match='x => size must equal to 3'):
+        ser_attributes_list(array('d', [1.0]), 3, 'x')
+    with pytest.raises(Exception, match='x => size must equal to 3'):
+        ser_attributes_list(numpy.zeros(2), 3, 'x')
+    # 越界时逐个元素定位
+    with pytest.raises(Exception, match=r'x\.\(item\) => must large or equal than 0'):
+        ser_attributes_list(numpy.asarray([1.0, -1.0]), 2, 'x', min=0)
+    assert ser_attributes_list(array('d'), 0, 'x', min=0) == array('d')
+    # 二维数组与非数值数组按普通列表校验
+    with pytest.raises(Exception, match='x => must be an AttributesList'):
+        ser_attributes_list(numpy.zeros((2, 1)), 2, 'x')
+    with pytest.raises(Exception, match=r'x\.\(item\)'):
+        ser_attributes_list(['a', 'b'], 2, 'x')
+
+
+def _build(tmp_path, name, values, **options):
+    Resource.clear()
+    Equipment('Equipment.A', type=get_args(EquipmentType)[0], level=[0, 2], parents={},
+              materials=[{}, {}], values=values, scripts=[], name='a', rare='Rare1', icon='a', sub_icon='s')
+    path = str(tmp_path / name)
+    os.makedirs(path)
+    write_all(path, Resource.all(), BuildOptions(**options))
+    with open_db(path, capacity=0) as db:
+        return {id: db.get(id) for id in db.ids()}
+
+
+@pytest.mark.parametrize('options', [{}, {'packed_tables': True}, {'attribute_ids': True}])
+def test_arrays_build_like_lists(tmp_path, options):
+    numpy = pytest.importorskip('numpy')
+    lists = _build(tmp_path, 'lists', {ATK: [1.0, 2.5], DEF: [3.0, 4.0]}, **options)
+    arrays = _build(tmp_path, 'arrays', {ATK: array('d', [1.0, 2.5]), DEF: numpy.asarray([3.0, 4.0])}, **options)
+    if options.get('packed_tables'):
+        # 数组按自身的dtype直接拷贝 列表按值选择最小的dtype 解码后相同
+        for db in [lists, arrays]:
+            db['Equipment.A']['attributes'] = unpack_table(db['Equipment.A']['attributes'])
+    assert arrays == lists
+
+
+def test_attribute_ids(tmp_path):
+    named = _build(tmp_path, 'named', {ATK: [1.0, 2.0]})
+    ids = _build(tmp_path, 'ids', {ATK: [1.0, 2.0]}, attribute_ids=True)
+
+    assert '@attributes' not in named
+    names = ids['@attributes']
+    assert names == [*get_args(Attribute)] and names.index(ATK) == AttributeIDs[ATK]
+
+    table = ids['Equipment.A']['attributes']
+    assert table == {'x': 1, 'y': 2, 'k': [AttributeIDs[ATK]], 't': [[1.0, 2.0]]}
+    assert {names[k]: v for k, v in zip(table['k'], table['t'])} == named['Equipment.A']['attributes']['t']
+
+
+def test_attribute_key():
+    assert attribute_key(ATK) == ATK
+    with use_output_options(OutputOptions(attribute_ids=True)):
+        assert attribute_key(ATK) == AttributeIDs[ATK]
+        assert attribute_table({}, 2) is None
+        assert attribute_table({ATK: [1.0, 2.0]}, 2)['k'] == [AttributeIDs[ATK]]
+    with use_output_options(OutputOptions(attribute_ids=True, packed_tables=True)):
+        assert 'p' in attribute_table({ATK: [1.0, 2.0]}, 2)
+    assert attribute_table({}, 2) is None
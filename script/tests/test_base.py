@@ -0,0 +1,118 @@
+from dataclasses import dataclass
+import pytest
+from lib.base import *
+
+
+@dataclass(kw_only=True)
+class Sample(Resource):
+    count: int
+    name: str | None = None
+    extra: Mapping[str, int]
+
+    _schema_ = (
+        rule('count', ser_int, min=0, max=9),
+        rule('name', ser_str, optional=True),
+        method(None, '_ser_extra'),
+        method('size', '_ser_size'),
+    )
+
+    def _ser_extra(self):
+        return {'extra': self.extra or None, 'flag': True}
+
+    def _ser_size(self):
+        return len(self.extra) or None
+
+
+@dataclass(kw_only=True)
+class SampleChild(Sample):
+    rare: RareLevel
+
+    _schema_ = (
+        rule('rare', ser_rare_level),
+    )
+
+
+@dataclass(kw_only=True)
+class SampleManual(Sample):
+    @clean()
+    def serialize(self) -> dict[str, Any]:
+        return {'T': 'manual'}
+
+
+def _reference(res: Sample) -> dict[str, Any]:
+    # 逐级展开super().serialize()再clean()的写法
+    out = {
+        'T': type(res).__name__,
+        'res_id': ser_res_id(res.res_id, type(res)),
+        'count': ser_int(res.count, min=0, max=9),
+        'name': ser_str(res.name, optional=True),
+        **res._ser_extra(),
+        'size': res._ser_size(),
+    }
+    if isinstance(res, SampleChild):
+        out['rare'] = ser_rare_level(res.rare)
+    return {k: v for k, v in out.items() if v is not None}
+
+
+def test_compiled_matches_reference():
+    for res in [
+        Sample('Sample.A', count=0, extra={}),
+        Sample('Sample.B', count=9, name='b', extra={'x': 1}),
+        SampleChild('SampleChild.C', count=3, extra={'y': 2}, rare='Rare2'),
+    ]:
+        assert res.serialize() == _reference(res)
+    # 有rule之外的字段顺序也与展开的写法一致
+    assert [*Sample('Sample.D', count=1, name='d', extra={'z': 0}).serialize()] == \
+        ['T', 'res_id', 'count', 'name', 'extra', 'flag', 'size']
+
+
+def test_manual_serialize_is_kept():
+    assert SampleManual('SampleManual.A', count=1, extra={}).serialize() == {'T': 'manual'}
+
+
+@pytest.mark.parametrize('kwargs, message', [
+    ({'count': -1}, 'Sample ~ count => must large or equal than 0'),
+    ({'count': 10}, 'Sample ~ count => must large or equal than 9'),
+    ({'count': True}, 'Sample ~ count => must be a int|None'),
+    ({'count': 1, 'name': 3}, 'Sample ~ name => must be a str'),
+])
+def test_errors(kwargs, message):
+    res = Sample('Sample.A', **{'extra': {}, **kwargs})
+    with pytest.raises(Exception) as info:
+        res.serialize()
+    assert str(info.value) == message
+
+
+def test_inherited_errors():
+    with pytest.raises(Exception, match=r'SampleChild ~ rare'):
+        SampleChild('SampleChild.A', count=1, extra={}, rare='Rare9').serialize()
+    with pytest.raises(Exception, match=r'SampleChild ~ res_id => must start with "SampleChild."'):
+        SampleChild('Sample.X', count=1, extra={}, rare='Rare1').serialize()
+
+
+def test_typed_registries():
+    a = Sample('Sample.A', count=1, extra={})
+    c = SampleChild('SampleChild.C', count=1, extra={}, rare='Rare1')
+    b = Sample('Sample.B', count=1, extra={})
+
+    assert [*Resource.all()] == [a, c, b]
+    # 不包含子类
+    assert [*Resource.all(Sample)] == [a, b] and [*Resource.all(SampleChild)] == [c]
+    assert Resource.count(Sample) == 2 and Resource.count(SampleManual) == 0
+    assert [*Resource.all(SampleManual)] == []
+
+    assert Resource.find('Sample.A', Sample) is a and Resource.find('SampleChild.C') is c
+    assert Resource.is_id('Sample.B', Sample) and not Resource.is_id('SampleChild.C', Sample)
+    assert not Resource.is_id(None, Sample) and not Resource.is_id('Sample.Z', Sample)
+
+    with pytest.raises(Exception, match='Sample.A => id conflict'):
+        Sample('Sample.A', count=1, extra={})
+    with pytest.raises(Exception, match='w => SampleChild.C is not SampleID'):
+        Resource.find('SampleChild.C', Sample, 'w')
+    with pytest.raises(Exception, match='w => Sample.Z not found'):
+        Resource.find('Sample.Z', Sample, 'w')
+    with pytest.raises(Exception, match='w => 3 is not SampleID'):
+        Resource.find(3, Sample, 'w')
+
+    Resource.clear()
+    assert [*Resource.all()] == [] and Resource.count(Sample) == 0
@@ -0,0 +1,69 @@
+from dataclasses import replace
+import json
+import pytest
+import bench
+from lib.base import *
+from lib.build import encode
+from lib.synthetic import SyntheticScale, SyntheticScales, generate
+
+
+def _encoded(scale):
+    Resource.clear()
+    return [(res.res_id, encode(res)) for res in generate(scale)]
+
+
+def test_generate_is_deterministic():
+    small = SyntheticScales['small']
+    first = _encoded(small)
+    assert first == _encoded(small)
+    assert first != _encoded(replace(small, seed=1))
+    assert len({id for id, _ in first}) == len(first)
+
+
+def test_degenerate_scales():
+    # 没有词条 Buff 装饰品时生成的内容也能通过校验
+    scale = SyntheticScale(materials=0, buffs=0, entries=0, equipment_entries=0, equipment_buffs=0,
+                           equipments=3, trees=1, depth=3, levels=1, attributes=1,
+                           random_pools=0, accessories=0)
+    records = _encoded(scale)
+    assert [id.split('.')[0] for id, _ in records] == ['Equipment'] * 3
+    assert _encoded(replace(scale, equipments=0)) == []
+
+
+def test_compare():
+    baseline = {'timings': {'generate': 0.001, 'write': 0.1, 'read': 0.001, 'index': 0.2}}
+    result = {'timings': {'generate': 9.0, 'write': 0.2, 'read': 0.004, 'index': 0.21, 'new': 1.0}}
+    # generate不参与比较 低于MIN_TIME的阶段视为噪声 新增的阶段没有基准
+    assert bench.compare(result, baseline, 0.1) == ['write: 0.1000s -> 0.2000s (+100%)']
+    assert bench.compare(result, baseline, 1.5) == []
+
+
+def test_main(tmp_path, capsys):
+    p_baseline = str(tmp_path / 'baseline.json')
+    args = ['--scale', 'small', '--repeat', '1', '--baseline', p_baseline]
+
+    assert bench.main(args) == 0
+    assert 'no baseline for small' in capsys.readouterr().out
+
+    assert bench.main([*args, '--save']) == 0
+    with open(p_baseline) as handle:
+        baselines = json.load(handle)
+    assert [*baselines] == ['small'] and baselines['small']['resources'] > 0
+
+    # 基准结果中的耗时缩小到几乎为0 全部视为退化
+    for stage in baselines['small']['timings']:
+        baselines['small']['timings'][stage] = 1e-9
+    baselines['small']['timings']['write_all'] = 1.0
+    with open(p_baseline, 'w') as handle:
+        json.dump(baselines, handle)
+    assert bench.main(args) == 1
+    assert 'REGRESSION write_all' not in capsys.readouterr().out
+
+    assert bench.main([*args, '--json', '--packed-tables']) == 0
+    assert 'no baseline for small,packed_tables=True' in capsys.readouterr().out
+
+
+def test_main_profile(capsys):
+    assert bench.main(['--scale', 'small', '--profile']) == 0
+    report = json.loads(capsys.readouterr().out)
+    assert 'Equipment' in report['types'] and 'write' in report['total']
@@ -0,0 +1,155 @@
+import os
+import pytest
+import lib.build
+from lib.base import *
+from lib.build import MANIFEST_FILE, BuildOptions, write_all
+from lib.entry import Entry
+from lib.shard import open_db
+from lib.synthetic import SyntheticScales, generate
+
+
+def _snapshot(path):
+    with open_db(path, capacity=0) as db:
+        return {id: db.raw(id) for id in db.ids()}
+
+
+@pytest.fixture
+def encoded(monkeypatch):
+    ids = []
+    encode = lib.build.encode
+
+    def counting(res):
+        ids.append(res.res_id)
+        return encode(res)
+
+    monkeypatch.setattr(lib.build, 'encode', counting)
+    return ids
+
+
+@pytest.mark.parametrize('options', [{}, {'shards': True}, {'compression': 'zlib', 'index': 'binary'}])
+def test_incremental_reuse(tmp_path, encoded, options):
+    resources = generate(SyntheticScales['small'])
+    path = str(tmp_path)
+    write_all(path, resources, BuildOptions(incremental=True, **options))
+    assert len(encoded) == len(resources)
+    full = _snapshot(path)
+
+    encoded.clear()
+    write_all(path, resources, BuildOptions(incremental=True, **options))
+    assert encoded == []
+    assert _snapshot(path) == full
+
+
+def test_incremental_changes(tmp_path, encoded):
+    resources = generate(SyntheticScales['small'])
+    path = str(tmp_path)
+    write_all(path, resources, BuildOptions(incremental=True))
+
+    # 修改一个词条 引用它的资源也要重新编码
+    entry = next(res for res in resources if type(res) is Entry)
+    entry.name = 'renamed'
+    dependents = {res.res_id for res in resources if entry.res_id in res.references()}
+    assert dependents
+
+    encoded.clear()
+    write_all(path, resources, BuildOptions(incremental=True))
+    assert set(encoded) == {entry.res_id, *dependents}
+    assert _snapshot(path)[entry.res_id] == lib.build.encode(entry)
+
+    # 删除没有被引用的资源 其余资源都能复用
+    referenced = {ref for res in resources for ref in res.references()}
+    removed = next(res for res in resources if res.res_id not in referenced)
+    encoded.clear()
+    write_all(path, [res for res in resources if res is not removed], BuildOptions(incremental=True))
+    assert encoded == [] and removed.res_id not in _snapshot(path)
+
+
+def test_incremental_invalidation(tmp_path, encoded):
+    resources = generate(SyntheticScales['small'])
+    path = str(tmp_path)
+    write_all(path, resources, BuildOptions(incremental=True))
+
+    # 输出选项不同
+    encoded.clear()
+    write_all(path, resources, BuildOptions(incremental=True, packed_tables=True))
+    assert len(encoded) == len(resources)
+
+    # 不开启incremental时不写清单 下次全部重新编码
+    write_all(path, resources, BuildOptions())
+    assert not os.path.exists(os.path.join(path, MANIFEST_FILE))
+    encoded.clear()
+    write_all(path, resources, BuildOptions(incremental=True))
+    assert len(encoded) == len(resources)
+
+    # 数据文件缺失
+    os.remove(os.path.join(path, 'db.tpd'))
+    encoded.clear()
+    write_all(path, resources, BuildOptions(incremental=True))
+    assert len(encoded) == len(resources)
+
+
+def test_failed_build_removes_manifest(tmp_path):
+    resources = generate(SyntheticScales['small'])
+    path = str(tmp_path)
+    write_all(path, resources, BuildOptions(incremental=True))
+    assert os.path.exists(os.path.join(path, MANIFEST_FILE))
+
+    entry = next(res for res in resources if type(res) is Entry)
+    entry.max_piece = -1
+    with pytest.raises(Exception, match='max_piece'):
+        write_all(path, resources, BuildOptions(incremental=True))
+    assert not os.path.exists(os.path.join(path, MANIFEST_FILE))
+
+
+def test_incremental_empty(tmp_path, encoded):
+    write_all(str(tmp_path), [], BuildOptions(incremental=True))
+    write_all(str(tmp_path), [], BuildOptions(incremental=True))
+    assert encoded == []
+    assert _snapshot(str(tmp_path)) == {}
+
+
+
+def _write(path, resources, **options):
+    os.makedirs(path, exist_ok=True)
+    write_all(path, resources, BuildOptions(**options))
+    return _snapshot(path)
+
+
+def test_parallel_matches_serial(tmp_path):
+    resources = generate(SyntheticScales['small'])
+    serial = _write(str(tmp_path / 'serial'), resources)
+    assert _write(str(tmp_path / 'parallel'), resources, workers=3) == serial
+    assert _write(str(tmp_path / 'empty'), [], workers=3) == {}
+
+
+def test_parallel_first_error(tmp_path):
+    resources = generate(SyntheticScales['small'])
+    # 两个不同类型的资源出错 抛出注册顺序在前的那个
+    entry = next(res for res in resources if type(res) is Entry)
+    last = resources[-1]
+    assert type(last) is not Entry
+    entry.max_piece = -1
+    last.name = None
+    for workers in [0, 3]:
+        with pytest.raises(Exception, match='Entry ~ max_piece'):
+            write_all(str(tmp_path), resources, BuildOptions(workers=workers))
+
+
+def test_parallel_incremental(tmp_path):
+    resources = generate(SyntheticScales['small'])
+    path = str(tmp_path / 'db')
+    _write(path, resources, incremental=True, workers=3)
+
+    entry = next(res for res in resources if type(res) is Entry)
+    entry.name = 'renamed'
+    assert _write(path, resources, incremental=True, workers=3) == _write(str(tmp_path / 'serial'), resources)
+
+
+def test_parallel_profile(tmp_path):
+    resources = generate(SyntheticScales['small'])
+    profile = write_all(str(tmp_path), resources, BuildOptions(workers=3, profile=True))
+    serial = write_all(str(tmp_path), resources, BuildOptions(profile=True))
+    assert profile.stats.keys() == serial.stats.keys()
+    for T, stages in serial.stats.items():
+        if 'dumps' in stages:
+            assert profile.stats[T]['dumps'][1:] == stages['dumps'][1:]
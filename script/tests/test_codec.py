@@ -0,0 +1,130 @@
+import json
+import pytest
+from lib.codec import *
+from lib.codec import _BLOCK, _HEADER
+from lib.reader import ResourceDB
+from lib.writer import FileWriter
+
+
+SAMPLES = [json.dumps({'T': 'Equipment', 'name': 'Equipment %d' % i, 'level': [0, i]}).encode() for i in range(200)]
+
+
+def test_codec_is_abstract():
+    with pytest.raises(TypeError):
+        Codec()
+
+    class Partial(Codec):
+        id, name = 99, 'partial'
+
+        def compress(self, data, zdict):
+            return data
+
+    with pytest.raises(TypeError):
+        Partial()
+
+
+def test_codec_conflict():
+    with pytest.raises(Exception, match='Codec conflict: zlib'):
+        register_codec(find_codec('zlib'))
+    with pytest.raises(Exception, match='Unknown codec: nope'):
+        find_codec('nope')
+    with pytest.raises(Exception, match='Unknown codec: 99'):
+        find_codec_id(99)
+
+
+@pytest.mark.parametrize('name', ['zlib', 'lzma'])
+def test_round_trip(name):
+    codec = find_codec(name)
+    assert find_codec_id(codec.id) is codec
+    zdict = codec.train(SAMPLES)
+    data = b'\n'.join(SAMPLES)
+    for raw in [data, b'', b'x']:
+        assert codec.decompress(codec.compress(raw, zdict), zdict) == raw
+
+
+def test_trained_dictionary():
+    assert train_dictionary([], 1024) == b''
+    assert train_dictionary([b''], 1024) == b''
+    zdict = train_dictionary(SAMPLES, 256)
+    assert 0 < len(zdict) <= 256 and b'"Equipment' in zdict
+
+    codec = find_codec('zlib')
+    sample = SAMPLES[7]
+    assert len(codec.compress(sample, zdict)) < len(codec.compress(sample, b''))
+
+
+def test_block_start():
+    assert split_start(block_start(0, 0)) == (0, 0)
+    assert split_start(block_start(123, 0xFFFFFFFF)) == (123, 0xFFFFFFFF)
+
+
+def _write(path, records, **kwargs):
+    with FileWriter(path, compression='zlib', **kwargs) as writer:
+        for id, value in records.items():
+            writer.write(id, json.dumps(value), 0)
+
+
+@pytest.mark.parametrize('block_size', [64, 16 * 1024])
+def test_blocks(tmp_path, block_size):
+    records = {'R.%d' % i: {'i': i, 'pad': 'y' * (i % 50)} for i in range(300)}
+    records['R.big'] = {'pad': 'z' * 1000}
+    _write(str(tmp_path), records, block_size=block_size)
+
+    table = BlockTable(str(tmp_path / 'db.tpb'))
+    assert table.codec is find_codec('zlib') and table.block_size == block_size
+    # 小块时每块只能放下少量记录 超过block_size的记录独占一块
+    assert len(table) > (block_size == 64 and 10 or 0)
+    with ResourceDB(str(tmp_path), capacity=0) as db:
+        assert {id: db.get(id) for id in db.ids()} == records
+
+
+def test_version_1_block_table(tmp_path):
+    records = {'R.%d' % i: {'i': i} for i in range(10)}
+    _write(str(tmp_path), records)
+    p_blocks = str(tmp_path / 'db.tpb')
+    raw = open(p_blocks, 'rb').read()
+    # 版本1的Header没有block_size
+    with open(p_blocks, 'wb') as handle:
+        handle.write(raw[:4] + b'\x01\x00' + raw[6:_HEADER.size - 4] + raw[_HEADER.size:])
+
+    assert BlockTable(p_blocks).block_size is None
+    with ResourceDB(str(tmp_path), capacity=0) as db:
+        assert {id: db.get(id) for id in db.ids()} == records
+
+
+def test_empty_blocks(tmp_path):
+    _write(str(tmp_path), {})
+    assert len(BlockTable(str(tmp_path / 'db.tpb'))) == 0
+    with ResourceDB(str(tmp_path), capacity=0) as db:
+        assert [*db.ids()] == []
+
+
+def test_corrupted_block(tmp_path):
+    _write(str(tmp_path), {'R.%d' % i: {'i': i} for i in range(10)})
+    table = BlockTable(str(tmp_path / 'db.tpb'))
+    data = bytearray(open(tmp_path / 'db.tpd', 'rb').read())
+    assert table.decompress(bytes(data), 0)
+
+    data[len(data) // 2] ^= 0xFF
+    with pytest.raises(Exception, match='Block 0 is corrupted'):
+        table.decompress(bytes(data), 0)
+    with pytest.raises(Exception, match='Block 0 is corrupted'):
+        table.decompress(bytes(data[:len(data) // 2]), 0)
+
+
+def test_invalid_block_table(tmp_path):
+    _write(str(tmp_path), {'R.%d' % i: {'i': i} for i in range(10)})
+    p_blocks = str(tmp_path / 'db.tpb')
+    raw = open(p_blocks, 'rb').read()
+
+    def check(data, message):
+        with open(p_blocks, 'wb') as handle:
+            handle.write(data)
+        with pytest.raises(Exception, match=message):
+            BlockTable(p_blocks)
+
+    check(raw[:_HEADER.size - 1], 'not a block table')
+    check(b'XXXX' + raw[4:], 'not a block table')
+    check(raw[:4] + b'\x03\x00' + raw[6:], 'unsupported block table version 3')
+    check(raw[:6] + b'\x63\x00' + raw[8:], 'unknown codec 99')
+    check(raw[:-_BLOCK.size // 2], 'block table is truncated')
@@ -0,0 +1,118 @@
+import json
+import os
+from lib.base import Resource
+from lib.content import CONTENT_INDEX_FILE, ContentPack
+
+
+MODULES = {
+    'a.py': ['Resource.A1', 'Resource.A2'],
+    'b/c.py': ['Resource.C1'],
+    'b/d.py': ['Resource.D1', 'Resource.D2'],
+}
+
+
+def _pack(tmp_path, modules=MODULES):
+    root = tmp_path / 'pack'
+    for rel, ids in modules.items():
+        path = root / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text('from lib.base import Resource\n' + ''.join("Resource('%s')\n" % id for id in ids))
+    return str(root)
+
+
+def _ids(path):
+    with open(os.path.join(path, 'db.tpi')) as handle:
+        return [*json.load(handle)]
+
+
+def test_lazy_find(tmp_path):
+    root = _pack(tmp_path)
+    with ContentPack(root) as pack:
+        assert os.path.exists(os.path.join(root, CONTENT_INDEX_FILE))
+        Resource.clear()
+
+        assert Resource.find('Resource.D2').res_id == 'Resource.D2'
+        assert pack.loaded == {'b/d.py'}
+        assert Resource.is_id('Resource.C1', Resource)
+        assert pack.loaded == {'b/d.py', 'b/c.py'}
+        assert not Resource.is_id('Resource.Missing', Resource)
+
+
+def test_warm_index_skips_imports(tmp_path):
+    root = _pack(tmp_path)
+    ContentPack(root)
+    Resource.clear()
+
+    pack = ContentPack(root)
+    assert pack.stats()['import_count'] == 0
+    assert pack.refresh() == []
+
+
+def test_refresh_detects_changes(tmp_path):
+    root = _pack(tmp_path)
+    ContentPack(root)
+    Resource.clear()
+
+    with open(os.path.join(root, 'a.py'), 'a') as handle:
+        handle.write("Resource('Resource.A3')\n")
+    pack = ContentPack(root)
+    assert pack.modules['a.py']['ids'] == ['Resource.A1', 'Resource.A2', 'Resource.A3']
+
+
+def test_nested_load_credits_the_inner_module(tmp_path):
+    root = _pack(tmp_path)
+    ContentPack(root)
+    Resource.clear()
+
+    # a.py导入时查找尚未导入的b/d.py中的资源 b/d.py也修改过
+    with open(os.path.join(root, 'a.py'), 'a') as handle:
+        handle.write("Resource.find('Resource.D1')\nResource('Resource.A3')\n")
+    with open(os.path.join(root, 'b/d.py'), 'a') as handle:
+        handle.write("Resource('Resource.D3')\n")
+    with ContentPack(root, refresh=False) as pack:
+        assert pack.refresh() == ['a.py', 'b/d.py']
+        assert pack.loaded == {'a.py', 'b/d.py'}
+        assert pack.modules['a.py']['ids'] == ['Resource.A1', 'Resource.A2', 'Resource.A3']
+        assert pack.modules['b/d.py']['ids'] == ['Resource.D1', 'Resource.D2', 'Resource.D3']
+
+    Resource.clear()
+    with ContentPack(root) as pack:
+        assert pack.stats()['import_count'] == 0
+        assert Resource.find('Resource.D3').res_id == 'Resource.D3'
+        assert pack.loaded == {'b/d.py'}
+
+
+def test_write_order_ignores_access_history(tmp_path):
+    root = _pack(tmp_path)
+    Resource('Resource.Outside')
+
+    first = str(tmp_path / 'first')
+    os.makedirs(first)
+    with ContentPack(root) as pack:
+        pack.reset()
+        Resource.clear()
+        Resource('Resource.Outside')
+        Resource.write_all(first)
+
+    second = str(tmp_path / 'second')
+    os.makedirs(second)
+    with ContentPack(root) as pack:
+        pack.reset()
+        Resource.clear()
+        Resource('Resource.Outside')
+        Resource.find('Resource.D1')
+        Resource.find('Resource.C1')
+        assert [res.res_id for res in Resource.all(Resource)][:3] == ['Resource.Outside', 'Resource.A1', 'Resource.A2']
+        Resource.write_all(second)
+
+    assert _ids(first) == _ids(second) == [
+        'Resource.Outside', 'Resource.A1', 'Resource.A2', 'Resource.C1', 'Resource.D1', 'Resource.D2',
+    ]
+
+
+def test_empty_pack(tmp_path):
+    root = tmp_path / 'empty'
+    root.mkdir()
+    with ContentPack(str(root)) as pack:
+        assert pack.modules == {}
+        assert [*Resource.all()] == []
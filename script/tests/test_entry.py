@@ -0,0 +1,42 @@
+import os
+from lib.base import *
+from lib.attribute import Attribute
+from lib.build import BuildOptions, write_all
+from lib.entry import Entry, EntryType
+from lib.shard import open_db
+
+
+ATK, DEF = get_args(Attribute)[:2]
+
+
+def _build(tmp_path, **options):
+    path = str(tmp_path / 'db')
+    os.makedirs(path, exist_ok=True)
+    write_all(path, Resource.all(), BuildOptions(**options))
+    with open_db(path, capacity=0) as db:
+        return {id: db.get(id) for id in db.ids()}
+
+
+def test_stacking_is_off_by_default(tmp_path):
+    Entry('Entry.A', type=get_args(EntryType)[0], max_piece=1, piece_values={ATK: [2.0]},
+          name='a', rare='Rare1', icon='a')
+    assert 'stacking' not in _build(tmp_path)['Entry.A']
+
+
+def test_stacking_matrix(tmp_path):
+    # max_piece=2 => 3个piece x 5个plus
+    Entry('Entry.A', type=get_args(EntryType)[0], max_piece=2,
+          piece_values={ATK: [1.0, 3.0]}, plus_values={ATK: [0.1, 0.2, 0.3, 0.4], DEF: [1.0, 2.0, 3.0, 4.0]},
+          name='a', rare='Rare1', icon='a')
+    table = _build(tmp_path, entry_stacking=True)['Entry.A']['stacking']
+    assert table['x'] == 2 and table['y'] == 15
+    atk, def_ = table['t'][ATK], table['t'][DEF]
+    assert atk[:5] == [0] * 5 and def_[:5] == [0] * 5
+    assert atk[5:10] == [1.0, 1.1, 1.2, 1.3, 1.4]
+    assert def_[10:15] == [0, 1.0, 2.0, 3.0, 4.0]
+    assert atk[14] == 3.4
+
+
+def test_stacking_without_values(tmp_path):
+    Entry('Entry.A', type=get_args(EntryType)[0], max_piece=0, name='a', rare='Rare1', icon='a')
+    assert 'stacking' not in _build(tmp_path, entry_stacking=True)['Entry.A']
@@ -0,0 +1,132 @@
+import json
+import os
+import pytest
+from lib.base import *
+from lib.attribute import Attribute
+from lib.build import MANIFEST_FILE, BuildOptions, write_all
+from lib.equipment import Equipment, EquipmentTree, EquipmentType, material_prefix
+from lib.shard import open_db
+
+
+ATK = get_args(Attribute)[0]
+
+
+def _equipment(id, parents={}, level=[0, 2], materials=None):
+    return Equipment(id, type=get_args(EquipmentType)[0], level=level, parents=parents,
+                     materials=materials or [{} for _ in range(level[1] - level[0])],
+                     values={ATK: [1.0] * (level[1] - level[0])}, scripts=[],
+                     name=id, rare='Rare1', icon='e', sub_icon='s')
+
+
+def test_empty_tree():
+    tree = EquipmentTree([])
+    assert len(tree) == 0
+    assert tree.serialize() == {'ids': [], 'parents': [], 'parent_levels': [],
+                                'ancestors': {'o': [0], 'v': []}, 'descendants': {'o': [0], 'v': []}}
+
+
+def test_tree_order_and_closures():
+    # 子节点先于父节点注册 拓扑序仍然是父节点在前
+    d = _equipment('Equipment.D', {'Equipment.B': 1, 'Equipment.C': 2})
+    b = _equipment('Equipment.B', {'Equipment.A': 1})
+    a = _equipment('Equipment.A')
+    c = _equipment('Equipment.C', {'Equipment.A': 2, 'Equipment.Missing': 1})
+    tree = EquipmentTree([d, b, a, c])
+
+    assert tree.order == ['Equipment.A', 'Equipment.B', 'Equipment.C', 'Equipment.D']
+    assert tree.parents == [[], [(0, 1)], [(0, 2)], [(1, 1), (2, 2)]]
+    assert tree.ancestors('Equipment.D') == ['Equipment.A', 'Equipment.B', 'Equipment.C']
+    assert tree.ancestors('Equipment.A') == []
+    assert tree.descendants('Equipment.A') == ['Equipment.B', 'Equipment.C', 'Equipment.D']
+    assert tree.descendants('Equipment.D') == []
+
+
+def test_tree_cycle():
+    _equipment('Equipment.A', {'Equipment.C': 1})
+    _equipment('Equipment.B', {'Equipment.A': 1})
+    _equipment('Equipment.C', {'Equipment.B': 1})
+    _equipment('Equipment.R')
+    with pytest.raises(Exception, match='cycle: Equipment.B -> Equipment.C -> Equipment.A -> Equipment.B'):
+        EquipmentTree(Resource.all())
+
+    with pytest.raises(Exception, match='cycle: Equipment.S -> Equipment.S'):
+        EquipmentTree([_equipment('Equipment.S', {'Equipment.S': 0})])
+
+
+def _ids(path):
+    with open_db(path, capacity=0) as db:
+        return set(db.ids())
+
+
+def test_tree_stage(tmp_path):
+    path = str(tmp_path / 'db')
+    os.makedirs(path)
+    write_all(path, [], BuildOptions(equipment_tree=True, material_prefix=True))
+    assert '@equipment_tree' not in _ids(path)
+
+    _equipment('Equipment.A')
+    _equipment('Equipment.B', {'Equipment.A': 1})
+    # 默认不输出
+    write_all(path, Resource.all(), BuildOptions())
+    assert not any(id.startswith('@') for id in _ids(path))
+
+    write_all(path, Resource.all(), BuildOptions(material_prefix=True))
+    assert '@equipment_tree' not in _ids(path) and '@material_prefix.Equipment.B' in _ids(path)
+
+    write_all(path, Resource.all(), BuildOptions(equipment_tree=True))
+    assert '@equipment_tree' in _ids(path) and '@material_prefix.Equipment.B' not in _ids(path)
+    with open_db(path, capacity=0) as db:
+        record = db.get('@equipment_tree')
+    assert record['ids'] == ['Equipment.A', 'Equipment.B']
+    assert record['parents'] == [[], [0]] and record['parent_levels'] == [[], [1]]
+    assert record['ancestors'] == {'o': [0, 0, 1], 'v': [0]}
+
+
+def test_tree_stage_invalidates_incremental(tmp_path):
+    path = str(tmp_path / 'db')
+    os.makedirs(path)
+    _equipment('Equipment.A')
+    _equipment('Equipment.B', {'Equipment.A': 1})
+    write_all(path, Resource.all(), BuildOptions(incremental=True))
+    with open(os.path.join(path, MANIFEST_FILE)) as handle:
+        before = json.load(handle)
+
+    write_all(path, Resource.all(), BuildOptions(incremental=True, equipment_tree=True, material_prefix=True))
+    with open(os.path.join(path, MANIFEST_FILE)) as handle:
+        after = json.load(handle)
+    assert before['output'] != after['output']
+    assert {'@equipment_tree', '@material_prefix.Equipment.A'} <= _ids(path)
+
+
+def test_material_prefix():
+    a = _equipment('Equipment.A', level=[0, 3], materials=[{'Material.M': 1}, {'Material.M': 2}, {'Material.N': 5}])
+    b = _equipment('Equipment.B', {'Equipment.A': 2}, level=[2, 4], materials=[{'Material.M': 10}, {}])
+    equipments = {e.res_id: e for e in [a, b]}
+    tables = material_prefix(EquipmentTree(equipments.values()), equipments)
+
+    assert tables['Equipment.A'] == {'Material.M': [0, 1, 3, 3], 'Material.N': [0, 0, 0, 5]}
+    # 在等级2接上A的累计值 N在A的等级2之前没有消耗
+    assert tables['Equipment.B'] == {'Material.M': [3, 13, 13], 'Material.N': [0, 0, 0]}
+
+
+def test_material_prefix_rejects_multiple_parents(tmp_path):
+    _equipment('Equipment.A', level=[0, 1])
+    _equipment('Equipment.B', level=[0, 1])
+    _equipment('Equipment.C', {'Equipment.B': 1, 'Equipment.A': 1}, level=[1, 2])
+    equipments = {res.res_id: res for res in Resource.all()}
+    with pytest.raises(Exception, match=r'parents => material prefix requires at most one parent: '
+                                        r'Equipment\.C <- Equipment\.B, Equipment\.A'):
+        material_prefix(EquipmentTree(equipments.values()), equipments)
+
+    # 装备树本身允许多个父节点
+    path = str(tmp_path / 'db')
+    os.makedirs(path)
+    write_all(path, Resource.all(), BuildOptions(equipment_tree=True))
+    with pytest.raises(Exception, match='at most one parent'):
+        write_all(path, Resource.all(), BuildOptions(material_prefix=True))
+
+
+def test_material_prefix_without_materials():
+    a = _equipment('Equipment.A', level=[0, 0], materials=[])
+    equipments = {'Equipment.A': a}
+    assert material_prefix(EquipmentTree([a]), equipments) == {'Equipment.A': {}}
@@ -0,0 +1,82 @@
+import io
+import json
+import pytest
+import lib.index
+from lib.index import _HEADER, BinaryIndex, load_index, write_binary_index
+
+
+def _write(path, index):
+    with open(path, 'wb') as handle:
+        write_binary_index(handle, index)
+    return BinaryIndex(path)
+
+
+def test_round_trip(tmp_path):
+    index = {'Equipment.%d' % i: (i * 10, i, i % 3) for i in range(500)}
+    index['中文.ID'] = (7, 8, 1)
+    binary = _write(str(tmp_path / 'db.tpi'), index)
+    assert len(binary) == len(index)
+    assert {id: binary[id] for id in binary} == index
+    assert dict(binary) == index
+    binary.close()
+
+
+def test_empty(tmp_path):
+    binary = _write(str(tmp_path / 'db.tpi'), {})
+    assert len(binary) == 0 and [*binary] == []
+    assert 'A' not in binary
+    with pytest.raises(KeyError):
+        binary['A']
+    binary.close()
+
+
+def test_missing_ids(tmp_path):
+    binary = _write(str(tmp_path / 'db.tpi'), {'A.1': (0, 1, 0)})
+    assert 'A.2' not in binary and 1 not in binary and None not in binary
+    assert binary.get('A.2') is None
+    with pytest.raises(KeyError):
+        binary['A.2']
+    binary.close()
+
+
+def test_hash_collision(tmp_path, monkeypatch):
+    # 所有ID同一个hash 只能按名字区分
+    monkeypatch.setattr(lib.index, 'id_hash', lambda id: 42)
+    index = {'B': (1, 1, 0), 'A': (0, 1, 1), 'C': (2, 1, 0)}
+    binary = _write(str(tmp_path / 'db.tpi'), index)
+    assert [*binary] == ['A', 'B', 'C']
+    assert dict(binary) == index
+    assert 'D' not in binary
+    binary.close()
+
+
+def test_id_too_long():
+    with pytest.raises(Exception, match='ID too long'):
+        write_binary_index(io.BytesIO(), {'x' * 0x10000: (0, 0, 0)})
+
+
+def test_invalid_index(tmp_path):
+    path = str(tmp_path / 'db.tpi')
+    for data, message in [
+        (b'TPI1', 'not a binary index'),
+        (b'XXXX' + bytes(_HEADER.size - 4), 'not a binary index'),
+        (_HEADER.pack(b'TPI1', 2, 32, 0, _HEADER.size), 'unsupported index version 2'),
+    ]:
+        with open(path, 'wb') as handle:
+            handle.write(data)
+        with pytest.raises(Exception, match=message):
+            BinaryIndex(path)
+
+
+def test_load_index(tmp_path):
+    index = {'A.1': (0, 3, 0), 'A.2': (4, 5, 1)}
+    p_json = str(tmp_path / 'json.tpi')
+    with open(p_json, 'w') as handle:
+        json.dump(index, handle)
+    assert load_index(p_json) == index
+
+    p_binary = str(tmp_path / 'binary.tpi')
+    _write(p_binary, index).close()
+    binary = load_index(p_binary)
+    assert isinstance(binary, BinaryIndex) and dict(binary) == index
+    binary.close()
@@ -0,0 +1,135 @@
+from collections import Counter
+from itertools import combinations, product
+import pytest
+from lib.base import *
+from lib.entry import Entry, Slots
+from lib.optimizer import LoadoutOptimizer, SearchSpace
+from lib.stats import Loadout, StatCalculator
+from lib.synthetic import SyntheticScale, generate
+
+
+TINY = SyntheticScale(
+    materials=2, buffs=2, entries=6, max_piece=2, equipments=4, trees=2, depth=2, levels=3,
+    attributes=6, equipment_entries=2, equipment_buffs=0, random_pools=1, pool_size=2,
+    accessories=3, accessory_levels=2,
+)
+
+
+def _levels(res):
+    return range(*res.level) if hasattr(res, 'level') else range(res.max_level)
+
+
+def _slots(res, level):
+    slots = res.values.get(Slots)
+    base = res.level[0] if hasattr(res, 'level') else 0
+    return slots and [*slots[level - base]] or []
+
+
+def _brute_force(calc, space, weights):
+    '''
+    枚举全部合法的loadout 同类型槽中宝石的排列只算一次
+    '''
+    names = [calc.names.index(name) for name in weights]
+    gems = [(id, Resource.find(id)) for id in space.gems]
+    accessories = [(id, level) for id in space.accessories for level in _levels(Resource.find(id))]
+
+    seen = set()
+    scores = []
+    for id in space.equipments:
+        equipment = Resource.find(id)
+        for level in _levels(equipment):
+            for n in range(space.accessory_count + 1):
+                for chosen in combinations(accessories, n):
+                    if len({a for a, _ in chosen}) < n:
+                        continue
+                    slots = _slots(equipment, level) + [s for a, l in chosen for s in _slots(Resource.find(a), l)]
+                    _, pieces, _ = calc.item('equipment', id, level)
+                    for a, l in chosen:
+                        for j, p in calc.item('accessory', a, l)[1].items():
+                            pieces[j] = pieces.get(j, 0) + p
+                    for picked in product([None, *range(len(gems))], repeat=len(slots)):
+                        used = Counter()
+                        ok = True
+                        for slot, g in zip(slots, picked):
+                            if g is None:
+                                continue
+                            gid, entry = gems[g]
+                            used[gid] += 1
+                            j = calc.entry_index[gid]
+                            if slot != 'Extra' and slot != entry.type:
+                                ok = False
+                            elif pieces.get(j, 0) + used[gid] > entry.max_piece:
+                                ok = False
+                            elif space.gems[gid] is not None and used[gid] > space.gems[gid]:
+                                ok = False
+                        if not ok:
+                            continue
+                        key = (id, level, frozenset(chosen), frozenset(Counter(zip(slots, picked)).items()))
+                        if key in seen:
+                            continue
+                        seen.add(key)
+                        loadout = Loadout(id, level, [*chosen], {gid: (c, 0) for gid, c in used.items()})
+                        final = calc.compute([loadout])[0]
+                        scores.append(sum(final[k] * w for k, w in zip(names, weights.values())))
+    return sorted(scores, reverse=True)
+
+
+@pytest.fixture
+def tiny():
+    resources = generate(TINY)
+    calc = StatCalculator(resources)
+    equipments = {res.res_id: None for res in resources if type(res).__name__ == 'Equipment'}
+    accessories = {res.res_id: None for res in resources if type(res).__name__ == 'Accessory'}
+    entries = [res.res_id for res in resources if type(res) is Entry]
+    return calc, equipments, accessories, entries
+
+
+@pytest.mark.parametrize('count, gems, top_k', [(0, 0, 5), (1, 0, 8), (2, 2, 10), (2, 3, 3)])
+def test_matches_brute_force(tiny, count, gems, top_k):
+    calc, equipments, accessories, entries = tiny
+    space = SearchSpace(equipments=equipments, accessories=accessories, accessory_count=count,
+                        gems={id: (k % 2 and 1 or None) for k, id in enumerate(entries[:gems])})
+    weights = {name: 1.0 + k % 3 for k, name in enumerate(calc.names[:6])}
+
+    results = LoadoutOptimizer(calc).search(space, weights, top_k=top_k)
+    expected = _brute_force(calc, space, weights)
+    assert [r.score for r in results] == pytest.approx(expected[:top_k])
+
+    # 返回的loadout重新计算得分一致
+    names = [calc.names.index(name) for name in weights]
+    for result in results:
+        final = calc.compute([result.loadout])[0]
+        assert sum(final[k] * w for k, w in zip(names, weights.values())) == pytest.approx(result.score)
+
+
+def test_parallel_matches_serial(tiny):
+    calc, equipments, accessories, entries = tiny
+    space = SearchSpace(equipments=equipments, accessories=accessories, accessory_count=2, gems={entries[0]: None})
+    weights = {calc.names[0]: 1.0, calc.names[1]: 0.5}
+    serial = LoadoutOptimizer(calc).search(space, weights, top_k=6)
+    parallel = LoadoutOptimizer(calc).search(space, weights, top_k=6, workers=3)
+    assert [r.score for r in parallel] == pytest.approx([r.score for r in serial])
+
+
+def test_empty_and_invalid(tiny):
+    calc, equipments, _, entries = tiny
+    optimizer = LoadoutOptimizer(calc)
+    assert optimizer.search(SearchSpace(equipments={}), {calc.names[0]: 1.0}) == []
+
+    # 指定的等级
+    id = next(iter(equipments))
+    level = Resource.find(id).level[0]
+    results = optimizer.search(SearchSpace(equipments={id: [level]}), {calc.names[0]: 1.0}, top_k=5)
+    assert [(r.loadout.equipment, r.loadout.level) for r in results] == [(id, level)]
+
+    for space, score, message in [
+        (SearchSpace(equipments={'Equipment.Nope': None}), {calc.names[0]: 1.0}, 'not found'),
+        (SearchSpace(equipments=equipments, accessory_count=-1), {calc.names[0]: 1.0}, 'accessory_count'),
+        (SearchSpace(equipments=equipments, gems={id: None}), {calc.names[0]: 1.0}, 'is not an Entry'),
+        (SearchSpace(equipments=equipments), {'Nope': 1.0}, 'is not a stat name'),
+        (SearchSpace(equipments=equipments), {calc.names[0]: -1.0}, 'must not less than 0'),
+    ]:
+        with pytest.raises(Exception, match=message):
+            optimizer.search(space, score)
+    with pytest.raises(Exception, match='top_k'):
+        optimizer.search(SearchSpace(equipments=equipments), {calc.names[0]: 1.0}, top_k=0)
@@ -0,0 +1,190 @@
+import json
+import os
+import pytest
+from lib.build import MANIFEST_FILE, BuildOptions, write_all
+from lib.patch import apply_patch, read_patch, write_patch
+from lib.shard import SHARD_FILE, ShardedWriter, load_shards, open_db
+from lib.synthetic import SyntheticScales, generate
+from lib.writer import FileWriter
+
+
+def _write(path, records, shards=False, **kwargs):
+    os.makedirs(path, exist_ok=True)
+    writer = shards and ShardedWriter(path, **kwargs) or FileWriter(path, **kwargs)
+    with writer:
+        for id, value in records.items():
+            writer.write(id, json.dumps(value), 0)
+
+
+def _read(path):
+    with open_db(path, capacity=0) as db:
+        return {id: db.get(id) for id in db.ids()}
+
+
+def _snapshot(path):
+    return {name: open(os.path.join(path, name), 'rb').read() for name in sorted(os.listdir(path))}
+
+
+@pytest.mark.parametrize('options', [
+    {},
+    {'index': 'binary'},
+    {'compression': 'zlib'},
+    {'shards': True},
+    {'shards': True, 'compression': 'zlib', 'index': 'binary'},
+])
+def test_round_trip(tmp_path, options):
+    resources = generate(SyntheticScales['small'])
+    base, target = str(tmp_path / 'base'), str(tmp_path / 'target')
+    os.makedirs(base)
+    os.makedirs(target)
+    write_all(base, resources, BuildOptions(**options))
+
+    buff = next(res for res in resources if res.res_id.startswith('Buff.'))
+    key = next(iter(buff.arguments))
+    buff.arguments[key] += 1
+    removed = [res for res in resources if res.res_id.startswith('Accessory.')][:2]
+    write_all(target, [res for res in resources if res not in removed], BuildOptions(**options))
+
+    p_patch = str(tmp_path / 'a.tpp')
+    stats = write_patch(base, target, p_patch)
+    assert stats.removed == 2 and stats.changed >= 1 and stats.added == 0
+    assert stats.size < stats.db_size
+
+    apply_patch(base, p_patch)
+    assert _read(base) == _read(target)
+
+    # 追加后的文件中留有失效的记录
+    with open_db(base, capacity=0) as db:
+        if options.get('shards'):
+            assert db.decode_type('Buff') == {id: value for id, value in _read(target).items() if id.startswith('Buff.')}
+        else:
+            assert db.decode_all() == _read(target)
+
+    with pytest.raises(Exception, match='does not match|not found'):
+        apply_patch(base, p_patch)
+
+
+def _blocks(path):
+    with open_db(path, capacity=0) as db:
+        segments = [db] if load_shards(path) is None else [db.segment(name) for name in db._segments]
+        return [(segment._blocks.block_size, segment._blocks.blocks) for segment in segments]
+
+
+@pytest.mark.parametrize('shards', [False, True])
+@pytest.mark.parametrize('compact', [None, 0.5])
+def test_block_size(tmp_path, shards, compact):
+    # 追加的块与重写的段沿用目标的块大小 而不是BLOCK_SIZE
+    base, target = str(tmp_path / 'base'), str(tmp_path / 'target')
+    _write(base, {'a.A%d' % i: i for i in range(40)}, shards, compression='zlib', block_size=64)
+    records = {'a.A%d' % i: i for i in range(20)}
+    records.update({'a.A%d' % i: 'y' * i for i in range(20, 30)})
+    records.update({'b.B%d' % i: 'x' * i for i in range(20)})
+    _write(target, records, shards, compression='zlib', block_size=64)
+
+    p_patch = str(tmp_path / 'a.tpp')
+    write_patch(base, target, p_patch)
+    assert read_patch(p_patch)[0]['block_size'] == 64
+    apply_patch(base, p_patch, compact)
+    assert _read(base) == records
+
+    for block_size, blocks in _blocks(base):
+        assert block_size == 64 and len(blocks) > 1
+        assert all(raw_size <= 64 for _, _, raw_size in blocks)
+
+
+def test_identical_builds(tmp_path):
+    _write(str(tmp_path / 'a'), {'a.A': 1})
+    _write(str(tmp_path / 'b'), {'a.A': 1})
+    stats = write_patch(str(tmp_path / 'a'), str(tmp_path / 'b'), str(tmp_path / 'p.tpp'))
+    assert (stats.added, stats.changed, stats.removed) == (0, 0, 0)
+    assert read_patch(str(tmp_path / 'p.tpp'))[1] == []
+    apply_patch(str(tmp_path / 'a'), str(tmp_path / 'p.tpp'))
+    assert _read(str(tmp_path / 'a')) == {'a.A': 1}
+
+
+def test_add_and_resplit_types(tmp_path):
+    base, target = str(tmp_path / 'base'), str(tmp_path / 'target')
+    _write(base, {'a.A%d' % i: i for i in range(50)}, shards=True)
+    records = {'a.A%d' % i: i * 2 for i in range(60)}
+    records['c.C'] = 'new'
+    _write(target, records, shards=True, shard_size=200)
+
+    write_patch(base, target, str(tmp_path / 'p.tpp'))
+    apply_patch(base, str(tmp_path / 'p.tpp'))
+    assert load_shards(base) == load_shards(target)
+    assert _read(base) == _read(target)
+    assert not [name for name in os.listdir(base) if name.endswith('.tmp') or '.tmp.' in name]
+
+
+@pytest.mark.parametrize('shards', [False, True])
+def test_diverged_db_is_untouched(tmp_path, shards):
+    base, target, live = str(tmp_path / 'base'), str(tmp_path / 'target'), str(tmp_path / 'live')
+    _write(base, {'a.A': 1, 'b.B': 2}, shards=shards)
+    _write(target, {'a.A': 10, 'b.B': 20}, shards=shards)
+    _write(live, {'a.A': 1, 'b.B': 99}, shards=shards)
+    open(os.path.join(live, MANIFEST_FILE), 'w').write('{}')
+    write_patch(base, target, str(tmp_path / 'p.tpp'))
+
+    before = _snapshot(live)
+    with pytest.raises(Exception, match='does not match'):
+        apply_patch(live, str(tmp_path / 'p.tpp'))
+    assert _snapshot(live) == before
+    assert _read(live) == {'a.A': 1, 'b.B': 99}
+
+
+def test_diverged_rebuild_is_untouched(tmp_path):
+    base, target, live = str(tmp_path / 'base'), str(tmp_path / 'target'), str(tmp_path / 'live')
+    _write(base, {'a.A': 1, 'b.B': 2}, shards=True)
+    _write(target, {'a.A': 10, 'b.B': 2, 'c.C': 3}, shards=True)
+    _write(live, {'a.A': 5, 'b.B': 2}, shards=True)
+    write_patch(base, target, str(tmp_path / 'p.tpp'))
+
+    before = _snapshot(live)
+    with pytest.raises(Exception, match='does not match'):
+        apply_patch(live, str(tmp_path / 'p.tpp'))
+    assert _snapshot(live) == before
+    assert os.path.exists(os.path.join(live, SHARD_FILE))
+
+
+def test_layout_mismatch(tmp_path):
+    _write(str(tmp_path / 'a'), {'a.A': 1})
+    _write(str(tmp_path / 'b'), {'a.A': 2}, shards=True)
+    _write(str(tmp_path / 'c'), {'a.A': 1}, shards=True)
+    write_patch(str(tmp_path / 'c'), str(tmp_path / 'b'), str(tmp_path / 'p.tpp'))
+    with pytest.raises(Exception, match='sharded'):
+        apply_patch(str(tmp_path / 'a'), str(tmp_path / 'p.tpp'))
+
+
+@pytest.mark.parametrize('compression', [None, 'zlib'])
+def test_compaction(tmp_path, compression):
+    base, target = str(tmp_path / 'base'), str(tmp_path / 'target')
+    _write(base, {'a.A%d' % i: 'x' * 50 for i in range(100)}, compression=compression)
+    _write(target, {'a.A%d' % i: 'y' * 50 for i in range(100)}, compression=compression)
+    write_patch(base, target, str(tmp_path / 'p.tpp'))
+
+    # 一半的字节失效
+    stats = apply_patch(base, str(tmp_path / 'p.tpp'), compact=0.4)
+    assert stats.changed == 100 and stats.compacted == 1
+    assert os.path.getsize(os.path.join(base, 'db.tpd')) == os.path.getsize(os.path.join(target, 'db.tpd'))
+    assert _read(base) == _read(target)
+
+
+def test_apply_removes_build_manifest(tmp_path):
+    base, target = str(tmp_path / 'base'), str(tmp_path / 'target')
+    _write(base, {'a.A': 1})
+    _write(target, {'a.A': 2})
+    open(os.path.join(base, MANIFEST_FILE), 'w').write('{}')
+    write_patch(base, target, str(tmp_path / 'p.tpp'))
+    apply_patch(base, str(tmp_path / 'p.tpp'), compact=None)
+    assert not os.path.exists(os.path.join(base, MANIFEST_FILE))
+
+
+def test_corrupted_patch(tmp_path):
+    _write(str(tmp_path / 'a'), {'a.A': 1})
+    _write(str(tmp_path / 'b'), {'a.A': 2})
+    p_patch = str(tmp_path / 'p.tpp')
+    write_patch(str(tmp_path / 'a'), str(tmp_path / 'b'), p_patch)
+    data = open(p_patch, 'rb').read()
+    open(p_patch, 'wb').write(data[:-1])
+    with pytest.raises(Exception, match='truncated'):
+        read_patch(p_patch)
@@ -0,0 +1,59 @@
+import json
+import os
+from lib.build import BuildOptions, write_all
+from lib.pool import ConstantPool, pool_hook
+from lib.shard import open_db
+from lib.synthetic import SyntheticScales, generate
+
+
+def _round_trip(records):
+    pool = ConstantPool.from_records(records)
+    hook = pool_hook(pool.serialize())
+    return pool, [json.loads(json.dumps(pool.intern(record)), object_hook=hook) for record in records]
+
+
+def test_empty():
+    pool, decoded = _round_trip([])
+    assert len(pool) == 0 and decoded == []
+    pool, decoded = _round_trip([{}, []])
+    assert len(pool) == 0 and decoded == [{}, []]
+
+
+def test_repeated_values_share_one_object():
+    table = {'x': ['a', 'b'], 'y': [[1, 2], [3, 4]]}
+    records = [{'name': 'a long repeated string', 'table': dict(table)} for _ in range(3)]
+    pool, decoded = _round_trip(records)
+    assert 'a long repeated string' in pool.values and table in pool.values
+    assert decoded == records
+    assert decoded[0]['table'] is decoded[1]['table']
+
+
+def test_dollar_keys_are_not_references():
+    records = [
+        {'$': 0, 'name': 'a long repeated string'},
+        {'v': {'$': 0}, 'w': {'$$': 1, '$x': 'a long repeated string'}},
+        {'t': {'x': ['$'], 'y': [{'$': 0}]}},
+    ]
+    pool, decoded = _round_trip(records)
+    assert len(pool) > 0
+    assert decoded == records
+
+
+def test_type_tags_are_not_pooled():
+    records = [{'T': 'SomeLongTypeName', 'v': [{'T': 'SomeLongTypeName'}]} for _ in range(10)]
+    pool = ConstantPool.from_records(records)
+    assert len(pool) == 0
+    assert pool.intern(records[0]) == records[0]
+
+
+def test_raw_records_keep_type_tags(tmp_path):
+    resources = generate(SyntheticScales['small'])
+    path = str(tmp_path / 'db')
+    os.makedirs(path)
+    write_all(path, resources, BuildOptions(constant_pool=True))
+
+    with open_db(path, capacity=0) as db:
+        assert db.get('@pool')
+        for res in resources[:50]:
+            raw = json.loads(db.raw(res.res_id))
+            assert raw['T'] == type(res).__name__
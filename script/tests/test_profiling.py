@@ -0,0 +1,59 @@
+import json
+from lib.base import *
+from lib.build import BuildOptions, write_all
+from lib.profiling import BuildProfile
+from lib.synthetic import SyntheticScales, generate
+
+
+def test_build_profile(tmp_path):
+    resources = generate(SyntheticScales['small'])
+    calls = []
+    profile = write_all(str(tmp_path), resources, BuildOptions(profile_hook=lambda *args: calls.append(args)))
+
+    counts = {}
+    for res in resources:
+        counts[type(res).__name__] = counts.get(type(res).__name__, 0) + 1
+    for T, count in counts.items():
+        stages = profile.stats[T]
+        assert stages['dumps'][1] == count and stages['write'][1] == count
+        assert stages['dumps'][2] == stages['write'][2] > 0
+        assert stages['find'][1] >= 0
+
+    report = profile.report()
+    assert report['total']['write']['calls'] == sum(stages['write'][1] for stages in profile.stats.values() if 'write' in stages)
+    assert report['types'][T]['dumps'] == dict(zip(['time', 'calls', 'bytes'], profile.stats[T]['dumps']))
+    assert json.loads(profile.to_json())['types'].keys() == profile.stats.keys()
+
+    # hook收到每一次add 合计与stats相同
+    hooked = {}
+    for T, stage, elapsed, count, size in calls:
+        stat = hooked.setdefault((T, stage), [0, 0])
+        stat[0] += count
+        stat[1] += size
+    assert hooked == {(T, stage): stat[1:] for T, stages in profile.stats.items() for stage, stat in stages.items()}
+
+    # 构建结束后恢复原来的find
+    assert Resource.__dict__['find'].__func__.__name__ == 'find'
+
+
+def test_no_profile(tmp_path):
+    assert write_all(str(tmp_path), generate(SyntheticScales['small']), BuildOptions()) is None
+
+
+def test_reuse_and_merge(tmp_path):
+    resources = generate(SyntheticScales['small'])
+    write_all(str(tmp_path), resources, BuildOptions(incremental=True))
+    profile = write_all(str(tmp_path), resources, BuildOptions(incremental=True, profile=True))
+    assert sum(stages.get('reuse', [0, 0])[1] for stages in profile.stats.values()) == len(resources)
+
+    merged = BuildProfile()
+    merged.merge(profile.stats)
+    merged.merge(profile.stats)
+    for T, stages in profile.stats.items():
+        for stage, (_, calls, size) in stages.items():
+            assert merged.stats[T][stage][1:] == [calls * 2, size * 2]
+
+
+def test_empty():
+    profile = BuildProfile()
+    assert profile.report() == {'types': {}, 'total': {}}
@@ -0,0 +1,95 @@
+import gc
+import json
+import pytest
+from lib.reader import ResourceDB, gc_paused
+from lib.writer import FileWriter
+
+
+def _write(path, records, **kwargs):
+    with FileWriter(path, **kwargs) as writer:
+        for id, (value, cache) in records.items():
+            writer.write(id, json.dumps(value), cache)
+
+
+RECORDS = {'R.%d' % i: ({'i': i}, 0) for i in range(5)}
+RECORDS['P.0'] = ({'pinned': True}, 1)
+
+
+def test_lru(tmp_path):
+    _write(str(tmp_path), RECORDS)
+    with ResourceDB(str(tmp_path), capacity=2) as db:
+        a = db.get('R.0')
+        db.get('R.1')
+        assert db.get('R.0') is a
+        db.get('R.2')
+        # R.1最久未使用 被淘汰
+        assert db.stats()['cached'] == 2 and db.evictions == 1
+        assert db.get('R.0') is a
+        assert db.get('R.1') is not None
+        assert db.hits == 2 and db.misses == 4 and db.evictions == 2
+
+
+def test_pinned(tmp_path):
+    _write(str(tmp_path), RECORDS)
+    with ResourceDB(str(tmp_path), capacity=1) as db:
+        pinned = db.get('P.0')
+        for i in range(5):
+            db.get('R.%d' % i)
+        assert db.get('P.0') is pinned
+        stats = db.stats()
+        assert stats['pinned'] == 1 and stats['cached'] == 1 and stats['evictions'] == 4
+
+
+def test_no_cache(tmp_path):
+    _write(str(tmp_path), RECORDS)
+    with ResourceDB(str(tmp_path), capacity=0) as db:
+        assert db.get('R.0') == db.get('R.0')
+        assert db.misses == 2 and db.stats()['cached'] == 0
+
+
+def test_errors(tmp_path):
+    _write(str(tmp_path), RECORDS)
+    with pytest.raises(Exception, match='capacity'):
+        ResourceDB(str(tmp_path), capacity=-1)
+
+    db = ResourceDB(str(tmp_path))
+    with pytest.raises(Exception, match='R.9 not found'):
+        db.get('R.9')
+    with pytest.raises(Exception, match='R.9 not found'):
+        db.raw('R.9')
+    db.close()
+    db.close()
+    with pytest.raises(Exception, match='Already closed'):
+        db.get('R.0')
+    with pytest.raises(Exception, match='Already closed'):
+        db.decode_all()
+
+
+@pytest.mark.parametrize('options', [{}, {'index': 'binary'}, {'compression': 'zlib', 'block_size': 32}])
+def test_decode_all(tmp_path, options):
+    _write(str(tmp_path), RECORDS, **options)
+    with ResourceDB(str(tmp_path), capacity=0) as db:
+        decoded = db.decode_all()
+        assert [*decoded] == [*RECORDS]
+        assert decoded == {id: db.get(id) for id in RECORDS}
+        assert [(id, json.loads(raw), cache) for id, raw, cache in db.records()] == \
+            [(id, value, cache) for id, (value, cache) in RECORDS.items()]
+        assert db.raw('R.3') == b'{"i": 3}'
+
+
+def test_gc_paused_nests(tmp_path):
+    _write(str(tmp_path), RECORDS)
+    assert gc.isenabled()
+    with ResourceDB(str(tmp_path)) as db, gc_paused():
+        db.decode_all()
+        # 内层的解析不会提前恢复GC
+        assert not gc.isenabled()
+    assert gc.isenabled()
+
+
+@pytest.mark.parametrize('options', [{}, {'index': 'binary'}, {'compression': 'zlib'}])
+def test_empty(tmp_path, options):
+    _write(str(tmp_path), {}, **options)
+    with ResourceDB(str(tmp_path)) as db:
+        assert len(db) == 0 and [*db.ids()] == [] and [*db.records()] == []
+        assert db.decode_all() == {}
@@ -0,0 +1,78 @@
+import tempfile
+import pytest
+from lib.base import *
+from lib.attribute import Attribute
+from lib.entry import Entry, EntryType
+from lib.accessory import *
+from lib.reader import ResourceDB
+from lib.sampler import AccessorySampler, PoolSampler, alias_table, make_rng
+
+
+ATK, DEF = get_args(Attribute)[:2]
+
+
+def _pools():
+    RandomAttributes('RandomAttributes.A', max_level=2, values=[
+        RandomAttribute(0, ATK, [1.0, 2.0], weight=3),
+        RandomAttribute(1, DEF, [5.0, 6.0], weight=1),
+    ])
+    Entry('Entry.E', type=get_args(EntryType)[0], max_piece=1, name='e', rare='Rare1', icon='e')
+    RandomEntries('RandomEntries.B', max_level=2, values=[RandomEntry(7, 'Entry.E', [[1, 0], [1, 1]])])
+
+
+def _accessory(id, random_values):
+    return Accessory(id, max_level=2, values={ATK: [1.0, 2.0]}, random_values=random_values,
+                     name=id, rare='Rare1', icon='a')
+
+
+def test_alias_table_reconstructs_weights():
+    weights = [5, 1, 0, 2, 8]
+    prob, alias = alias_table(weights)
+    n = len(weights)
+    mass = [0.0] * n
+    for k in range(n):
+        mass[k] += prob[k] / n
+        mass[alias[k]] += (1 - prob[k]) / n
+    for k, w in enumerate(weights):
+        assert mass[k] == pytest.approx(w / sum(weights))
+
+
+@pytest.mark.parametrize('weights', [[], [0, 0]])
+def test_alias_table_rejects_empty(weights):
+    with pytest.raises(Exception):
+        alias_table(weights)
+
+
+def test_roll_is_deterministic_and_weighted():
+    pool = PoolSampler('P', [0, 1], [[1.0], [2.0]], *alias_table([3, 1]))
+    first = pool.roll(4000, 0, make_rng(1))
+    second = pool.roll(4000, 0, make_rng(1))
+    assert list(first['random_id']) == list(second['random_id'])
+    share = list(first['random_id']).count(0) / 4000
+    assert 0.7 < share < 0.8
+
+
+@pytest.mark.parametrize('random_values', [
+    ['RandomAttributes.A'],
+    ['RandomEntries.B'],
+    [],
+    ['RandomAttributes.A', 'RandomEntries.B'],
+    ['RandomEntries.B', 'RandomAttributes.A'],
+])
+def test_from_db(random_values):
+    _pools()
+    _accessory('Accessory.X', random_values)
+    path = tempfile.mkdtemp()
+    Resource.write_all(path)
+
+    with ResourceDB(path) as db:
+        sampler = AccessorySampler.from_db(db, 'Accessory.X')
+    # 两种构建方式都是先随机属性后随机词条
+    order = [id for id in ['RandomAttributes.A', 'RandomEntries.B'] if id in random_values]
+    assert [pool.pool_id for pool in sampler.pools] == order
+
+    expected = AccessorySampler.from_accessory(Resource.find('Accessory.X'))
+    assert [pool.pool_id for pool in expected.pools] == order
+    assert list(sampler.roll(10, 1, seed=3)) == list(expected.roll(10, 1, seed=3))
+    for id, rolled in sampler.roll(10, 1, seed=3).items():
+        assert list(rolled['random_id']) == list(expected.roll(10, 1, seed=3)[id]['random_id'])
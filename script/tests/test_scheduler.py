@@ -0,0 +1,103 @@
+import random
+import pytest
+from lib.scheduler import TickScheduler
+from lib.script import TickScript
+
+
+def _script(delay=0, interval=1, times=1):
+    return TickScript(script='pass', delay=delay, interval=interval, times=times)
+
+
+def _expected(start, delay, interval, times, until):
+    # 直接按语义展开每次触发的tick
+    first = start + 1 + delay
+    if interval == 0:
+        return [first] * times
+    ticks = []
+    due = first
+    while due <= until and (times == 0 or len(ticks) < times):
+        ticks.append(due)
+        due += interval
+    return ticks
+
+
+@pytest.mark.parametrize('start', [0, 200, 65536 - 40, (1 << 24) - 40, (1 << 32) - 40])
+def test_matches_reference(start):
+    rng = random.Random(start)
+    scheduler = TickScheduler(now=start)
+    ticks = 700
+    expected = {}
+    for k in range(200):
+        interval = rng.choice([0, 1, 2, 7, 255, 256, 300])
+        times = rng.randint(1, 4) if interval == 0 else rng.randint(0, 5)
+        delay = rng.choice([0, 1, 40, 255, 256, 257, rng.randint(0, 600)])
+        scheduler.schedule(_script(delay, interval, times), owner=k)
+        expected[k] = _expected(start, delay, interval, times, start + ticks)
+
+    actual = {k: [] for k in expected}
+    for now, fired in scheduler.advance(ticks):
+        for timer in fired:
+            actual[timer.owner].append(now)
+
+    assert actual == expected
+    assert scheduler.now == start + ticks
+    assert scheduler.metrics().total_fired == sum(len(v) for v in expected.values())
+
+
+def test_overflow():
+    # 到期时间与now在第32位以上不同时放在overflow中 第3层转完一圈后重新分配
+    start = (1 << 32) - 40
+    scheduler = TickScheduler(now=start)
+    timer = scheduler.schedule(_script(delay=100, interval=300, times=2))
+    assert scheduler._overflow == [timer]
+    fired = [now for now, timers in scheduler.advance(500) if timers]
+    assert fired == [start + 101, start + 401]
+    assert scheduler.metrics().cascaded > 0
+
+
+def test_pending_and_cancel():
+    scheduler = TickScheduler()
+    assert scheduler.tick() == [] and scheduler.pending == 0
+
+    once = scheduler.schedule(_script())
+    forever = scheduler.schedule(_script(interval=2, times=0), owner='a')
+    other = scheduler.schedule(_script(delay=5), owner='a')
+    assert scheduler.pending == 3
+
+    assert scheduler.tick() == [once, forever]
+    assert scheduler.pending == 2 and not once.active
+    assert scheduler.cancel(once) is False
+
+    assert scheduler.cancel_owner('a') == 2
+    assert scheduler.pending == 0 and scheduler.cancel(forever) is False
+    assert [timers for _, timers in scheduler.advance(20) if timers] == []
+    assert forever.fired == 1 and other.fired == 0
+
+
+def test_zero_interval_fires_in_one_tick():
+    scheduler = TickScheduler()
+    timer = scheduler.schedule(_script(delay=2, interval=0, times=3))
+    assert [len(fired) for _, fired in scheduler.advance(4)] == [0, 0, 3, 0]
+    assert timer.fired == 3 and scheduler.pending == 0
+
+
+def test_records_and_validation():
+    scheduler = TickScheduler()
+    record = {'T': 'TickScript', 'script': 0, 'delay': 0, 'interval': 1, 'times': 2}
+    timer = scheduler.schedule(record)
+    assert scheduler.tick() == [timer] and scheduler.tick() == [timer]
+
+    for bad, message in [
+        ({'T': 'HitScript'}, 'must be a TickScript'),
+        (_script(delay=-1), 'not less than 0'),
+        (_script(interval=0, times=0), 'interval 0 requires times'),
+        ({**record, 'times': 1.5}, 'must be int'),
+    ]:
+        with pytest.raises(Exception, match=message):
+            scheduler.schedule(bad)
+
+    # 任何一个有误时都不注册
+    with pytest.raises(Exception):
+        scheduler.schedule_many([(_script(), 1), (_script(delay=-1), 2)])
+    assert scheduler.pending == 0
+    assert scheduler.schedule_many([]) == []
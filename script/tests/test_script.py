@@ -0,0 +1,119 @@
+import os
+import stat
+import tempfile
+import pytest
+import lib.build
+from lib.base import *
+from lib.attribute import Attribute
+from lib.build import SCRIPT_CACHE_DIR, BuildOptions, write_all
+from lib.equipment import Equipment, EquipmentType
+from lib.script import BuildScript, HitScript, TickScript, compile_script, load_scripts, script_hash
+from lib.shard import open_db
+
+
+ATK = get_args(Attribute)[0]
+
+
+@pytest.fixture(autouse=True)
+def cache(tmp_path, monkeypatch):
+    # 不使用真实的用户缓存目录
+    cache = str(tmp_path / 'user-cache' / 'tp-scripts')
+    monkeypatch.setattr(lib.build, 'SCRIPT_CACHE_DIR', cache)
+    return cache
+
+
+def _equipment(id, scripts):
+    return Equipment(id, type=get_args(EquipmentType)[0], level=[0, 1], parents={},
+                     materials=[{}], values={ATK: [1.0]}, scripts=scripts,
+                     name=id, rare='Rare1', icon='e', sub_icon='s')
+
+
+def _write(path, **options):
+    os.makedirs(path, exist_ok=True)
+    write_all(path, Resource.all(), BuildOptions(**options))
+
+
+def _read(path):
+    with open_db(path, capacity=0) as db:
+        return {id: db.get(id) for id in db.ids()}
+
+
+def test_equipment_scripts_use_the_table(tmp_path):
+    _equipment('Equipment.A', [BuildScript(script='x = 1'), HitScript(script='y = 2')])
+    _equipment('Equipment.B', [TickScript(script='x = 1', times=3)])
+    _equipment('Equipment.C', [])
+    cache = str(tmp_path / 'cache')
+    _write(str(tmp_path / 'db'), script_table=True, script_cache=cache)
+
+    db = _read(str(tmp_path / 'db'))
+    table = db['@scripts']
+    assert table['script'] == ['x = 1', 'y = 2']
+    assert table['hash'] == [script_hash('x = 1'), script_hash('y = 2')]
+    assert db['Equipment.A']['scripts'] == [{'T': 'BuildScript', 'script': 0}, {'T': 'HitScript', 'script': 1}]
+    assert db['Equipment.B']['scripts'] == [{'T': 'TickScript', 'script': 0, 'delay': 0, 'interval': 1, 'times': 3}]
+    assert 'scripts' not in db['Equipment.C']
+
+    codes = load_scripts(table, cache)
+    scope = {}
+    exec(codes[db['Equipment.A']['scripts'][1]['script']], scope)
+    assert scope['y'] == 2
+
+
+def test_equipment_scripts_inline_without_table(tmp_path):
+    _equipment('Equipment.A', [BuildScript(script='x = 1')])
+    _write(str(tmp_path / 'db'))
+
+    db = _read(str(tmp_path / 'db'))
+    assert '@scripts' not in db
+    assert db['Equipment.A']['scripts'] == [{'T': 'BuildScript', 'script': 'x = 1'}]
+
+
+def test_script_cache_is_outside_the_output(tmp_path, cache):
+    _equipment('Equipment.A', [BuildScript(script='x = 3')])
+    path = str(tmp_path / 'db')
+    _write(path, script_table=True)
+
+    assert all(not os.path.isdir(os.path.join(path, name)) for name in os.listdir(path))
+    assert os.path.exists(os.path.join(cache, script_hash('x = 3') + '.pyc'))
+    # 默认的缓存目录属于当前用户 不在共享的临时目录下
+    assert os.path.commonpath([tempfile.gettempdir(), SCRIPT_CACHE_DIR]) != tempfile.gettempdir()
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='posix permissions')
+def test_script_cache_permissions(tmp_path, cache):
+    compile_script('x = 1', 'w', cache)
+    assert stat.S_IMODE(os.stat(cache).st_mode) & 0o077 == 0
+
+    shared = str(tmp_path / 'shared')
+    os.makedirs(shared)
+    os.chmod(shared, 0o777)
+    with pytest.raises(Exception, match='w => script cache .* is writable by other users'):
+        compile_script('x = 1', 'w', shared)
+
+
+@pytest.mark.skipif(os.name != 'posix' or os.getuid() != 0, reason='chown requires root')
+def test_script_cache_owner(tmp_path):
+    other = str(tmp_path / 'other')
+    os.makedirs(other, mode=0o700)
+    os.chown(other, os.getuid() + 1, -1)
+    with pytest.raises(Exception, match='not owned by the current user'):
+        compile_script('x = 1', 'w', other)
+
+    # 缓存目录中不属于当前用户的文件不使用
+    mine = str(tmp_path / 'mine')
+    compile_script('x = 1', 'w', mine)
+    p_cache = os.path.join(mine, script_hash('x = 2') + '.pyc')
+    with open(os.path.join(mine, script_hash('x = 1') + '.pyc'), 'rb') as handle:
+        planted = handle.read()
+    with open(p_cache, 'wb') as handle:
+        handle.write(planted)
+    os.chown(p_cache, os.getuid() + 1, -1)
+    scope = {}
+    exec(compile_script('x = 2', 'w', mine), scope)
+    assert scope['x'] == 2
+
+
+def test_invalid_script(tmp_path):
+    _equipment('Equipment.A', [BuildScript(script='x = ')])
+    with pytest.raises(Exception, match=r'Equipment\.A\.scripts\[0\]\.script => invalid script'):
+        _write(str(tmp_path / 'db'), script_table=True)
@@ -0,0 +1,120 @@
+import json
+import os
+import pytest
+from lib.build import BuildOptions, write_all
+from lib.index import id_hash
+from lib.reader import ResourceDB
+from lib.shard import *
+from lib.synthetic import SyntheticScales, generate
+
+
+def _records(T, n, size=40):
+    return [('%s.%d' % (T, i), json.dumps({'i': i, 'pad': 'x' * size}), 0) for i in range(n)]
+
+
+def _write(path, records, **kwargs):
+    with ShardedWriter(path, **kwargs) as writer:
+        writer.write_many(records)
+
+
+def _files(path):
+    return sorted(name for name in os.listdir(path) if name.startswith('db'))
+
+
+def test_record_type_and_segment():
+    assert record_type('Equipment.A.b') == 'Equipment'
+    assert record_type('@pool') == '@' and record_type('@material_prefix.Equipment.A') == '@'
+    assert segment_of('A.1', ['db.A']) == 'db.A'
+
+    segments = ['db.A.%d' % k for k in range(4)]
+    ids = ['A.%d' % i for i in range(400)]
+    assert {segment_of(id, segments) for id in ids} == set(segments)
+    for id in ids:
+        assert segment_of(id, segments) == segments[id_hash(id) * 4 >> 64]
+
+
+def test_split_by_size(tmp_path):
+    path = str(tmp_path)
+    records = [*_records('A', 200), *_records('B', 5), *_records('@x', 200)]
+    _write(path, records, shard_size=2000)
+
+    types = load_shards(path)
+    assert len(types['A']) > 1 and types['B'] == ['db.B'] and types['@'] == ['db.@']
+    # 每个段可以单独读取 且只包含属于它的ID
+    for name in types['A']:
+        with ResourceDB(path, name=name) as db:
+            assert all(segment_of(id, types['A']) == name for id in db.ids())
+
+    with open_db(path, capacity=0) as db:
+        assert isinstance(db, ShardedDB)
+        assert len(db) == len(records)
+        assert {id: db.raw(id) for id in db.ids()} == {id: data.encode() for id, data, _ in records}
+        assert db.decode_type('A') == {id: json.loads(data) for id, data, _ in records[:200]}
+        assert db.decode_type('Nope') == {}
+        decoded = db.decode_types(['A', 'B', 'Nope'])
+        assert decoded['A'] == db.decode_type('A') and len(decoded['B']) == 5 and decoded['Nope'] == {}
+        assert 'C.1' not in db
+        with pytest.raises(Exception, match='C.1 not found'):
+            db.get('C.1')
+
+
+def test_layout_changes_leave_no_stale_files(tmp_path):
+    path = str(tmp_path)
+    _write(path, _records('A', 200), shard_size=2000)
+    many = _files(path)
+    _write(path, _records('A', 200), shard_size=1 << 20)
+    assert _files(path) == ['db.A.tpd', 'db.A.tpi', 'db.tps'] and len(many) > 3
+
+    resources = generate(SyntheticScales['small'])
+    write_all(path, resources, BuildOptions())
+    assert _files(path) == ['db.tpd', 'db.tpi']
+    write_all(path, resources, BuildOptions(shards=True))
+    assert 'db.tpd' not in _files(path)
+    write_all(path, resources, BuildOptions())
+    assert _files(path) == ['db.tpd', 'db.tpi']
+
+
+@pytest.mark.parametrize('options', [
+    {'constant_pool': True},
+    {'compression': 'zlib', 'index': 'binary'},
+    {'shard_size': 4096},
+])
+def test_build_matches_single_file(tmp_path, options):
+    resources = generate(SyntheticScales['small'])
+    single, sharded = str(tmp_path / 'single'), str(tmp_path / 'sharded')
+    os.makedirs(single)
+    os.makedirs(sharded)
+    write_all(single, resources, BuildOptions(**options))
+    write_all(sharded, resources, BuildOptions(shards=True, **options))
+
+    with open_db(single, capacity=0) as a, open_db(sharded, capacity=0) as b:
+        assert isinstance(b, ShardedDB)
+        assert sorted(a.ids()) == sorted(b.ids())
+        assert {id: a.get(id) for id in a.ids()} == {id: b.get(id) for id in b.ids()}
+
+
+def test_empty_and_errors(tmp_path):
+    path = str(tmp_path)
+    _write(path, [])
+    assert load_shards(path) == {}
+    with open_db(path) as db:
+        assert len(db) == 0 and [*db.ids()] == [] and db.decode_types(['A']) == {'A': {}}
+
+    with pytest.raises(Exception, match='shard_size'):
+        ShardedWriter(path, shard_size=0)
+    with pytest.raises(Exception, match='Unknown index format'):
+        ShardedWriter(path, index='xml')
+
+    with pytest.raises(Exception, match='ID conflict: A.0'):
+        _write(path, [*_records('A', 3), *_records('A', 1)])
+    # 出错时清空输出 清单与段一致
+    assert load_shards(path) == {} and _files(path) == ['db.tps']
+
+    with open(os.path.join(path, SHARD_FILE), 'w') as handle:
+        json.dump({'version': 99, 'types': {}}, handle)
+    with pytest.raises(Exception, match='unsupported shard version 99'):
+        open_db(path)
+
+    os.remove(os.path.join(path, SHARD_FILE))
+    with pytest.raises(Exception, match='not a sharded db'):
+        ShardedDB(path)
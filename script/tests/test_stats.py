@@ -0,0 +1,64 @@
+import pytest
+from lib.synthetic import SyntheticScale, SyntheticScales, generate
+
+numpy = pytest.importorskip('numpy')
+
+from lib.stats import Loadout, StatCalculator
+
+
+def _loadouts(resources, n):
+    equipments = [res for res in resources if res.res_id.startswith('Equipment.')]
+    accessories = [res for res in resources if res.res_id.startswith('Accessory.')]
+    loadouts = []
+    for i in range(n):
+        equipment = equipments[i % len(equipments)]
+        accessory = accessories[i % len(accessories)]
+        loadouts.append(Loadout(
+            equipment.res_id,
+            equipment.level[0] + i % (equipment.level[1] - equipment.level[0]),
+            [(accessory.res_id, i % accessory.max_level)],
+        ))
+    return loadouts
+
+
+def test_batch_matches_single():
+    resources = generate(SyntheticScales['small'])
+    calc = StatCalculator()
+    loadouts = _loadouts(resources, 7)
+    loadouts[0].entries = {next(iter(calc.entry_index)): (3, 2)}
+
+    batch = calc.compute(loadouts)
+    assert batch.shape == (7, len(calc.names))
+    for i, loadout in enumerate(loadouts):
+        numpy.testing.assert_allclose(batch[i], calc.compute([loadout])[0])
+
+
+def test_no_entries():
+    scale = SyntheticScales['small']
+    resources = generate(SyntheticScale(**{**scale.__dict__, 'entries': 0, 'equipment_entries': 0}))
+    calc = StatCalculator()
+    assert not calc.entry_index
+
+    loadouts = _loadouts(resources, 3)
+    totals = calc.totals(loadouts)
+    assert totals.shape == (3, len(calc.attributes))
+    for i, loadout in enumerate(loadouts):
+        expected, _, _ = calc.item('equipment', loadout.equipment, loadout.level)
+        for id, level in loadout.accessories:
+            expected = expected + calc.item('accessory', id, level)[0]
+        numpy.testing.assert_allclose(totals[i], expected)
+
+
+def test_empty_batch():
+    generate(SyntheticScales['small'])
+    calc = StatCalculator()
+    assert calc.compute([]).shape == (0, len(calc.names))
+
+
+def test_level_out_of_range():
+    resources = generate(SyntheticScales['small'])
+    calc = StatCalculator()
+    loadout = _loadouts(resources, 1)[0]
+    loadout.level = 10 ** 6
+    with pytest.raises(Exception, match='out of range'):
+        calc.compute([loadout])
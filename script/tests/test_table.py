@@ -0,0 +1,81 @@
+from array import array
+import base64
+import math
+import pytest
+from lib.base import *
+from lib.table import *
+from lib.table import _HEADER
+
+
+def _dtype(blob):
+    return _HEADER.unpack_from(base64.b64decode(blob), 0)[3]
+
+
+def test_pick_dtype():
+    assert pick_dtype([]) == DTYPE_U16
+    assert pick_dtype([0, 65535, 3.0]) == DTYPE_U16
+    assert pick_dtype([-1, 0.5]) == DTYPE_F32
+    assert pick_dtype([0.1]) == DTYPE_F64
+    assert pick_dtype([1e300]) == DTYPE_F64
+
+
+@pytest.mark.parametrize('table, y', [
+    ({'a': [1, 2, 3], 'b': [4, 5, 6]}, 3),
+    ({'a': [0.5, -1.25], 'b': [2.0, 3.0]}, 2),
+    ({'a': [0.1, 1e10]}, 2),
+    ({'a': [], 'b': []}, 0),
+    ({'E.1': [[1, 0], [2, 3]], 'E.2': [[0, 0], [7, 14]]}, 2),
+])
+def test_round_trip(table, y):
+    packed = pack_table(table, y)
+    assert packed['x'] == len(table) and packed['k'] == [*table]
+    assert unpack_table(packed) == {'x': len(table), 'y': y, 't': table}
+
+
+def test_buff_table():
+    table = {'Buff.A': [{'p': 1.5}, {}, {'p': 2.0, 'q': 3.0}], 'Buff.B': [{}, {}, {}]}
+    packed = pack_table(table, 3)
+    assert packed['a'] == [['p', 'q'], []]
+    assert unpack_table(packed)['t'] == table
+
+
+def test_arrays_are_copied_directly():
+    columns = [array('H', [1, 2]), array('H', [3, 4])]
+    blob = pack_columns(columns, 2)
+    assert _dtype(blob) == DTYPE_U16
+    assert unpack_columns(blob) == (2, 2, 1, [[1, 2], [3, 4]])
+
+    columns = [array('f', [0.5, 1.5])]
+    assert unpack_columns(pack_columns(columns, 2))[3] == [[0.5, 1.5]]
+
+    # 不支持直接拷贝的类型按值选择dtype
+    blob = pack_columns([array('i', [1, 70000])], 2)
+    assert _dtype(blob) == DTYPE_F32 and unpack_columns(blob)[3] == [[1, 70000]]
+
+
+def test_numpy_columns():
+    numpy = pytest.importorskip('numpy')
+    columns = [numpy.asarray([1.0, 2.0]), numpy.asarray([3.0, 4.0], dtype='>f8')]
+    assert unpack_columns(pack_columns(columns, 2))[3] == [[1.0, 2.0], [3.0, 4.0]]
+
+
+def test_size_mismatch():
+    with pytest.raises(Exception, match='Packed table size must equal to 2\\*3\\*1'):
+        pack_columns([[1, 2, 3], [1, 2]], 3)
+    with pytest.raises(Exception, match='Packed table size'):
+        pack_columns([array('H', [1, 2, 3]), array('H', [1, 2])], 3)
+
+
+def test_dict_table():
+    assert dict_table({}, 3) is None
+    with use_output_options(OutputOptions(packed_tables=True)):
+        assert dict_table({}, 3) is None
+        packed = dict_table({'a': [1, 2]}, 2)
+        assert 'p' in packed and 't' not in packed
+    assert dict_table({'a': [1, 2]}, 2) == {'x': 1, 'y': 2, 't': {'a': [1, 2]}}
+
+
+def test_nan_column():
+    blob = pack_columns([[math.nan, 1.0]], 2)
+    values = unpack_columns(blob)[3][0]
+    assert math.isnan(values[0]) and values[1] == 1.0
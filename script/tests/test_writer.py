@@ -0,0 +1,91 @@
+import json
+import os
+import pytest
+import lib.writer
+from lib.reader import ResourceDB
+from lib.writer import FileWriter
+
+
+def _records(n, start=0):
+    return [('R.%d' % i, json.dumps({'i': i, 'pad': 'x' * (i % 7)}), i % 3) for i in range(start, start + n)]
+
+
+def _read(path):
+    with ResourceDB(path, capacity=0) as db:
+        return {id: db.get(id) for id in db.ids()}
+
+
+def _raising(records, after):
+    yield from records[:after]
+    raise RuntimeError('source failed')
+
+
+@pytest.mark.parametrize('vectored', [False, True])
+def test_write_many(tmp_path, monkeypatch, vectored):
+    monkeypatch.setattr(lib.writer, 'WRITE_BUFFER', 64)
+    records = _records(50)
+    with FileWriter(str(tmp_path)) as writer:
+        writer.write('A', '{"a":1}', 0)
+        writer.write_many(records[:20], preallocate=1 << 16, vectored=vectored)
+        writer.write_many(records[20:], vectored=vectored)
+        writer.write('B', '{"b":2}', 0)
+
+    db = _read(str(tmp_path))
+    assert db == {'A': {'a': 1}, 'B': {'b': 2}, **{id: json.loads(data) for id, data, _ in records}}
+    # 预分配的空间已截断
+    assert os.path.getsize(tmp_path / 'db.tpd') == sum(len(data) + 1 for data in ['{"a":1}', '{"b":2}', *(r[1] for r in records)])
+
+
+def test_write_many_empty(tmp_path):
+    with FileWriter(str(tmp_path)) as writer:
+        writer.write_many([])
+        writer.write_many([], preallocate=4096)
+    assert _read(str(tmp_path)) == {}
+    assert os.path.getsize(tmp_path / 'db.tpd') == 0
+
+
+@pytest.mark.parametrize('after', [0, 3, 30])
+def test_source_error_drops_buffered_records(tmp_path, monkeypatch, after):
+    monkeypatch.setattr(lib.writer, 'WRITE_BUFFER', 64)
+    records = _records(40)
+    with FileWriter(str(tmp_path)) as writer:
+        with pytest.raises(RuntimeError):
+            writer.write_many(_raising(records, after))
+        written = len(writer._index)
+        assert written <= after
+        writer.write('Z', '{"z":0}', 0)
+
+    db = _read(str(tmp_path))
+    assert len(db) == written + 1 and db['Z'] == {'z': 0}
+    for id, data, _ in records[:written]:
+        assert db[id] == json.loads(data)
+
+
+def test_id_conflict(tmp_path):
+    with FileWriter(str(tmp_path)) as writer:
+        writer.write('R.1', '{}', 0)
+        with pytest.raises(Exception, match='ID conflict: R.1'):
+            writer.write_many(_records(3))
+        writer.write('R.9', '{"i":9}', 0)
+    assert _read(str(tmp_path)) == {'R.1': {}, 'R.9': {'i': 9}}
+
+
+def test_failed_flush_is_not_retried(tmp_path, monkeypatch):
+    calls = []
+
+    def failing(fd, data):
+        calls.append(len(data))
+        os.write(fd, data[:5])
+        raise OSError('disk full')
+
+    monkeypatch.setattr(lib.writer, '_write', failing)
+    with FileWriter(str(tmp_path)) as writer:
+        writer.write('A', '{"a":1}', 0)
+        with pytest.raises(OSError):
+            writer.write_many(_records(5))
+        monkeypatch.undo()
+        writer.write('B', '{"b":2}', 0)
+
+    assert len(calls) == 1
+    assert _read(str(tmp_path)) == {'A': {'a': 1}, 'B': {'b': 2}}
+    assert os.path.getsize(tmp_path / 'db.tpd') == 16